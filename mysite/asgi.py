@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# потоки живых итогов (polls/live.py) обслуживаются в обход обработчика Django
+from polls.live import LiveResultsApp  # noqa: E402
+
+application = LiveResultsApp(django_application)
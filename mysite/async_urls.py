@@ -0,0 +1,12 @@
+"""URLconf для запросов через ASGI: polls подключается с асинхронными представлениями"""
+from django.urls import include, path
+
+import polls.urls
+
+from . import urls
+
+
+urlpatterns = [
+    path('polls/', include('polls.async_urls')),
+    *(pattern for pattern in urls.urlpatterns if getattr(pattern, 'urlconf_name', None) is not polls.urls),
+]
@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.metrics.RequestMetricsMiddleware',
+    'polls.async_views.AsyncViewsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,3 +139,125 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Голосование: число шардов счетчика голосов одного варианта ответа
+POLLS_VOTE_COUNTER_SHARDS = 8
+
+# Буферизованная запись голосов (см. polls/vote_buffer.py).
+# У каждого процесса-воркера должен быть свой JOURNAL_PATH.
+POLLS_VOTE_BUFFER = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL_MS': 200,
+    'FLUSH_MAX_VOTES': 500,
+    'JOURNAL_PATH': os.path.join(BASE_DIR, 'var', 'vote_journal.log'),
+}
+
+# Время жизни кэшированного снимка результатов опроса, секунды
+POLLS_RESULTS_SNAPSHOT_TTL = 60 * 60
+
+# Накопление изменений likes_count в памяти процесса (см. polls/likes.py)
+POLLS_LIKE_COALESCING = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL_MS': 1000,
+}
+
+# Время жизни закэшированной карточки поста, секунды
+POLLS_POST_CARD_TTL = 24 * 60 * 60
+
+# Верхняя граница времени жизни кэша активных опросов, секунды
+POLLS_ACTIVE_QUESTIONS_MAX_TTL = 24 * 60 * 60
+
+# Метрики запросов (см. polls/metrics.py). /metrics доступен сотрудникам и
+# сборщику с заголовком Authorization: Bearer <TOKEN>. Журнал медленных
+# запросов включается числом секунд в SLOW_REQUEST_SECONDS.
+POLLS_METRICS = {
+    'ENABLED': True,
+    'TOKEN': os.environ.get('POLLS_METRICS_TOKEN'),
+    'SLOW_REQUEST_SECONDS': None,
+}
+
+# Сессии читаются из кэша, в БД — только при промахе и записи
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Пользователь сессии кэшируется (см. polls/auth_backends.py). ModelBackend
+# оставлен для сессий, созданных до перехода на кэширующий бэкенд.
+AUTHENTICATION_BACKENDS = [
+    'polls.auth_backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Время жизни закэшированного пользователя сессии, секунды
+POLLS_AUTH_USER_CACHE_TTL = 5 * 60
+
+# Рендиции загруженных изображений (см. polls/images.py)
+POLLS_IMAGE_RENDITIONS = {
+    'WORKERS': 2,
+    'WEBP_QUALITY': 80,
+    'JPEG_QUALITY': 82,
+}
+
+# Загрузки хранятся с адресацией по содержимому (см. polls/storage.py),
+# рендиции — под именами, производными от оригинала
+STORAGES = {
+    'default': {'BACKEND': 'polls.storage.ContentAddressedStorage'},
+    'renditions': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Через сколько секунд файл без ссылок может быть удален сборщиком collect_media
+POLLS_MEDIA_ORPHAN_GRACE = 60 * 60
+
+# Ограничения загружаемых изображений (см. polls/uploads.py)
+POLLS_IMAGE_UPLOADS = {
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'MAX_PIXELS': 40_000_000,
+    'MAX_SIDE': 10_000,
+    'FORMATS': ['JPEG', 'PNG', 'WEBP', 'GIF'],
+}
+
+# Общий для всех процессов кэш: сессии, пользователи сессий, версии ключей
+# и метки буфера голосов. Без REDIS_URL — кэш в памяти процесса для
+# разработки и тестов; вне DEBUG с ним приложение не стартует (см. polls/cache.py)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {'BACKEND': 'polls.cache.LocMemCache'},
+    }
+
+# Под ASGI отдавать главную, вопрос, итоги, ленту и профиль асинхронными
+# представлениями (см. polls/async_views.py). Выключено: на текущем стенде
+# (manage.py bench_asgi) ASGI медленнее WSGI на всех пяти маршрутах.
+POLLS_ASYNC_VIEWS = False
+
+# Живые итоги опросов через server-sent events (см. polls/live.py)
+POLLS_LIVE_RESULTS = {
+    'INTERVAL': 1.0,
+    'HEARTBEAT': 15,
+    'RETRY_MS': 3000,
+}
+
+# Время жизни кэшированного индекса голосов пользователя, секунды (см. polls/voted.py)
+POLLS_VOTED_INDEX_TTL = 60 * 60
+
+# Архив итогов закрытых опросов (см. polls/archive.py, команда close_expired_polls)
+POLLS_ARCHIVE = {
+    'GRACE': 5 * 60,
+    'BATCH_SIZE': 1000,
+}
+
+# Фоновое удаление аккаунтов (см. polls/account_deletion.py). Удаляемый
+# аккаунт сразу скрывается из профилей и ленты, а его строки пачками удаляет
+# команда process_account_deletions; поток в веб-воркерах выключен, поэтому
+# команду нужно запускать по расписанию, например в crontab:
+#   */5 * * * * cd /srv/mysite && python manage.py process_account_deletions
+POLLS_ACCOUNT_DELETION = {
+    'BACKGROUND': False,
+    'INTERVAL': 60,
+    'BATCH_SIZE': 500,
+}
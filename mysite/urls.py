@@ -1,9 +1,11 @@
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.views.generic import RedirectView
 from django.conf import settings
 from django.conf.urls.static import static
 
+from polls.media import serve_media
+
 urlpatterns = [
     path('polls/', include('polls.urls')),
     path('admin/', admin.site.urls),
@@ -11,5 +13,14 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+    # медиафайлы с заголовками кэширования только для разработки. В продакшене
+    # их отдает веб-сервер с теми же заголовками, например в nginx:
+    #   location /media/ { alias <MEDIA_ROOT>/; }
+    #   location ~ "^/media/(.*[0-9a-f]{2}/[0-9a-f]{64}\.[0-9a-z]+)$" {
+    #       alias <MEDIA_ROOT>/$1;
+    #       add_header Cache-Control "public, max-age=31536000, immutable";
+    #   }
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media),
+    ]
\ No newline at end of file
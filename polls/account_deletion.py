@@ -0,0 +1,209 @@
+"""Фоновое удаление аккаунтов.
+
+delete_profile не удаляет пользователя в самом запросе. Каскад по голосам,
+лайкам, комментариям, постам и вопросам активного пользователя — это
+тысячи строк в одной транзакции, и при каскаде счетчики Choice.votes,
+likes_count и comments_count не уменьшаются. Поэтому аккаунт сразу
+деактивируется: его сессии перестают аутентифицироваться. Затем создается
+AccountDeletion, а строки пользователя удаляются пачками по BATCH_SIZE.
+Каждая пачка — короткая транзакция, в ней же суммарно на вариант или пост
+уменьшаются счетчики.
+
+Пачки выполняет команда process_account_deletions, ее запускают по cron;
+она же доделывает удаления, прерванные падением процесса. Фоновый поток
+в каждом веб-воркере (BACKGROUND) по умолчанию выключен: он конкурирует с
+запросами за блокировку записи в SQLite.
+
+При буфере голосов (vote_buffer) голос, принятый до деактивации, может
+попасть в БД уже после шага удаления голосов, и каскад при удалении
+пользователя унес бы его без поправки Choice.votes. Поэтому такие
+заявки обрабатываются не раньше чем через PENDING_TTL буфера после
+запроса — к этому времени принятые голоса записаны.
+"""
+import datetime
+import threading
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .background import PeriodicFlusher
+from .models import AccountDeletion, Choice, MicroblogPost, PostComment, PostLike, Question, Vote
+from .results import apply_vote
+from .vote_buffer import buffer_settings, buffering_enabled
+
+
+DEFAULTS = {
+    # удалять еще и в фоновом потоке каждого процесса, а не только командой
+    'BACKGROUND': False,
+    # период фонового прохода, секунды
+    'INTERVAL': 60,
+    # строк за одну транзакцию
+    'BATCH_SIZE': 500,
+}
+
+
+def deletion_settings():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_ACCOUNT_DELETION', {})}
+
+
+_deleter = None
+_deleter_lock = threading.Lock()
+
+
+def get_deleter():
+    global _deleter
+    if _deleter is None:
+        with _deleter_lock:
+            if _deleter is None:
+                _deleter = PeriodicFlusher(
+                    'account-deletions', deletion_settings()['INTERVAL'], process_account_deletions,
+                )
+    return _deleter
+
+
+def _wake_deleter():
+    deleter = get_deleter()
+    deleter.start()
+    deleter.wake()
+
+
+def request_account_deletion(user):
+    """Деактивирует аккаунт и ставит его строки в очередь на удаление"""
+    with transaction.atomic():
+        user.is_active = False
+        # save, а не update: post_save сбрасывает пользователя в кэше аутентификации
+        user.save(update_fields=['is_active'])
+        AccountDeletion.objects.get_or_create(user=user)
+        if deletion_settings()['BACKGROUND']:
+            transaction.on_commit(_wake_deleter)
+
+
+def _delete_batch(queryset, batch_size, *fields):
+    """Удаляет пачку строк queryset обычным delete() по группам.
+
+    Возвращает {значения fields: число реально удаленных строк}. Счетчики
+    уменьшаются на число удаленных, а не выбранных строк, поэтому
+    параллельный обработчик того же аккаунта не вычтет голос дважды.
+    Сигналы моделей (сброс кэшей, учет ссылок на файлы) срабатывают как
+    при любом удалении; счетчики постов и вариантов сигналами не ведутся,
+    их поправляют шаги ниже.
+    """
+    groups = defaultdict(list)
+    for pk, *key in queryset.order_by('pk').values_list('pk', *fields)[:batch_size]:
+        groups[tuple(key)].append(pk)
+    deleted = {}
+    for key, pks in groups.items():
+        _, per_model = queryset.model.objects.filter(pk__in=pks).delete()
+        deleted[key] = per_model.get(queryset.model._meta.label, 0)
+    return deleted
+
+
+def _delete_votes(user_id, batch_size):
+    with transaction.atomic():
+        deleted = _delete_batch(Vote.objects.filter(user_id=user_id), batch_size, 'question_id', 'choice_id')
+        for (question_id, choice_id), amount in deleted.items():
+            # базу можно увести в минус: итог — база плюс шарды
+            Choice.objects.filter(pk=choice_id).update(votes=F('votes') - amount)
+            transaction.on_commit(partial(apply_vote, question_id, choice_id, -amount))
+    return deleted
+
+
+def _delete_likes(user_id, batch_size):
+    with transaction.atomic():
+        deleted = _delete_batch(PostLike.objects.filter(user_id=user_id), batch_size, 'post_id')
+        for (post_id,), amount in deleted.items():
+            MicroblogPost.objects.filter(pk=post_id).update(likes_count=F('likes_count') - amount)
+    return deleted
+
+
+def _delete_comments(user_id, batch_size):
+    with transaction.atomic():
+        deleted = _delete_batch(PostComment.objects.filter(author_id=user_id), batch_size, 'post_id')
+        for (post_id,), amount in deleted.items():
+            MicroblogPost.objects.filter(pk=post_id).update(comments_count=F('comments_count') - amount)
+    return deleted
+
+
+def _delete_post_likes(user_id, batch_size):
+    # лайки и комментарии чужих пользователей под постами аккаунта уходят
+    # вместе с постами, счетчики этих постов больше не нужны
+    return _delete_batch(PostLike.objects.filter(post__author_id=user_id), batch_size)
+
+
+def _delete_post_comments(user_id, batch_size):
+    return _delete_batch(PostComment.objects.filter(post__author_id=user_id), batch_size)
+
+
+def _delete_question_votes(user_id, batch_size):
+    # счетчики вариантов уходят вместе с вопросами, индексы голосов
+    # проголосовавших сбрасывает сигнал post_delete у Vote
+    return _delete_batch(Vote.objects.filter(question__author_id=user_id), batch_size)
+
+
+def _delete_objects(queryset, batch_size):
+    # обычный delete(): каскадом уходит то, что успело появиться после
+    # предыдущих шагов, и срабатывают сигналы моделей
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+    if ids:
+        queryset.model.objects.filter(pk__in=ids).delete()
+    return ids
+
+
+def _delete_posts(user_id, batch_size):
+    return _delete_objects(MicroblogPost.objects.filter(author_id=user_id), batch_size)
+
+
+def _delete_questions(user_id, batch_size):
+    # варианты, шарды и архив — каскадом; сигналы сбрасывают итоги и
+    # отпускают картинку вопроса
+    return _delete_objects(Question.objects.filter(author_id=user_id), batch_size)
+
+
+STEPS = (
+    _delete_votes,
+    _delete_likes,
+    _delete_comments,
+    _delete_post_likes,
+    _delete_post_comments,
+    _delete_posts,
+    _delete_question_votes,
+    _delete_questions,
+)
+
+
+def delete_account_step(user_id, batch_size):
+    """Одна пачка удаления; False, когда аккаунт удален полностью"""
+    for step in STEPS:
+        if step(user_id, batch_size):
+            return True
+    # остались профиль (его сигналы отпускают аватар) и сама заявка
+    for user in get_user_model().objects.filter(pk=user_id):
+        user.delete()
+    return False
+
+
+def settle_delay():
+    """Сколько ждать после запроса, пока в БД не попадут голоса из буфера"""
+    if not buffering_enabled():
+        return datetime.timedelta(0)
+    return datetime.timedelta(seconds=buffer_settings()['PENDING_TTL'])
+
+
+def process_account_deletions(batch_size=None):
+    """Доводит до конца все запрошенные удаления; возвращает число удаленных аккаунтов"""
+    batch_size = batch_size or deletion_settings()['BATCH_SIZE']
+    deleted = 0
+    pending = (
+        AccountDeletion.objects.filter(requested_at__lte=timezone.now() - settle_delay())
+        .order_by('requested_at').values_list('user_id', flat=True)
+    )
+    for user_id in list(pending):
+        while delete_account_step(user_id, batch_size):
+            pass
+        deleted += 1
+    return deleted
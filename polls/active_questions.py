@@ -0,0 +1,101 @@
+"""Кэш списка активных опросов для главной страницы.
+
+Список меняется только при изменении вопросов или когда наступает
+ближайшая граница — pub_date еще не опубликованного вопроса или
+expiration_date одного из активных. Поэтому запись кэша живет ровно до
+этой границы, а сохранение или удаление Question поднимает версию.
+"""
+import math
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .async_utils import aslist
+from .cache_versions import aget_version, bump_version, get_version
+from .models import Question
+
+
+VERSION_KEY = 'polls:active-questions:ver'
+LIST_KEY = 'polls:active-questions:v{version}'
+
+
+def max_ttl():
+    return getattr(settings, 'POLLS_ACTIVE_QUESTIONS_MAX_TTL', 24 * 60 * 60)
+
+
+def _active_queryset(now):
+    return Question.objects.filter(expiration_date__gt=now, pub_date__lte=now).order_by('-pub_date')
+
+
+def _next_publish_queryset(now):
+    return Question.objects.filter(pub_date__gt=now)
+
+
+def _cache_timeout(questions, next_publish, now):
+    """(valid_until, timeout): запись живет до ближайшей границы"""
+    boundaries = [question.expiration_date for question in questions]
+    if next_publish is not None:
+        boundaries.append(next_publish)
+    valid_until = min(boundaries, default=None)
+
+    timeout = max_ttl()
+    if valid_until is not None:
+        timeout = min(timeout, math.ceil((valid_until - now).total_seconds()))
+    return valid_until, timeout
+
+
+def _fresh(cached, now):
+    if cached is None:
+        return False
+    # таймаут кэша округляется до секунд — границу проверяем сами
+    valid_until = cached[1]
+    return valid_until is None or now < valid_until
+
+
+def get_active_questions():
+    """Опубликованные и не истекшие вопросы, новые первыми"""
+    now = timezone.now()
+    key = LIST_KEY.format(version=get_version(VERSION_KEY))
+
+    cached = cache.get(key)
+    if _fresh(cached, now):
+        return cached[0]
+
+    questions = list(_active_queryset(now))
+    next_publish = _next_publish_queryset(now).aggregate(next=Min('pub_date'))['next']
+    valid_until, timeout = _cache_timeout(questions, next_publish, now)
+    if timeout > 0:
+        cache.set(key, (questions, valid_until), timeout)
+    return questions
+
+
+async def aget_active_questions():
+    """Асинхронный вариант get_active_questions"""
+    now = timezone.now()
+    key = LIST_KEY.format(version=await aget_version(VERSION_KEY))
+
+    cached = await cache.aget(key)
+    if _fresh(cached, now):
+        return cached[0]
+
+    # запросы асинхронного ORM все равно идут по одному через общий поток
+    questions = await aslist(_active_queryset(now))
+    next_publish = await _next_publish_queryset(now).aaggregate(next=Min('pub_date'))
+    valid_until, timeout = _cache_timeout(questions, next_publish['next'], now)
+    if timeout > 0:
+        await cache.aset(key, (questions, valid_until), timeout)
+    return questions
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_active_questions(sender, **kwargs):
+    # после коммита: иначе параллельный запрос закэширует под новой версией
+    # список без этого изменения
+    transaction.on_commit(partial(bump_version, VERSION_KEY))
@@ -1,10 +1,24 @@
 from django.contrib import admin
 from .models import Question, Choice, Vote, UserProfile
+from .archive import is_archived
+from .voting import with_vote_totals
 
 
 class ChoiceInLine(admin.TabularInline):
     model = Choice
     extra = 3
+    # Choice.votes — только база шардированного счетчика, править ее нельзя
+    fields = ('choice_text', 'vote_total')
+    readonly_fields = ('vote_total',)
+
+    def get_queryset(self, request):
+        return with_vote_totals(super().get_queryset(request))
+
+    def vote_total(self, obj):
+        # у новых строк аннотации нет
+        return getattr(obj, 'vote_total', None)
+
+    vote_total.short_description = 'Голосов'
 
 
 class QuestionAdmin(admin.ModelAdmin):
@@ -13,6 +27,12 @@ class QuestionAdmin(admin.ModelAdmin):
     search_fields = ['question_text']
     inlines = [ChoiceInLine]
 
+    def get_readonly_fields(self, request, obj=None):
+        # итоги архивного вопроса заморожены — срок уже не продлить
+        if obj is not None and is_archived(obj):
+            return ('expiration_date',)
+        return super().get_readonly_fields(request, obj)
+
 
 class VoteAdmin(admin.ModelAdmin):
     list_display = ('user', 'question', 'choice', 'voted_at')
@@ -37,7 +57,7 @@ class PostCommentInline(admin.TabularInline):
 
 
 class MicroblogPostAdmin(admin.ModelAdmin):
-    list_display = ('author', 'content_preview', 'created_at', 'likes_count')
+    list_display = ('author', 'content_preview', 'created_at', 'likes_count', 'comments_count')
     list_filter = ['created_at', 'author']
     search_fields = ['content', 'author__username']
     inlines = [PostCommentInline]
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        from .cache import require_shared_cache
+        require_shared_cache()
+
+        # обработчики сигналов инвалидации кэша
+        from . import active_questions, auth_backends, images, live, media, results, voted  # noqa: F401
@@ -0,0 +1,129 @@
+"""Архив итогов закрытых опросов.
+
+После expiration_date итоги вопроса больше не меняются. Команда
+close_expired_polls замораживает их в QuestionArchive (общее число и
+голоса по вариантам), и страница итогов закрытого опроса берет их из
+архива, без снимка в кэше и счетчиков. Голосовать по архивному вопросу
+нельзя никому.
+
+Архивируются вопросы, закрытые не меньше GRACE секунд назад: голоса,
+принятые до закрытия и еще лежащие в буфере (vote_buffer), успевают
+попасть в БД. С --compact-votes строки Vote архивных вопросов удаляются
+пачками, а шарды счетчиков сворачиваются в Choice.votes, чтобы горячие
+таблицы не росли вместе с историей. Индексы голосов затронутых
+пользователей при этом сбрасываются, а страница архивного вопроса
+голос пользователя не ищет: строк Vote по нему больше нет.
+
+После архивирования expiration_date вопроса не меняется (QuestionForm,
+QuestionAdmin): продление закрытого опроса разошлось бы с архивом.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Choice, ChoiceVoteShard, Question, QuestionArchive, Vote
+from .results import _build_snapshot, _snapshot_rows, aget_results_snapshot, get_results_snapshot
+
+
+DEFAULTS = {
+    # пауза после expiration_date перед архивированием, секунды
+    'GRACE': 5 * 60,
+    # вопросов или строк Vote за один проход
+    'BATCH_SIZE': 1000,
+}
+
+
+def archive_settings():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_ARCHIVE', {})}
+
+
+def get_archive(question):
+    """Архив вопроса или None; архив стоит выбирать через select_related('archive')"""
+    try:
+        return question.archive
+    except ObjectDoesNotExist:
+        return None
+
+
+def archived_snapshot(archive):
+    """Итоги из архива в формате results.get_results_snapshot"""
+    meta = [(choice_id, choice_text) for choice_id, choice_text, _ in archive.choice_counts]
+    counts = {choice_id: votes for choice_id, _, votes in archive.choice_counts}
+    return _build_snapshot(meta, counts)
+
+
+def question_results(question):
+    archive = get_archive(question)
+    if archive is not None:
+        return archived_snapshot(archive)
+    return get_results_snapshot(question.pk)
+
+
+async def aquestion_results(question):
+    archive = get_archive(question)
+    if archive is not None:
+        return archived_snapshot(archive)
+    return await aget_results_snapshot(question.pk)
+
+
+def expired_questions(now=None):
+    """Закрытые с запасом GRACE и еще не архивированные вопросы"""
+    now = now or timezone.now()
+    cutoff = now - datetime.timedelta(seconds=archive_settings()['GRACE'])
+    return Question.objects.filter(expiration_date__lte=cutoff, archive__isnull=True)
+
+
+def is_archived(question):
+    """Есть ли у вопроса архив; для новых и удаленных вопросов — нет"""
+    return question.pk is not None and get_archive(question) is not None
+
+
+def archive_question(question_id):
+    """Замораживает итоги вопроса; True, если архив создан этим вызовом"""
+    with transaction.atomic():
+        # строка вопроса заблокирована: итоги читаются и архив создается
+        # одним шагом, параллельный вызов ждет и находит готовый архив
+        if not Question.objects.select_for_update().filter(pk=question_id).exists():
+            return False
+        if QuestionArchive.objects.filter(pk=question_id).exists():
+            return False
+        rows = [list(row) for row in _snapshot_rows(question_id)]
+        QuestionArchive.objects.create(
+            question_id=question_id,
+            total=sum(votes for _, _, votes in rows),
+            choice_counts=rows,
+        )
+    return True
+
+
+def compact_votes(question_id, batch_size=None):
+    """Удаляет строки Vote архивного вопроса и сворачивает шарды в Choice.votes.
+
+    Возвращает число удаленных голосов.
+    """
+    batch_size = batch_size or archive_settings()['BATCH_SIZE']
+    deleted = 0
+    while True:
+        batch = list(Vote.objects.filter(question_id=question_id).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        # у Vote нет зависимых строк; post_delete сбрасывает индексы голосов
+        # проголосовавших и снимок итогов
+        deleted += Vote.objects.filter(pk__in=batch).delete()[0]
+
+    shard_totals = (
+        ChoiceVoteShard.objects.filter(choice=OuterRef('pk'))
+        .order_by().values('choice').annotate(total=Sum('count')).values('total')
+    )
+    with transaction.atomic():
+        Choice.objects.filter(question_id=question_id).update(
+            votes=F('votes') + Coalesce(Subquery(shard_totals), 0)
+        )
+        ChoiceVoteShard.objects.filter(choice__question_id=question_id).delete()
+        QuestionArchive.objects.filter(pk=question_id).update(votes_compacted_at=timezone.now())
+    return deleted
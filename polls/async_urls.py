@@ -0,0 +1,22 @@
+"""Маршруты polls с асинхронными представлениями вместо синхронных (для ASGI)"""
+from django.urls import path
+
+from . import async_views, urls
+
+
+app_name = urls.app_name
+
+ASYNC_VIEWS = {
+    'index': async_views.index,
+    'detail': async_views.detail,
+    'results': async_views.results,
+    'microblog_feed': async_views.microblog_feed,
+    'microblog': async_views.microblog_feed,
+    'user_profile': async_views.user_profile,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+    if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in urls.urlpatterns
+]
@@ -0,0 +1,6 @@
+"""Мелкие помощники для асинхронного ORM"""
+
+
+async def aslist(queryset):
+    """Асинхронный аналог list(queryset)"""
+    return [obj async for obj in queryset]
@@ -0,0 +1,179 @@
+"""Асинхронные версии нагруженных страниц для работы под ASGI.
+
+Синхронное представление под ASGI занимает поток на все время запроса.
+Здесь те же страницы написаны на асинхронном ORM и асинхронных вызовах
+кэша. Параллельными SQL-запросы от этого не становятся: асинхронный ORM
+выполняет каждый запрос через sync_to_async(thread_sensitive=True), то
+есть по одному в общем потоке. asyncio.gather лишь дает обращениям к
+кэшу идти, пока запрос к БД ждет этот поток. Замер (manage.py
+bench_asgi) показывает, что под текущей нагрузкой ASGI медленнее WSGI,
+поэтому маршруты включаются только явно.
+Маршруты подменяет AsyncViewsMiddleware, если запрос пришел через ASGI и
+включен POLLS_ASYNC_VIEWS; под WSGI работают обычные views.py.
+
+Пользователь загружается заранее (request.auser) и кладется в
+request.user, чтобы шаблоны и контекст-процессоры не обращались к базе
+синхронно. Сами шаблоны рендерятся в синхронном потоке (arender): тег
+{% picture %} проверяет рендиции в кэше и хранилище, а контекст-процессор
+сообщений читает сессию — это блокирующий ввод-вывод.
+"""
+import asyncio
+import functools
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import aget_object_or_404, render
+from django.utils import timezone
+
+from .active_questions import aget_active_questions
+from .archive import aquestion_results, is_archived
+from .async_utils import aslist
+from .feed import amark_liked, visible_authors, visible_posts, with_feed_relations
+from .forms import PostCommentForm
+from .fragments import arender_post_cards
+from .models import MicroblogPost, Question
+from .pagination import KeysetPaginator
+from .voted import avoted_choice, avoted_choices
+
+
+ASYNC_URLCONF = 'mysite.async_urls'
+
+# рендеринг шаблона блокирует (хранилище, кэш, сессия), поэтому уходит из цикла событий
+arender = sync_to_async(render)
+
+
+def async_views_enabled():
+    return getattr(settings, 'POLLS_ASYNC_VIEWS', False)
+
+
+class AsyncViewsMiddleware:
+    """Под ASGI направляет запросы в URLconf с асинхронными представлениями"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # цепочка middleware асинхронна только под ASGI
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.enabled = async_views_enabled()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if self.enabled:
+            request.urlconf = ASYNC_URLCONF
+        return await self.get_response(request)
+
+
+async def _load_user(request):
+    request.user = await request.auser()
+    return request.user
+
+
+def login_required(view):
+    """Асинхронный login_required без перехода в синхронный поток ради проверки"""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await _load_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), settings.LOGIN_URL)
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def index(request):
+    # сначала пользователь: суперпользователю кэш активных опросов не нужен
+    user = await _load_user(request)
+    if user.is_superuser:
+        questions = await aslist(Question.objects.select_related('author'))
+    else:
+        questions = await aget_active_questions()
+    voted = await avoted_choices(user, [question.pk for question in questions])
+    return await arender(request, 'polls/index.html', {
+        'latest_question_list': questions,
+        'question_list': questions,
+        'object_list': questions,
+        'voted_question_ids': set(voted),
+    })
+
+
+@login_required
+async def detail(request, pk):
+    questions = Question.objects.select_related('archive').prefetch_related('choices')
+    if not request.user.is_superuser:
+        now = timezone.now()
+        questions = questions.filter(expiration_date__gt=now, pub_date__lte=now)
+
+    # индекс голосов читается из кэша, пока запрос вопроса ждет поток ORM
+    question, choice_id = await asyncio.gather(
+        aget_object_or_404(questions, pk=pk),
+        avoted_choice(request.user, pk),
+    )
+    # у архивного вопроса строки Vote могли быть сжаты — индексу не верим
+    archived = is_archived(question)
+    if archived:
+        choice_id = None
+    user_choice = next((choice for choice in question.choices.all() if choice.pk == choice_id), None)
+    return await arender(request, 'polls/detail.html', {
+        'question': question,
+        'object': question,
+        'archived': archived,
+        'has_voted': choice_id is not None,
+        'user_choice': user_choice,
+    })
+
+
+@login_required
+async def results(request, pk):
+    # снимок нужен только открытому опросу, поэтому сначала вопрос с архивом
+    question = await aget_object_or_404(Question.objects.select_related('archive'), pk=pk)
+    snapshot = await aquestion_results(question)
+    return await arender(request, 'polls/results.html', {
+        'question': question,
+        'object': question,
+        'choices_with_percentage': snapshot['choices'],
+        'total_votes': snapshot['total'],
+    })
+
+
+async def microblog_feed(request):
+    """Лента постов"""
+    paginator = KeysetPaginator(with_feed_relations(visible_posts(MicroblogPost.objects.all())), 10)
+    user, page_obj = await asyncio.gather(
+        _load_user(request), paginator.aget_page(request.GET.get('cursor')),
+    )
+    page_obj.object_list = await amark_liked(page_obj.object_list, user)
+    await arender_post_cards(page_obj.object_list, request, 'feed')
+
+    return await arender(request, 'polls/microblog_feed.html', {
+        'page_obj': page_obj,
+        'comment_form': PostCommentForm(),
+    })
+
+
+async def user_profile(request, username):
+    """Профиль пользователя с его постами"""
+    # посты выбираются по имени автора, не дожидаясь загрузки самого автора
+    paginator = KeysetPaginator(visible_posts(MicroblogPost.objects.filter(author__username=username)), 10)
+    _, profile_user, page_obj = await asyncio.gather(
+        _load_user(request),
+        aget_object_or_404(visible_authors(User.objects.select_related('profile')), username=username),
+        paginator.aget_page(request.GET.get('cursor')),
+    )
+    await arender_post_cards(page_obj.object_list, request, 'profile')
+
+    return await arender(request, 'polls/user_profile.html', {
+        'profile_user': profile_user,
+        'user_profile': profile_user.profile,
+        'page_obj': page_obj,
+    })
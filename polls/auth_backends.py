@@ -0,0 +1,76 @@
+"""Бэкенд аутентификации с кэшированием пользователя.
+
+ModelBackend на каждый запрос загружает пользователя из auth_user. Здесь
+пользователь вместе с профилем кладется в кэш под версионным ключом;
+сохранение или удаление User и UserProfile (смена пароля, last_login,
+правка профиля) поднимает версию. Изменения в обход сигналов
+(QuerySet.update) видны не позже чем через POLLS_AUTH_USER_CACHE_TTL.
+
+Сброс работает только на общем для процессов кэше: с кэшем в памяти
+процесса остальные воркеры принимали бы сессию вышедшего, сменившего
+пароль или деактивированного пользователя до истечения TTL. Поэтому
+приложение не стартует без общего кэша (см. polls/cache.py).
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache_versions import aget_version, bump_version, get_version
+from .models import UserProfile
+
+
+UserModel = get_user_model()
+
+VERSION_KEY = 'polls:auth-user:ver:{user_id}'
+USER_KEY = 'polls:auth-user:{user_id}:v{version}'
+
+
+def user_cache_ttl():
+    return getattr(settings, 'POLLS_AUTH_USER_CACHE_TTL', 5 * 60)
+
+
+def invalidate_user(user_id):
+    bump_version(VERSION_KEY.format(user_id=user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend, берущий пользователя сессии из кэша"""
+
+    def get_user(self, user_id):
+        version = get_version(VERSION_KEY.format(user_id=user_id))
+        key = USER_KEY.format(user_id=user_id, version=version)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = UserModel._default_manager.select_related('profile').get(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            cache.set(key, user, user_cache_ttl())
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        version = await aget_version(VERSION_KEY.format(user_id=user_id))
+        key = USER_KEY.format(user_id=user_id, version=version)
+        user = await cache.aget(key)
+        if user is None:
+            try:
+                user = await UserModel._default_manager.select_related('profile').aget(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            await cache.aset(key, user, user_cache_ttl())
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver(post_save, sender=UserModel)
+@receiver(post_delete, sender=UserModel)
+def invalidate_on_user_change(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_on_profile_change(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
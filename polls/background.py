@@ -0,0 +1,61 @@
+"""Фоновые потоки для периодического сброса накопленных данных в БД"""
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher:
+    """Поток-демон, вызывающий flush() раз в interval секунд или по wake().
+
+    Поток стартует лениво при первом start(); при завершении процесса
+    выполняется последний flush(), чтобы не терять накопленное.
+    """
+
+    def __init__(self, name, interval, flush):
+        self.name = name
+        self.interval = interval
+        self._flush = flush
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval * 10 + 5)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._run_flush()
+        self._run_flush()
+        close_old_connections()
+
+    def _run_flush(self):
+        try:
+            self._flush()
+        except Exception:
+            logger.exception('Ошибка фонового сброса %s', self.name)
+        finally:
+            close_old_connections()
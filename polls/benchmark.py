@@ -0,0 +1,383 @@
+"""Нагрузочный бенчмарк маршрутов polls (запускается командой bench).
+
+Запросы выполняются в процессе через django.test.Client в нескольких
+потоках, каждый поток со своим пользователем. Для каждого маршрута
+считаются p50/p95/p99 задержки, запросов в секунду и SQL-запросов на
+HTTP-запрос. Результат сохраняется в JSON и может сравниваться с
+сохраненной базовой линией.
+
+run_async_scenario гоняет те же сценарии через AsyncClient (ASGI-обработчик
+и асинхронные представления): все запросы выполняются конкурентно в одном
+цикле событий, как под ASGI-сервером.
+"""
+import asyncio
+import contextlib
+import datetime
+import itertools
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment,
+)
+from django.utils import timezone
+
+from .models import Choice, MicroblogPost, PostComment, Question
+
+
+# Маршрут -> функция (ctx, rng, user) -> (method, path, data[, id пользователя,
+# от имени которого выполнить запрос])
+SCENARIOS = {
+    'index': lambda ctx, rng, user: ('get', '/polls/', None),
+    'detail': lambda ctx, rng, user: ('get', f'/polls/{rng.choice(ctx["questions"])}/', None),
+    'results': lambda ctx, rng, user: ('get', f'/polls/{rng.choice(ctx["questions"])}/results/', None),
+    'vote': lambda ctx, rng, user: _vote(ctx),
+    'register': lambda ctx, rng, user: ('get', '/polls/register/', None),
+    'login': lambda ctx, rng, user: ('get', '/polls/login/', None),
+    'profile': lambda ctx, rng, user: ('get', '/polls/profile/', None),
+    'delete_profile': lambda ctx, rng, user: ('get', '/polls/profile/delete/', None),
+    'user_profile': lambda ctx, rng, user: ('get', f'/polls/users/{rng.choice(ctx["usernames"])}/', None),
+    'edit_profile': lambda ctx, rng, user: ('get', f'/polls/users/{user.username}/edit/', None),
+    'create_question': lambda ctx, rng, user: ('get', '/polls/create/', None),
+    'microblog_feed': lambda ctx, rng, user: ('get', '/polls/microblog/', None),
+    'create_post': lambda ctx, rng, user: ('post', '/polls/microblog/create/', {'content': 'Бенчмарк'}),
+    'edit_post': lambda ctx, rng, user: ('get', f'/polls/microblog/post/{ctx["own_posts"][user.pk]}/edit/', None),
+    'delete_post': lambda ctx, rng, user: ('get', f'/polls/microblog/post/{ctx["own_posts"][user.pk]}/delete/', None),
+    'like_post': lambda ctx, rng, user: ('post', f'/polls/microblog/post/{rng.choice(ctx["posts"])}/like/', {}),
+    'add_comment': lambda ctx, rng, user: (
+        'post', f'/polls/microblog/post/{rng.choice(ctx["posts"])}/comment/', {'content': 'Комментарий'}
+    ),
+    'edit_comment': lambda ctx, rng, user: (
+        'get', f'/polls/microblog/comment/{ctx["own_comments"][user.pk]}/edit/', None
+    ),
+    'delete_comment': lambda ctx, rng, user: (
+        'get', f'/polls/microblog/comment/{ctx["own_comments"][user.pk]}/delete/', None
+    ),
+}
+
+
+def _vote(ctx):
+    """Каждый запрос — новая пара (пользователь, вопрос).
+
+    Иначе после первого голоса пользователь упирается в AlreadyVoted, и
+    замеряется только редирект, а не запись голоса.
+    """
+    users, questions = ctx['users'], ctx['questions']
+    pair = next(ctx['vote_pairs'])
+    if pair >= len(users) * len(questions):
+        raise ValueError('Пар (пользователь, вопрос) не хватает на все голоса: увеличьте --users или --questions')
+    voter, question_id = users[pair % len(users)], questions[pair // len(users)]
+    choice_id = ctx['choices'][question_id][pair % len(ctx['choices'][question_id])]
+    return 'post', f'/polls/{question_id}/vote/', {'choice': choice_id}, voter
+
+
+@contextlib.contextmanager
+def benchmark_database():
+    """Отдельная временная тестовая БД на время бенчмарка"""
+    # файловая БД вместо in-memory: потоки пишут в нее параллельно
+    fd, db_path = tempfile.mkstemp(suffix='.sqlite3', prefix='polls-bench-')
+    os.close(fd)
+    connection.settings_dict.setdefault('TEST', {})['NAME'] = db_path
+
+    # ошибки 500 учитываются в отчете, трассировки в консоли не нужны; при
+    # высокой конкурентности медленным становится каждый запрос
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    logging.getLogger('polls.slow_requests').setLevel(logging.CRITICAL)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        cache.clear()
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+
+def seed_benchmark_data(users=50, questions=20, posts=200, comments_per_post=3, seed=1):
+    """Заполняет пустую БД детерминированным набором данных для бенчмарка"""
+    if posts < users or posts * comments_per_post < users:
+        raise ValueError('Постов и комментариев должно хватить на каждого пользователя')
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    user_objs = [
+        User.objects.create_user(f'bench{i}', f'bench{i}@example.com', 'bench-password')
+        for i in range(users)
+    ]
+
+    question_ids = []
+    choices = {}
+    for i in range(questions):
+        question = Question.objects.create(
+            question_text=f'Вопрос {i}',
+            short_description='Краткое описание',
+            full_description='Полное описание',
+            pub_date=now - datetime.timedelta(days=1),
+            expiration_date=now + datetime.timedelta(days=30),
+            author=rng.choice(user_objs),
+        )
+        question_ids.append(question.pk)
+        choices[question.pk] = [
+            Choice.objects.create(question=question, choice_text=f'Вариант {j}').pk
+            for j in range(4)
+        ]
+
+    post_objs = MicroblogPost.objects.bulk_create([
+        MicroblogPost(author=user_objs[i % users], content=f'Пост {i}\nвторая строка', comments_count=comments_per_post)
+        for i in range(posts)
+    ])
+    # авторы постов и комментариев по кругу, чтобы у каждого пользователя были свои
+    comment_objs = PostComment.objects.bulk_create([
+        PostComment(post=post, author=user_objs[(i * comments_per_post + j) % users], content='Комментарий')
+        for i, post in enumerate(post_objs)
+        for j in range(comments_per_post)
+    ])
+
+    own_posts = {}
+    for post in post_objs:
+        own_posts.setdefault(post.author_id, post.pk)
+    own_comments = {}
+    for comment in comment_objs:
+        own_comments.setdefault(comment.author_id, comment.pk)
+
+    return {
+        'users': [user.pk for user in user_objs],
+        'usernames': [user.username for user in user_objs],
+        'questions': question_ids,
+        'choices': choices,
+        'posts': [post.pk for post in post_objs],
+        'own_posts': own_posts,
+        'own_comments': own_comments,
+        # счетчик пар для сценария vote; next() атомарен, его делят потоки
+        'vote_pairs': itertools.count(),
+    }
+
+
+def percentile(values, pct):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def prepare_sessions(ctx):
+    """Заранее и последовательно логинит всех пользователей бенчмарка.
+
+    Иначе при большой конкурентности потоки одновременно пишут сессии и
+    last_login, и SQLite отвечает database is locked.
+    """
+    ctx['sessions'] = {}
+    for user in User.objects.filter(pk__in=ctx['users']):
+        client = Client()
+        client.force_login(user)
+        ctx['sessions'][user.pk] = client.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+def _login(ctx, client, user):
+    session_key = ctx.get('sessions', {}).get(user.pk)
+    if session_key is None:
+        client.force_login(user)
+    else:
+        client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+
+
+def _switch_user(ctx, client, user_id):
+    """Подставляет сессию другого пользователя (prepare_sessions) вне замера"""
+    client.cookies[settings.SESSION_COOKIE_NAME] = ctx['sessions'][user_id]
+
+
+def _worker(ctx, name, user_id, requests, seed):
+    rng = random.Random(seed)
+    user = User.objects.get(pk=user_id)
+    client = Client(raise_request_exception=False)
+    _login(ctx, client, user)
+
+    samples = []
+    try:
+        for _ in range(requests):
+            method, path, data, *as_user = SCENARIOS[name](ctx, rng, user)
+            if as_user:
+                _switch_user(ctx, client, *as_user)
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data)
+                elapsed = time.perf_counter() - started
+            samples.append((elapsed, len(queries.captured_queries), response.status_code))
+    finally:
+        close_old_connections()
+        connection.close()
+    return samples
+
+
+def run_scenario(ctx, name, concurrency, requests, seed=1):
+    per_worker = max(1, requests // concurrency)
+    users = ctx['users']
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(_worker, ctx, name, users[i % len(users)], per_worker, seed * 1000 + i)
+            for i in range(concurrency)
+        ]
+        samples = [sample for future in futures for sample in future.result()]
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed * 1000 for elapsed, _, _ in samples]
+    return {
+        'requests': len(samples),
+        'concurrency': concurrency,
+        'rps': round(len(samples) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'queries_per_request': round(sum(q for _, q, _ in samples) / len(samples), 2) if samples else 0.0,
+        'max_queries': max((q for _, q, _ in samples), default=0),
+        'errors': sum(1 for _, _, status in samples if status >= 500),
+    }
+
+
+async def _async_worker(ctx, name, user_id, requests, seed):
+    rng = random.Random(seed)
+    user = await User.objects.aget(pk=user_id)
+    client = AsyncClient(raise_request_exception=False)
+    if user.pk in ctx.get('sessions', {}):
+        _login(ctx, client, user)
+    else:
+        await client.aforce_login(user)
+
+    samples = []
+    for _ in range(requests):
+        method, path, data, *as_user = SCENARIOS[name](ctx, rng, user)
+        if as_user:
+            _switch_user(ctx, client, *as_user)
+        started = time.perf_counter()
+        # как ASGIHandler: синхронные вызовы запроса идут в его собственный
+        # поток, а не в общий для всех запросов (AsyncClient этого не делает)
+        async with ThreadSensitiveContext():
+            response = await getattr(client, method)(path, data)
+        samples.append((time.perf_counter() - started, response.status_code))
+    return samples
+
+
+def run_async_scenario(ctx, name, concurrency, requests, seed=1):
+    """Как run_scenario, но concurrency клиентов — корутины в одном цикле событий.
+
+    SQL-запросы здесь не считаются: асинхронный ORM выполняет их в другом потоке.
+    """
+    per_worker = max(1, requests // concurrency)
+    users = ctx['users']
+
+    async def run():
+        batches = await asyncio.gather(*(
+            _async_worker(ctx, name, users[i % len(users)], per_worker, seed * 1000 + i)
+            for i in range(concurrency)
+        ))
+        return [sample for batch in batches for sample in batch]
+
+    started = time.perf_counter()
+    samples = asyncio.run(run())
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed * 1000 for elapsed, _ in samples]
+    return {
+        'requests': len(samples),
+        'concurrency': concurrency,
+        'rps': round(len(samples) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'errors': sum(1 for _, status in samples if status >= 500),
+    }
+
+
+def run_benchmark(ctx, names, concurrency, requests, seed=1, progress=None):
+    results = {}
+    for name in names:
+        results[name] = run_scenario(ctx, name, concurrency, requests, seed)
+        if progress:
+            progress(name, results[name])
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'concurrency': concurrency,
+            'requests': requests,
+            'seed': seed,
+            'threads': threading.active_count(),
+        },
+        'results': results,
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=0.25):
+    """Список регрессий относительно базовой линии.
+
+    Регрессия — рост p95 больше чем на tolerance, падение RPS больше чем на
+    tolerance или рост максимального числа SQL-запросов на HTTP-запрос.
+    """
+    regressions = []
+    for name, current in report['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        if current['max_queries'] > base['max_queries']:
+            regressions.append(
+                f'{name}: SQL-запросов на запрос {base["max_queries"]} -> {current["max_queries"]}'
+            )
+        if base['p95_ms'] and current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {base["p95_ms"]} мс -> {current["p95_ms"]} мс')
+        if base['rps'] and current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f'{name}: RPS {base["rps"]} -> {current["rps"]}')
+        if current['errors'] > base['errors']:
+            regressions.append(f'{name}: ошибок {base["errors"]} -> {current["errors"]}')
+    return regressions
+
+
+# Настройки без кэширования сессий и пользователя — для сравнения
+UNCACHED_AUTH = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+}
+
+
+def measure_auth_queries(ctx, names, requests, seed=1):
+    """SQL-запросов на GET-запрос авторизованного пользователя без кэша
+    сессий и пользователя и с ним: {name: {'db': ..., 'cached': ..., 'saved': ...}}
+    """
+    user = User.objects.get(pk=ctx['users'][0])
+    measured = {}
+    for mode, overrides in (('db', UNCACHED_AUTH), ('cached', {})):
+        cache.clear()
+        with override_settings(**overrides):
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            for name in names:
+                rng = random.Random(seed)
+                # первый запрос прогревает кэши и не учитывается
+                method, path, data = SCENARIOS[name](ctx, rng, user)
+                getattr(client, method)(path, data)
+                total = 0
+                for _ in range(requests):
+                    method, path, data = SCENARIOS[name](ctx, rng, user)
+                    with CaptureQueriesContext(connection) as queries:
+                        getattr(client, method)(path, data)
+                    total += len(queries)
+                measured.setdefault(name, {})[mode] = round(total / requests, 2)
+    for row in measured.values():
+        row['saved'] = round(row['db'] - row['cached'], 2)
+    return measured
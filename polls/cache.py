@@ -0,0 +1,69 @@
+"""Кэш в памяти процесса с нативными асинхронными методами.
+
+В Django асинхронные методы кэша по умолчанию вызывают синхронные через
+sync_to_async, а aget_many/aset_many — еще и по одному на ключ. Для
+LocMemCache, который не ходит в сеть и держит блокировку микросекунды,
+это только лишние переходы между потоками на каждый вызов из асинхронных
+представлений, поэтому здесь a*-методы выполняются прямо в цикле событий.
+
+Кэш в памяти у каждого процесса свой. Сессии (cached_db), пользователь
+сессии (auth_backends), версии ключей (cache_versions) и метки буфера
+голосов рассчитаны на общий кэш: сброс в одном процессе должен быть виден
+всем. Поэтому вне DEBUG приложение не стартует на кэше в памяти процесса.
+"""
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache as BaseLocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+class LocMemCache(BaseLocMemCache):
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.add(key, value, timeout, version)
+
+    async def aget(self, key, default=None, version=None):
+        return self.get(key, default, version)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.set(key, value, timeout, version)
+
+    async def atouch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.touch(key, timeout, version)
+
+    async def adelete(self, key, version=None):
+        return self.delete(key, version)
+
+    async def aget_many(self, keys, version=None):
+        return self.get_many(keys, version)
+
+    async def aset_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.set_many(data, timeout, version)
+
+    async def adelete_many(self, keys, version=None):
+        return self.delete_many(keys, version)
+
+    async def ahas_key(self, key, version=None):
+        return self.has_key(key, version)
+
+    async def aincr(self, key, delta=1, version=None):
+        return self.incr(key, delta, version)
+
+    async def aclear(self):
+        return self.clear()
+
+
+def require_shared_cache():
+    """Падает при старте, если вне DEBUG кэш по умолчанию не общий для процессов"""
+    if settings.DEBUG:
+        return
+    backend = import_string(settings.CACHES[DEFAULT_CACHE_ALIAS]['BACKEND'])
+    if issubclass(backend, (BaseLocMemCache, DummyCache)):
+        raise ImproperlyConfigured(
+            f'{backend.__module__}.{backend.__qualname__} хранит данные в памяти процесса: '
+            'сброс сессий, пользователей и версий ключей не дойдет до других процессов. '
+            'Настройте общий кэш (Redis или Memcached) в CACHES.'
+        )
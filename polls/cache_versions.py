@@ -0,0 +1,34 @@
+"""Версионные ключи кэша.
+
+Данные кладутся под ключом, включающим текущую версию; инвалидация лишь
+поднимает версию, и старые записи перестают читаться. Это избавляет от
+гонки «читатель записал устаревшие данные после удаления ключа».
+"""
+import time
+
+from django.core.cache import cache
+
+
+def get_version(key, create=True):
+    """Текущая версия; при отсутствии создается (или None, если create=False)"""
+    version = cache.get(key)
+    if version is None and create:
+        # версия от времени, чтобы после вытеснения ключа не прочитать старые данные
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key, create=True):
+    version = await cache.aget(key)
+    if version is None and create:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
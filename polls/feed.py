@@ -0,0 +1,80 @@
+"""Подготовка страниц ленты микроблогов за фиксированное число запросов"""
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
+
+from .async_utils import aslist
+from .models import PostComment, PostLike
+
+
+LATEST_COMMENTS = 5
+
+
+def latest_comments_queryset(limit=LATEST_COMMENTS):
+    """Последние limit комментариев каждого поста (оконная функция по post_id)"""
+    return (
+        PostComment.objects
+        .annotate(row_number=Window(
+            RowNumber(),
+            partition_by=F('post_id'),
+            order_by=[F('created_at').desc(), F('id').desc()],
+        ))
+        .filter(row_number__lte=limit)
+        .select_related('author')
+        .order_by('created_at', 'id')
+    )
+
+
+def visible_authors(users):
+    """Пользователи, чьи страницы и посты показываются.
+
+    Удаляемый аккаунт деактивируется сразу, а его строки удаляются позже
+    (polls/account_deletion.py) — до этого он скрыт отовсюду.
+    """
+    return users.filter(is_active=True, deletion__isnull=True)
+
+
+def visible_posts(posts):
+    """Посты авторов из visible_authors; условие — в том же запросе через JOIN"""
+    return posts.filter(author__is_active=True, author__deletion__isnull=True)
+
+
+def with_feed_relations(posts):
+    """Подтягивает к постам все, что нужно шаблону ленты.
+
+    Автор с профилем — через JOIN, число комментариев хранится в
+    post.comments_count, последние комментарии — одним prefetch-запросом
+    на всю страницу (в post.latest_comments).
+    """
+    return (
+        posts
+        .select_related('author__profile')
+        .prefetch_related(Prefetch('comments', queryset=latest_comments_queryset(), to_attr='latest_comments'))
+    )
+
+
+def _liked_queryset(posts, user):
+    return PostLike.objects.filter(user=user, post_id__in=[post.pk for post in posts]).values_list('post_id', flat=True)
+
+
+def _set_liked(posts, liked):
+    for post in posts:
+        post.liked_by_me = post.pk in liked
+    return posts
+
+
+def mark_liked(posts, user):
+    """Проставляет post.liked_by_me одним запросом на страницу"""
+    posts = list(posts)
+    liked = set()
+    if user.is_authenticated and posts:
+        liked = set(_liked_queryset(posts, user))
+    return _set_liked(posts, liked)
+
+
+async def amark_liked(posts, user):
+    """Асинхронный вариант mark_liked"""
+    posts = list(posts)
+    liked = set()
+    if user.is_authenticated and posts:
+        liked = set(await aslist(_liked_queryset(posts, user)))
+    return _set_liked(posts, liked)
@@ -2,6 +2,8 @@ from django import forms
 from .models import UserProfile, Question, MicroblogPost, PostComment
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from .uploads import UploadedImageField
+from .archive import is_archived
 
 # forms.py
 class UserProfileForm(forms.ModelForm):
@@ -9,6 +11,8 @@ class UserProfileForm(forms.ModelForm):
     class Meta:
         model = UserProfile
         fields = ['avatar', 'bio']
+        # изображение уже проверено при приеме загрузки (polls/uploads.py)
+        field_classes = {'avatar': UploadedImageField}
         widgets = {
             'avatar': forms.ClearableFileInput(attrs={
                 'class': 'form-control',
@@ -38,6 +42,7 @@ class QuestionForm(forms.ModelForm):
     class Meta:
         model = Question
         fields = ['question_text', 'short_description', 'full_description', 'expiration_date', 'image']
+        field_classes = {'image': UploadedImageField}
         labels = {
             'question_text': 'Текст вопроса',
             'short_description': 'Краткое описание',
@@ -71,6 +76,12 @@ class QuestionForm(forms.ModelForm):
             }),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # итоги архивного вопроса заморожены — срок уже не продлить
+        if is_archived(self.instance):
+            self.fields['expiration_date'].disabled = True
+
     # Варианты ответов
     choice1 = forms.CharField(
         max_length=200,
@@ -137,14 +148,11 @@ class CustomUserCreationForm(UserCreationForm):
     def save(self, commit=True):
         user = super().save(commit=False)
         user.email = self.cleaned_data['email']
+        # профиль с аватаром создаст сигнал post_save — одной вставкой
+        user.profile_defaults = {'avatar': self.cleaned_data['avatar_url']}
 
         if commit:
             user.save()
-            # Профиль
-            UserProfile.objects.create(
-                user=user,
-                avatar=self.cleaned_data['avatar_url']
-            )
 
         return user
 
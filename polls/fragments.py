@@ -0,0 +1,167 @@
+"""Кэширование отрендеренных карточек постов.
+
+Карточка рендерится один раз и переиспользуется для всех зрителей и
+страниц. Ключ кэша строится из id поста, updated_at, счетчиков
+комментариев и лайков (и данных, видимых в карточке ленты: аватара автора,
+готовности его рендиции и последних комментариев), поэтому при любом изменении старая версия
+просто перестает читаться.
+
+Все, что зависит от зрителя — ссылки редактирования/удаления, состояние
+лайка, CSRF-токен, форма комментария, — оставлено в карточке слотами
+<!--slot:...--> и подставляется после чтения из кэша.
+"""
+import hashlib
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from .images import ready_renditions
+
+
+CARD_TEMPLATES = {
+    'feed': 'polls/includes/feed_post_card.html',
+    'profile': 'polls/includes/profile_post_card.html',
+}
+
+# обертка ссылок автора в карточке ленты и профиля
+POST_ACTIONS_STYLE = {
+    'feed': 'margin-left: auto;',
+    'profile': '',
+}
+
+SLOT_RE = re.compile(r'<!--slot:([a-z-]+)(?::(\d+):(\d+))?-->')
+AUTH_BLOCK_RE = re.compile(r'<!--auth-->.*?<!--/auth-->', re.S)
+
+
+def card_ttl():
+    return getattr(settings, 'POLLS_POST_CARD_TTL', 24 * 60 * 60)
+
+
+def _avatar_name(post):
+    try:
+        return post.author.profile.avatar.name
+    except ObjectDoesNotExist:
+        return ''
+
+
+def card_cache_key(kind, post, ready_avatars=frozenset()):
+    parts = [kind, post.pk, post.updated_at.isoformat(), post.comments_count, post.likes_count]
+    if kind == 'feed':
+        avatar = _avatar_name(post)
+        # карточка пересобирается, когда у аватара появляется рендиция
+        parts.extend([avatar, avatar in ready_avatars])
+        parts.extend(
+            f'{comment.pk}@{comment.updated_at.isoformat()}'
+            for comment in post.latest_comments
+        )
+    digest = hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+    return f'polls:post-card:{kind}:{post.pk}:{digest}'
+
+
+def _post_actions(kind, post):
+    return format_html(
+        '<div style="{}">'
+        '<a href="{}" style="margin-right: 10px;">Редактировать</a>'
+        '<a href="{}" style="color: red;">Удалить</a>'
+        '</div>',
+        POST_ACTIONS_STYLE[kind],
+        reverse('polls:edit_post', args=(post.pk,)),
+        reverse('polls:delete_post', args=(post.pk,)),
+    )
+
+
+def _comment_actions(comment_id):
+    return format_html(
+        '<div>'
+        '<a href="{}" style="font-size: 12px;">Редактировать</a>'
+        '<a href="{}" style="font-size: 12px; color: red; margin-left: 10px;">Удалить</a>'
+        '</div>',
+        reverse('polls:edit_comment', args=(comment_id,)),
+        reverse('polls:delete_comment', args=(comment_id,)),
+    )
+
+
+def _fill_viewer_slots(html, kind, post, user, csrf_input):
+    if not user.is_authenticated:
+        html = AUTH_BLOCK_RE.sub('', html)
+
+    def replace(match):
+        slot, object_id, author_id = match.groups()
+        if slot == 'csrf':
+            return csrf_input
+        if slot == 'heart':
+            return '❤️' if getattr(post, 'liked_by_me', False) else '🤍'
+        if slot == 'post-actions':
+            return _post_actions(kind, post) if user.pk == post.author_id else ''
+        if slot == 'comment-actions':
+            return _comment_actions(int(object_id)) if user.pk == int(author_id) else ''
+        return ''
+
+    return SLOT_RE.sub(replace, html)
+
+
+def _render_missing(keys, cards, kind):
+    return {
+        key: render_to_string(CARD_TEMPLATES[kind], {'post': post})
+        for key, post in keys.items()
+        if key not in cards
+    }
+
+
+def _fill_cards(keys, cards, kind, request):
+    csrf_input = format_html(
+        '<input type="hidden" name="csrfmiddlewaretoken" value="{}">', get_token(request)
+    )
+    for key, post in keys.items():
+        post.card_html = mark_safe(
+            _fill_viewer_slots(cards[key], kind, post, request.user, csrf_input)
+        )
+
+
+def render_post_cards(posts, request, kind='feed'):
+    """Проставляет post.card_html для всех постов страницы.
+
+    Из кэша карточки читаются одним get_many, отсутствующие рендерятся
+    и сохраняются одним set_many.
+    """
+    ready_avatars = set()
+    if kind == 'feed':
+        ready_avatars = ready_renditions({_avatar_name(post) for post in posts}, 'feed_avatar')
+    keys = {card_cache_key(kind, post, ready_avatars): post for post in posts}
+    cards = cache.get_many(list(keys))
+
+    rendered = _render_missing(keys, cards, kind)
+    if rendered:
+        cache.set_many(rendered, card_ttl())
+        cards.update(rendered)
+
+    _fill_cards(keys, cards, kind, request)
+    return posts
+
+
+async def arender_post_cards(posts, request, kind='feed'):
+    """Асинхронный вариант render_post_cards; request.user должен быть уже загружен"""
+    ready_avatars = set()
+    if kind == 'feed':
+        # проверка рендиций может обратиться к хранилищу — уводим ее из цикла событий
+        ready_avatars = await sync_to_async(ready_renditions, thread_sensitive=False)(
+            {_avatar_name(post) for post in posts}, 'feed_avatar',
+        )
+    keys = {card_cache_key(kind, post, ready_avatars): post for post in posts}
+    cards = await cache.aget_many(list(keys))
+
+    rendered = _render_missing(keys, cards, kind)
+    if rendered:
+        await cache.aset_many(rendered, card_ttl())
+        cards.update(rendered)
+
+    _fill_cards(keys, cards, kind, request)
+    return posts
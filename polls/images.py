@@ -0,0 +1,199 @@
+"""Рендиции загруженных изображений.
+
+После загрузки аватара или картинки вопроса в фоновом пуле потоков
+строятся уменьшенные копии фиксированных размеров в WebP и JPEG, без
+EXIF и прочих метаданных (ориентация из EXIF применяется заранее).
+Готовность рендиций кэшируется, чтобы шаблоны не обращались к хранилищу
+на каждый показ; пока рендиции нет, показывается оригинал.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import InvalidStorageError, default_storage, storages
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+from .models import Question, UserProfile
+
+
+logger = logging.getLogger(__name__)
+
+# имя -> (ширина, высота, обрезать до точного размера)
+RENDITIONS = {
+    'feed_avatar': (100, 100, True),
+    'profile_avatar': (300, 300, True),
+    'question_hero': (1000, 1000, False),
+}
+AVATAR_RENDITIONS = ('feed_avatar', 'profile_avatar')
+QUESTION_RENDITIONS = ('question_hero',)
+
+# расширение -> формат Pillow
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+DEFAULTS = {
+    'WORKERS': 2,
+    'WEBP_QUALITY': 80,
+    'JPEG_QUALITY': 82,
+}
+
+# v2: рендиции переименованы — готовность по старым именам не годится
+READY_KEY = 'polls:rendition:v2:{kind}:{digest}'
+# отсутствие рендиции кэшируется ненадолго — она может вот-вот появиться
+MISSING_TTL = 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def rendition_settings():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_IMAGE_RENDITIONS', {})}
+
+
+def is_local_file(name):
+    # при регистрации в аватар записывается внешний URL — его не обрабатываем
+    return bool(name) and '://' not in name
+
+
+def rendition_storage():
+    """Хранилище рендиций: их имена выводятся из имени оригинала и не должны меняться"""
+    try:
+        return storages['renditions']
+    except InvalidStorageError:
+        return default_storage
+
+
+def rendition_name(name, kind, ext):
+    # расширение оригинала остается в имени: у foo.jpg и foo.png рендиции разные
+    return f'renditions/{kind}/{name}.{ext}'
+
+
+def _ready_key(name, kind):
+    return READY_KEY.format(kind=kind, digest=hashlib.md5(name.encode()).hexdigest())
+
+
+def ready_renditions(names, kind):
+    """Множество имен файлов из names, для которых рендиция kind уже построена"""
+    names = {name for name in names if is_local_file(name)}
+    keys = {_ready_key(name, kind): name for name in names}
+    cached = cache.get_many(list(keys))
+
+    ready = {keys[key] for key, value in cached.items() if value}
+    checked = {}
+    for key, name in keys.items():
+        if key in cached:
+            continue
+        exists = all(rendition_storage().exists(rendition_name(name, kind, ext)) for ext in FORMATS)
+        checked[key] = exists
+        if exists:
+            ready.add(name)
+    for key, exists in checked.items():
+        cache.set(key, exists, None if exists else MISSING_TTL)
+    return ready
+
+
+def rendition_urls(name, kind):
+    """{'webp': url, 'jpg': url} или None, если рендиция еще не готова"""
+    if name not in ready_renditions([name], kind):
+        return None
+    return {ext: rendition_storage().url(rendition_name(name, kind, ext)) for ext in FORMATS}
+
+
+def _resize(source, kind):
+    width, height, crop = RENDITIONS[kind]
+    if crop:
+        return ImageOps.fit(source, (width, height), Image.Resampling.LANCZOS)
+    image = source.copy()
+    image.thumbnail((width, height), Image.Resampling.LANCZOS)
+    return image
+
+
+def _encode(image, ext, options):
+    buffer = io.BytesIO()
+    # exif/icc_profile не передаются — метаданные в рендицию не попадают
+    if ext == 'webp':
+        image.save(buffer, FORMATS[ext], quality=options['WEBP_QUALITY'], method=4)
+    else:
+        image.save(buffer, FORMATS[ext], quality=options['JPEG_QUALITY'], optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_renditions(name, kinds):
+    """Строит недостающие рендиции файла name; возвращает число созданных файлов"""
+    if not is_local_file(name):
+        return 0
+    storage = rendition_storage()
+    missing = [
+        (kind, ext) for kind in kinds for ext in FORMATS
+        if not storage.exists(rendition_name(name, kind, ext))
+    ]
+    if missing:
+        options = rendition_settings()
+        with default_storage.open(name, 'rb') as f, Image.open(f) as original:
+            # JPEG декодируется сразу с уменьшением — не разворачиваем 12 Мп ради 300×300
+            largest = max(max(RENDITIONS[kind][:2]) for kind, _ in missing)
+            original.draft('RGB', (largest, largest))
+            source = ImageOps.exif_transpose(original).convert('RGB')
+
+        for kind, ext in missing:
+            target = rendition_name(name, kind, ext)
+            # save() не перезаписывает: при гонке двух задач оставляем первую
+            if storage.exists(target):
+                continue
+            storage.save(target, ContentFile(_encode(_resize(source, kind), ext, options)))
+
+    cache.set_many({_ready_key(name, kind): True for kind in kinds}, None)
+    return len(missing)
+
+
+def delete_renditions(name):
+    storage = rendition_storage()
+    for kind in RENDITIONS:
+        for ext in FORMATS:
+            storage.delete(rendition_name(name, kind, ext))
+    cache.delete_many([_ready_key(name, kind) for kind in RENDITIONS])
+
+
+def _build_logged(name, kinds):
+    try:
+        build_renditions(name, kinds)
+    except Exception:
+        logger.exception('Не удалось построить рендиции %s', name)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=rendition_settings()['WORKERS'], thread_name_prefix='polls-renditions',
+            )
+        return _executor
+
+
+def schedule_renditions(name, kinds):
+    """Ставит построение рендиций в пул после коммита транзакции"""
+    if not is_local_file(name):
+        return
+    transaction.on_commit(lambda: get_executor().submit(_build_logged, name, kinds))
+
+
+@receiver(post_save, sender=UserProfile)
+def avatar_renditions(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and 'avatar' not in update_fields):
+        return
+    schedule_renditions(instance.avatar.name, AVATAR_RENDITIONS)
+
+
+@receiver(post_save, sender=Question)
+def question_renditions(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or not instance.image or (update_fields is not None and 'image' not in update_fields):
+        return
+    schedule_renditions(instance.image.name, QUESTION_RENDITIONS)
@@ -0,0 +1,103 @@
+"""Лайки постов: атомарное переключение и счетчик likes_count.
+
+Переключение опирается на unique_together (user, post): пробуем вставить
+лайк, при конфликте — удаляем существующий. Счетчик меняется выражением
+F('likes_count') ± 1 без перезаписи остальных полей поста.
+
+Для «вирусных» постов можно включить POLLS_LIKE_COALESCING: изменения
+счетчика копятся в памяти процесса и сбрасываются одним UPDATE на пост
+раз в FLUSH_INTERVAL_MS. Несброшенные дельты теряются при падении
+процесса; расхождение исправляет сверка счетчиков.
+"""
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .background import PeriodicFlusher
+from .models import MicroblogPost, PostLike
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL_MS': 1000,
+}
+
+
+def coalescing_settings():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_LIKE_COALESCING', {})}
+
+
+class LikeCounterBuffer:
+    """Накопитель дельт likes_count по постам"""
+
+    def __init__(self, flush_interval):
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self._flusher = PeriodicFlusher('like-counters', flush_interval, self.flush)
+
+    def add(self, post_id, delta):
+        with self._lock:
+            self._deltas[post_id] = self._deltas.get(post_id, 0) + delta
+        self._flusher.start()
+
+    def pending(self, post_id):
+        return self._deltas.get(post_id, 0)
+
+    def flush(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        deltas = {post_id: delta for post_id, delta in deltas.items() if delta}
+        if not deltas:
+            return 0
+        try:
+            with transaction.atomic():
+                for post_id, delta in deltas.items():
+                    MicroblogPost.objects.filter(pk=post_id).update(likes_count=F('likes_count') + delta)
+        except Exception:
+            # вернуть дельты, чтобы применить их в следующий раз
+            with self._lock:
+                for post_id, delta in deltas.items():
+                    self._deltas[post_id] = self._deltas.get(post_id, 0) + delta
+            raise
+        return len(deltas)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_like_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = LikeCounterBuffer(coalescing_settings()['FLUSH_INTERVAL_MS'] / 1000)
+    return _buffer
+
+
+def toggle_like(user, post_id):
+    """Ставит или снимает лайк; возвращает (liked, likes_count)"""
+    coalescing = coalescing_settings()['ENABLED']
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                PostLike.objects.create(user=user, post_id=post_id)
+            liked, delta = True, 1
+        except IntegrityError:
+            deleted, _ = PostLike.objects.filter(user=user, post_id=post_id).delete()
+            # лайк мог снять параллельный запрос — тогда счетчик не трогаем
+            liked, delta = False, -deleted
+
+        if delta and coalescing:
+            transaction.on_commit(partial(get_like_buffer().add, post_id, delta))
+        elif delta:
+            MicroblogPost.objects.filter(pk=post_id).update(likes_count=F('likes_count') + delta)
+
+    likes_count = MicroblogPost.objects.values_list('likes_count', flat=True).get(pk=post_id)
+    if coalescing:
+        likes_count += get_like_buffer().pending(post_id)
+    return liked, likes_count
@@ -0,0 +1,292 @@
+"""Живые итоги опросов через server-sent events.
+
+Страница итогов подписывается на /polls/<id>/results/stream/ и получает
+новые итоги без перезагрузки. Внутри процесса работает брокер: голос
+(results.apply_vote) и любое другое изменение итогов отправляют сигнал
+results_changed, брокер помечает вопрос и не чаще раза в INTERVAL
+секунд собирает один снимок итогов на всех его подписчиков. Медленный
+подписчик получает только последний снимок, очередь у него не копится.
+
+Поток отдает LiveResultsApp — ASGI-обертка вокруг приложения Django в
+mysite/asgi.py: ожидающее соединение — это корутина, а не поток, поэтому
+воркер держит тысячи открытых соединений. Под WSGI тот же адрес отвечает
+204, и браузер больше не переподключается.
+
+Брокер свой у каждого процесса: на голоса, принятые другими воркерами,
+подписчики узнают при перепроверке итогов раз в HEARTBEAT секунд.
+"""
+import asyncio
+import io
+import json
+import threading
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from .models import Question
+from .results import aget_results_snapshot, results_changed
+
+
+DEFAULTS = {
+    # не чаще одного сообщения за столько секунд на вопрос
+    'INTERVAL': 1.0,
+    # комментарий-пинг и перепроверка итогов, секунды
+    'HEARTBEAT': 15,
+    # пауза перед переподключением EventSource, миллисекунды
+    'RETRY_MS': 3000,
+}
+
+
+def live_settings():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_LIVE_RESULTS', {})}
+
+
+async def _close_old_connections():
+    # поток идет мимо обработчика Django: request_started и request_finished
+    # не срабатывают, и соединения с БД закрываются здесь
+    await sync_to_async(close_old_connections)()
+
+
+def _payload(snapshot):
+    return {
+        'total': snapshot['total'],
+        'choices': [
+            {'id': item['choice']['id'], 'votes': item['votes'], 'percentage': item['percentage']}
+            for item in snapshot['choices']
+        ],
+    }
+
+
+class _Subscriber:
+    """Слот последнего снимка: новый снимок заменяет непрочитанный"""
+
+    def __init__(self):
+        self.payload = None
+        self.event = asyncio.Event()
+
+    def push(self, payload):
+        self.payload = payload
+        self.event.set()
+
+    async def next(self, timeout):
+        """Следующий снимок или None, если за timeout ничего не пришло"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.event.clear()
+        return self.payload
+
+
+class _Topic:
+    """Подписчики одного вопроса; живет в цикле событий, где на него подписались"""
+
+    def __init__(self, question_id, interval):
+        self.question_id = question_id
+        self.interval = interval
+        self.loop = asyncio.get_running_loop()
+        self.subscribers = set()
+        self.latest = None
+        self.dirty = False
+        self.task = None
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.task is None:
+            self.task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self.dirty and self.subscribers:
+                self.dirty = False
+                try:
+                    payload = _payload(await aget_results_snapshot(self.question_id))
+                finally:
+                    await _close_old_connections()
+                if payload != self.latest:
+                    self.latest = payload
+                    for subscriber in self.subscribers:
+                        subscriber.push(payload)
+                # изменения за это время уйдут одним сообщением
+                await asyncio.sleep(self.interval)
+        finally:
+            self.task = None
+
+
+class ResultsBroker:
+    """Pub/sub итогов внутри процесса.
+
+    publish() можно вызывать из любого потока: в цикл событий подписчиков
+    передается только отметка «итоги изменились».
+    """
+
+    def __init__(self):
+        self._topics = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, question_id):
+        with self._lock:
+            topic = self._topics.get(question_id)
+            if topic is None or topic.loop.is_closed():
+                topic = self._topics[question_id] = _Topic(question_id, live_settings()['INTERVAL'])
+        subscriber = _Subscriber()
+        topic.subscribers.add(subscriber)
+        if topic.latest is not None:
+            subscriber.push(topic.latest)
+        else:
+            topic.mark_dirty()
+        return subscriber
+
+    def unsubscribe(self, question_id, subscriber):
+        with self._lock:
+            topic = self._topics.get(question_id)
+            if topic is None:
+                return
+            topic.subscribers.discard(subscriber)
+            if not topic.subscribers:
+                del self._topics[question_id]
+
+    def has_subscribers(self, question_id):
+        return question_id in self._topics
+
+    def refresh(self, question_id):
+        """Перепроверяет итоги вопроса; вызывается из цикла событий подписчиков"""
+        topic = self._topics.get(question_id)
+        if topic is not None:
+            topic.mark_dirty()
+
+    def publish(self, question_id):
+        topic = self._topics.get(question_id)
+        if topic is None:
+            return
+        try:
+            topic.loop.call_soon_threadsafe(topic.mark_dirty)
+        except RuntimeError:
+            # цикл событий уже закрыт
+            pass
+
+
+broker = ResultsBroker()
+
+
+@receiver(results_changed)
+def publish_results(sender, question_id, **kwargs):
+    broker.publish(question_id)
+
+
+def _event(payload):
+    return f'event: results\ndata: {json.dumps(payload, separators=(",", ":"))}\n\n'
+
+
+async def _stream(question_id):
+    options = live_settings()
+    subscriber = broker.subscribe(question_id)
+    try:
+        yield f'retry: {options["RETRY_MS"]}\n\n'
+        while True:
+            payload = await subscriber.next(options['HEARTBEAT'])
+            if payload is None:
+                broker.refresh(question_id)
+                yield ': ping\n\n'
+            else:
+                yield _event(payload)
+    finally:
+        broker.unsubscribe(question_id, subscriber)
+
+
+def results_stream(request, pk):
+    """Маршрут потока итогов для reverse() и WSGI.
+
+    Под ASGI запросы к нему перехватывает LiveResultsApp; сюда они
+    попадают только под WSGI, где ответ 204 останавливает EventSource.
+    """
+    return HttpResponse(status=204)
+
+
+async def _respond(send, status, headers=(), body=b''):
+    await send({'type': 'http.response.start', 'status': status, 'headers': list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class LiveResultsApp:
+    """ASGI-обертка, отдающая поток итогов в обход обработчика Django.
+
+    ASGIHandler держит у каждого запроса собственный поток для синхронного
+    кода (middleware, сигналы) до конца ответа, то есть поток на каждое
+    открытое соединение. Здесь соединение — только корутина: сессия и
+    пользователь проверяются асинхронно (кэш сессий и пользователя), а
+    остальные запросы уходят в обычное приложение Django.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        question_id = self._match(scope)
+        if question_id is None:
+            return await self.application(scope, receive, send)
+        await self._serve(scope, receive, send, question_id)
+
+    def _match(self, scope):
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return None
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            return None
+        if match.func is not results_stream:
+            return None
+        return match.kwargs['pk']
+
+    async def _serve(self, scope, receive, send, question_id):
+        request = ASGIRequest(scope, io.BytesIO())
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        )
+        await _close_old_connections()
+        try:
+            user = await aget_user(request)
+            # у вопроса с подписчиками существование уже проверено
+            exists = user.is_authenticated and (
+                broker.has_subscribers(question_id)
+                or await Question.objects.filter(pk=question_id).aexists()
+            )
+        finally:
+            await _close_old_connections()
+        if not user.is_authenticated:
+            return await _respond(send, 403)
+        if not exists:
+            return await _respond(send, 404)
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            # nginx не должен буферизовать поток
+            (b'x-accel-buffering', b'no'),
+        ]})
+        stream = _stream(question_id)
+
+        async def pump():
+            async for chunk in stream:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(_wait_disconnect(receive))]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await stream.aclose()
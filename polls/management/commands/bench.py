@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.benchmark import (
+    SCENARIOS, benchmark_database, compare_to_baseline, prepare_sessions, run_benchmark,
+    seed_benchmark_data,
+)
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный бенчмарк всех маршрутов polls на отдельной тестовой БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routes', default=','.join(SCENARIOS),
+                            help='Маршруты через запятую (по умолчанию все)')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на маршрут')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', default='bench_output.json')
+        parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.25)
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['routes'].split(',') if name.strip()]
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные маршруты: {", ".join(sorted(unknown))}')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        with benchmark_database():
+            ctx = seed_benchmark_data(
+                users=options['users'], questions=options['questions'],
+                posts=options['posts'], seed=options['seed'],
+            )
+            # сценарий vote голосует от имени разных пользователей
+            prepare_sessions(ctx)
+            report = run_benchmark(
+                ctx, names, options['concurrency'], options['requests'],
+                seed=options['seed'], progress=self._print_row,
+            )
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+        if baseline is not None:
+            regressions = compare_to_baseline(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно базовой линии нет'))
+
+    def _print_row(self, name, row):
+        self.stdout.write(
+            f'{name:<16} {row["rps"]:>8} rps  p50 {row["p50_ms"]:>8} мс  p95 {row["p95_ms"]:>8} мс  '
+            f'p99 {row["p99_ms"]:>8} мс  SQL/запрос {row["queries_per_request"]:>6}  ошибок {row["errors"]}'
+        )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from polls.benchmark import (
+    SCENARIOS, benchmark_database, prepare_sessions, run_async_scenario, run_scenario,
+    seed_benchmark_data,
+)
+
+
+# маршруты, у которых есть асинхронные представления (polls/async_views.py)
+ASYNC_ROUTES = ('index', 'detail', 'results', 'microblog_feed', 'user_profile')
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность синхронных (WSGI) и асинхронных (ASGI) представлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routes', default=','.join(ASYNC_ROUTES),
+                            help='Маршруты через запятую')
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help='Одновременных клиентов: потоков для WSGI, корутин для ASGI')
+        parser.add_argument('--requests', type=int, default=640, help='Запросов на маршрут')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['routes'].split(',') if name.strip()]
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные маршруты: {", ".join(sorted(unknown))}')
+
+        concurrency, requests, seed = options['concurrency'], options['requests'], options['seed']
+        self.stdout.write(
+            f'{"маршрут":<16} {"":<5} {"rps":>8} {"p50, мс":>9} {"p95, мс":>9} {"p99, мс":>9} {"ошибок":>7}'
+        )
+        # асинхронные представления по умолчанию выключены — стенд меряет именно их
+        with benchmark_database(), override_settings(POLLS_ASYNC_VIEWS=True):
+            ctx = seed_benchmark_data(users=50, questions=20, posts=200, seed=seed)
+            prepare_sessions(ctx)
+            for name in names:
+                # прогрев кэшей, чтобы обе стороны мерились в одинаковых условиях
+                run_scenario(ctx, name, 1, 1, seed)
+                sync_row = run_scenario(ctx, name, concurrency, requests, seed)
+                async_row = run_async_scenario(ctx, name, concurrency, requests, seed)
+                self._print_row(name, 'wsgi', sync_row)
+                self._print_row('', 'asgi', async_row)
+
+    def _print_row(self, name, mode, row):
+        self.stdout.write(
+            f'{name:<16} {mode:<5} {row["rps"]:>8} {row["p50_ms"]:>9} {row["p95_ms"]:>9} '
+            f'{row["p99_ms"]:>9} {row["errors"]:>7}'
+        )
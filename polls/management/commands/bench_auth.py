@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.benchmark import SCENARIOS, benchmark_database, measure_auth_queries, seed_benchmark_data
+
+
+READ_ROUTES = (
+    'index', 'detail', 'results', 'profile', 'user_profile', 'microblog_feed', 'create_question',
+)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает SQL-запросов на запрос без кэша сессий и пользователя и с ним'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routes', default=','.join(READ_ROUTES),
+                            help='Маршруты через запятую')
+        parser.add_argument('--requests', type=int, default=20, help='Запросов на маршрут')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['routes'].split(',') if name.strip()]
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные маршруты: {", ".join(sorted(unknown))}')
+
+        with benchmark_database():
+            ctx = seed_benchmark_data(users=10, questions=10, posts=50, seed=options['seed'])
+            measured = measure_auth_queries(ctx, names, options['requests'], seed=options['seed'])
+
+        self.stdout.write(f'{"маршрут":<16} {"без кэша":>9} {"с кэшем":>9} {"экономия":>9}')
+        for name, row in measured.items():
+            self.stdout.write(f'{name:<16} {row["db"]:>9} {row["cached"]:>9} {row["saved"]:>9}')
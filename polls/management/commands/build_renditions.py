@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from polls.images import AVATAR_RENDITIONS, QUESTION_RENDITIONS, build_renditions, is_local_file
+from polls.models import Question, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Строит недостающие рендиции аватаров и изображений вопросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        jobs = {}
+        for name in UserProfile.objects.values_list('avatar', flat=True).distinct().iterator():
+            if is_local_file(name):
+                jobs[name] = AVATAR_RENDITIONS
+        for name in Question.objects.exclude(image='').exclude(image=None).values_list('image', flat=True).distinct().iterator():
+            if is_local_file(name):
+                jobs[name] = QUESTION_RENDITIONS
+
+        created = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {name: pool.submit(build_renditions, name, kinds) for name, kinds in jobs.items()}
+            for name, future in futures.items():
+                try:
+                    created += future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{name}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Изображений: {len(jobs)}, создано файлов: {created}, ошибок: {failed}'
+        ))
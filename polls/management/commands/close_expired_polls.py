@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from polls.archive import archive_question, archive_settings, compact_votes, expired_questions
+from polls.models import QuestionArchive
+
+
+class Command(BaseCommand):
+    help = 'Замораживает итоги закрытых опросов в архиве; с --compact-votes удаляет их строки Vote'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Вопросов и строк Vote за один проход')
+        parser.add_argument('--compact-votes', action='store_true',
+                            help='Удалить строки Vote архивных вопросов и свернуть шарды счетчиков')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or archive_settings()['BATCH_SIZE']
+        last_id = 0
+        archived = 0
+        # expired_questions пересчитывается на каждом проходе — курсор по pk
+        # не зависит от того, что уже архивировано
+        while True:
+            ids = list(
+                expired_questions().filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            for question_id in ids:
+                archived += archive_question(question_id)
+        self.stdout.write(f'Архивировано вопросов: {archived}')
+
+        if options['compact_votes']:
+            compacted = deleted = 0
+            pending = QuestionArchive.objects.filter(votes_compacted_at__isnull=True).order_by('pk')
+            for question_id in pending.values_list('pk', flat=True).iterator():
+                deleted += compact_votes(question_id, batch_size)
+                compacted += 1
+            self.stdout.write(f'Сжато вопросов: {compacted}, удалено голосов: {deleted}')
+
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,66 @@
+import collections
+import datetime
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from polls.media import MEDIA_FIELDS, collect_orphans
+from polls.models import MediaBlob
+from polls.storage import is_content_addressed
+
+
+class Command(BaseCommand):
+    help = 'Удаляет медиафайлы без ссылок; с --rebuild сначала пересчитывает ссылки по БД и диску'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересчитать ссылки заново (после bulk-операций и ручных правок)')
+        parser.add_argument('--grace', type=int, help='Пауза перед удалением, секунды')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.rebuild()
+        grace = None if options['grace'] is None else datetime.timedelta(seconds=options['grace'])
+        collected = collect_orphans(grace)
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {collected}'))
+
+    def rebuild(self):
+        counts = collections.Counter()
+        for model, field in MEDIA_FIELDS.items():
+            for name in model.objects.exclude(**{field: ''}).values_list(field, flat=True).iterator():
+                if is_content_addressed(name):
+                    counts[name] += 1
+
+        # файлы на диске, о которых таблица не знает, тоже становятся кандидатами
+        root = default_storage.path('')
+        for directory, _, files in os.walk(root):
+            relative = os.path.relpath(directory, root).replace(os.sep, '/')
+            if relative.split('/')[0] == 'renditions':
+                continue
+            for filename in files:
+                name = filename if relative == '.' else f'{relative}/{filename}'
+                if is_content_addressed(name):
+                    counts.setdefault(name, 0)
+
+        now = timezone.now()
+        with transaction.atomic():
+            existing = {blob.name: blob for blob in MediaBlob.objects.all()}
+            changed, created = [], []
+            for name, refcount in counts.items():
+                blob = existing.pop(name, None)
+                orphaned_at = None
+                if not refcount:
+                    orphaned_at = blob.orphaned_at if blob and blob.orphaned_at else now
+                if blob is None:
+                    created.append(MediaBlob(name=name, refcount=refcount, orphaned_at=orphaned_at))
+                elif (blob.refcount, blob.orphaned_at) != (refcount, orphaned_at):
+                    blob.refcount, blob.orphaned_at = refcount, orphaned_at
+                    changed.append(blob)
+            MediaBlob.objects.bulk_create(created)
+            MediaBlob.objects.bulk_update(changed, ['refcount', 'orphaned_at'])
+            # файлов этих строк уже нет
+            MediaBlob.objects.filter(name__in=list(existing)).delete()
+        self.stdout.write(f'Ссылки пересчитаны: файлов {len(counts)}, новых {len(created)}, исправлено {len(changed)}')
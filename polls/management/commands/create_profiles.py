@@ -0,0 +1,65 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from polls.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Создает недостающие профили пользователей пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10_000)
+        parser.add_argument('--after-id', type=int, default=0,
+                            help='Продолжить с пользователей с id больше указанного')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        started = time.monotonic()
+        checked = created = 0
+        last_id = options['after_id']
+
+        # id читаются потоком, в памяти только текущая пачка
+        user_ids = (
+            User.objects.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+        )
+        chunk = []
+        for user_id in user_ids:
+            chunk.append(user_id)
+            if len(chunk) < chunk_size:
+                continue
+            created += self.backfill(chunk)
+            checked += len(chunk)
+            last_id = chunk[-1]
+            chunk = []
+            self.stdout.write(
+                f'[{time.monotonic() - started:6.1f} с] проверено {checked}, создано {created}, '
+                f'последний id {last_id}'
+            )
+        if chunk:
+            created += self.backfill(chunk)
+            checked += len(chunk)
+            last_id = chunk[-1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено пользователей: {checked}, создано профилей: {created}, '
+            f'последний id {last_id} ({time.monotonic() - started:.1f} с)'
+        ))
+
+    def backfill(self, chunk):
+        # анти-join по диапазону id пачки: пользователи без профиля
+        missing = list(
+            User.objects.filter(pk__gte=chunk[0], pk__lte=chunk[-1], profile__isnull=True)
+            .values_list('pk', flat=True)
+        )
+        if not missing:
+            return 0
+        # ignore_conflicts — профиль мог появиться параллельно при регистрации
+        with transaction.atomic():
+            UserProfile.objects.bulk_create(
+                [UserProfile(user_id=user_id) for user_id in missing], ignore_conflicts=True,
+            )
+        return len(missing)
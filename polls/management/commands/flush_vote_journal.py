@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from polls.vote_buffer import buffer_settings, flush_rotated_journals
+
+
+class Command(BaseCommand):
+    help = (
+        'Записывает в БД голоса из ротированных журналов (*.flushing), оставшихся после сбоев. '
+        'Текущий журнал воркера не трогается: его переигрывает сам воркер при запуске'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journal', help='JOURNAL_PATH воркера (по умолчанию из настроек)')
+
+    def handle(self, *args, **options):
+        created = flush_rotated_journals(options['journal'] or buffer_settings()['JOURNAL_PATH'])
+        self.stdout.write(self.style.SUCCESS(f'Записано голосов: {created}'))
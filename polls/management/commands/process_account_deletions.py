@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from polls.account_deletion import deletion_settings, process_account_deletions
+
+
+class Command(BaseCommand):
+    help = 'Удаляет пачками строки аккаунтов, поставленных в очередь на удаление'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Строк за одну транзакцию')
+
+    def handle(self, *args, **options):
+        deleted = process_account_deletions(options['batch_size'] or deletion_settings()['BATCH_SIZE'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено аккаунтов: {deleted}'))
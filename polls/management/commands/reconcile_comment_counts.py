@@ -0,0 +1,12 @@
+from polls.management.commands.reconcile_counters import Command as ReconcileCountersCommand
+
+
+class Command(ReconcileCountersCommand):
+    help = 'Заполняет и сверяет MicroblogPost.comments_count (то же, что reconcile_counters --only comments)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        super().handle(*args, **{**options, 'only': 'comments'})
@@ -0,0 +1,91 @@
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from polls.models import Choice, ChoiceVoteShard, Question, Vote
+from polls.reconcile import POST_COUNTERS, reconcile_post_counter
+from polls.results import invalidate_results
+from polls.voting import with_vote_totals
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счетчики голосов вариантов (Choice.votes + шарды), MicroblogPost.likes_count '
+        'и MicroblogPost.comments_count с реальными строками Vote, PostLike и PostComment. '
+        'Архивные опросы не трогаются. '
+        'При включенном POLLS_LIKE_COALESCING запускать, когда буферы лайков сброшены.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+        parser.add_argument('--only', choices=['votes', *POST_COUNTERS], help='Сверить только один счетчик')
+
+    def handle(self, *args, **options):
+        only, batch_size, dry_run = options['only'], options['batch_size'], options['dry_run']
+        if only in (None, 'votes'):
+            checked, fixed = self.reconcile_votes(batch_size, dry_run)
+            self.stdout.write(self.style.SUCCESS(f'Проверено вариантов: {checked}, исправлено: {fixed}'))
+        for name in POST_COUNTERS:
+            if only in (None, name):
+                checked, fixed = reconcile_post_counter(name, batch_size, dry_run, self.report_post)
+                self.stdout.write(self.style.SUCCESS(
+                    f'Проверено постов ({POST_COUNTERS[name][0]}): {checked}, исправлено: {fixed}'
+                ))
+
+    def report_post(self, pk, stored, actual):
+        self.stdout.write(f'Пост #{pk}: {stored} -> {actual}')
+
+    def reconcile_votes(self, batch_size, dry_run):
+        last_id = 0
+        checked = fixed = 0
+
+        while True:
+            question_ids = list(
+                Question.objects.filter(pk__gt=last_id, archive__isnull=True).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not question_ids:
+                break
+            last_id = question_ids[-1]
+
+            stored = {
+                pk: (question_id, total) for pk, question_id, total in
+                with_vote_totals(Choice.objects.filter(question_id__in=question_ids))
+                .values_list('pk', 'question_id', 'vote_total')
+            }
+            checked += len(stored)
+            actual = dict(
+                Vote.objects.filter(question_id__in=question_ids).order_by()
+                .values('choice_id').annotate(total=Count('pk')).values_list('choice_id', 'total')
+            )
+            drifted = [pk for pk, (_, total) in stored.items() if total != actual.get(pk, 0)]
+            if not drifted:
+                continue
+
+            for pk in drifted:
+                self.stdout.write(f'Вариант #{pk}: {stored[pk][1]} -> {actual.get(pk, 0)}')
+            if dry_run:
+                continue
+
+            # база = реальное число голосов минус шарды, оба подзапросом в самом
+            # UPDATE: голос, записанный между чтением и записью, не потеряется
+            votes = (
+                Vote.objects.filter(choice=OuterRef('pk'))
+                .order_by().values('choice').annotate(total=Count('pk')).values('total')
+            )
+            shards = (
+                ChoiceVoteShard.objects.filter(choice=OuterRef('pk'))
+                .order_by().values('choice').annotate(total=Sum('count')).values('total')
+            )
+            with transaction.atomic():
+                fixed += Choice.objects.filter(pk__in=drifted).update(
+                    votes=Coalesce(Subquery(votes), 0) - Coalesce(Subquery(shards), 0)
+                )
+                for question_id in {stored[pk][0] for pk in drifted}:
+                    transaction.on_commit(partial(invalidate_results, question_id))
+
+        return checked, fixed
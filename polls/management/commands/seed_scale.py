@@ -0,0 +1,262 @@
+import bisect
+import contextlib
+import datetime
+import itertools
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from polls.active_questions import VERSION_KEY as ACTIVE_QUESTIONS_VERSION_KEY
+from polls.cache_versions import bump_version
+from polls.models import (
+    Choice, MicroblogPost, PostComment, PostLike, Question, UserProfile, Vote,
+)
+
+
+class ZipfSampler:
+    """Выбор индексов 0..n-1 со степенным распределением популярности.
+
+    Самые популярные индексы перемешаны, чтобы «горячие» объекты не были
+    просто первыми по id.
+    """
+
+    def __init__(self, rng, n, exponent):
+        self.order = list(range(n))
+        rng.shuffle(self.order)
+        self.cum_weights = list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+    def weight(self, rank):
+        previous = self.cum_weights[rank - 1] if rank else 0
+        return (self.cum_weights[rank] - previous) / self.cum_weights[-1]
+
+    def pick(self, rng):
+        rank = bisect.bisect(self.cum_weights, rng.random() * self.cum_weights[-1])
+        return self.order[min(rank, len(self.order) - 1)]
+
+
+@contextlib.contextmanager
+def explicit_timestamps(*fields):
+    """Временно отключает auto_now/auto_now_add, чтобы записать свои даты"""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Генерирует большой объем реалистичных данных (пользователи, опросы, голоса, посты)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--questions', type=int, default=2_000)
+        parser.add_argument('--hot-questions', type=int, default=10,
+                            help='Сколько опросов получают основную массу голосов')
+        parser.add_argument('--votes', type=int, default=1_000_000)
+        parser.add_argument('--posts', type=int, default=200_000)
+        parser.add_argument('--likes', type=int, default=1_000_000)
+        parser.add_argument('--comments', type=int, default=500_000)
+        parser.add_argument('--history-days', type=int, default=3 * 365,
+                            help='Насколько в прошлое растягиваются даты')
+        parser.add_argument('--chunk-size', type=int, default=5_000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='seed', help='Префикс имен пользователей')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        # даты отсчитываются от начала текущих суток — повторный запуск в тот же день дает те же данные
+        self.anchor = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.history = datetime.timedelta(days=options['history_days'])
+        self.started = time.monotonic()
+
+        user_ids = self.seed_users(options['users'], options['prefix'])
+        question_ids, choices = self.seed_questions(options['questions'], user_ids)
+        self.seed_votes(options['votes'], options['hot_questions'], user_ids, question_ids, choices)
+        post_times = self.seed_posts(options['posts'], options['likes'], options['comments'], user_ids)
+        self.seed_likes(post_times, user_ids)
+        self.seed_comments(post_times, user_ids)
+
+        bump_version(ACTIVE_QUESTIONS_VERSION_KEY)
+        self.log('Готово')
+
+    # вспомогательное
+
+    def log(self, message):
+        self.stdout.write(f'[{time.monotonic() - self.started:7.1f} с] {message}')
+
+    def past_moment(self, recent_share=0.5):
+        """Дата в прошлом: половина недавних (последние 30 дней), остальные — за всю историю"""
+        if self.rng.random() < recent_share:
+            offset = self.rng.random() * datetime.timedelta(days=30)
+        else:
+            offset = self.rng.random() * self.history
+        return self.anchor - offset
+
+    def bulk_insert(self, model, objects, label):
+        created = []
+        total = 0
+        for start in range(0, len(objects), self.chunk_size):
+            with transaction.atomic():
+                created.extend(model.objects.bulk_create(objects[start:start + self.chunk_size]))
+            total += len(objects[start:start + self.chunk_size])
+        self.log(f'{label}: {total}')
+        return created
+
+    def stream_insert(self, model, objects, label):
+        """bulk_create из генератора порциями по chunk_size, без накопления в памяти"""
+        total = 0
+        while True:
+            chunk = list(itertools.islice(objects, self.chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                model.objects.bulk_create(chunk)
+            total += len(chunk)
+            if total % (self.chunk_size * 20) == 0:
+                self.log(f'{label}: {total}...')
+        self.log(f'{label}: {total}')
+
+    # этапы
+
+    def seed_users(self, count, prefix):
+        password = make_password(f'{prefix}-password')
+        users = [
+            User(
+                username=f'{prefix}{i}',
+                email=f'{prefix}{i}@example.com',
+                password=password,
+                date_joined=self.past_moment(recent_share=0.2),
+            )
+            for i in range(count)
+        ]
+        # bulk_create не шлет post_save, профили создаются отдельно пачками
+        user_ids = [user.pk for user in self.bulk_insert(User, users, 'Пользователи')]
+        self.bulk_insert(UserProfile, [UserProfile(user_id=user_id) for user_id in user_ids], 'Профили')
+        return user_ids
+
+    def seed_questions(self, count, user_ids):
+        authors = ZipfSampler(self.rng, len(user_ids), 1.1)
+        questions = []
+        for i in range(count):
+            pub_date = self.past_moment()
+            # часть опросов уже закрыта, часть идет, несколько еще не опубликованы
+            if self.rng.random() < 0.05:
+                pub_date = self.anchor + self.rng.random() * datetime.timedelta(days=7)
+            questions.append(Question(
+                question_text=f'Опрос {i}',
+                short_description=f'Краткое описание опроса {i}',
+                full_description=f'Полное описание опроса {i}',
+                pub_date=pub_date,
+                expiration_date=pub_date + datetime.timedelta(days=self.rng.choice((1, 7, 30, 90))),
+                author_id=user_ids[authors.pick(self.rng)],
+            ))
+        question_ids = [question.pk for question in self.bulk_insert(Question, questions, 'Опросы')]
+
+        choice_objs = [
+            Choice(question_id=question_id, choice_text=f'Вариант {j + 1}')
+            for question_id in question_ids
+            for j in range(self.rng.randint(2, 4))
+        ]
+        choices = {}
+        for choice in self.bulk_insert(Choice, choice_objs, 'Варианты'):
+            choices.setdefault(choice.question_id, []).append(choice.pk)
+        return question_ids, choices
+
+    def seed_votes(self, total, hot, user_ids, question_ids, choices):
+        # горячие опросы получают половину голосов, остальное — по Ципфу
+        popularity = ZipfSampler(self.rng, len(question_ids), 1.0)
+        hot = min(hot, len(question_ids))
+        per_question = {}
+        for rank in range(len(question_ids)):
+            share = (0.5 / hot if rank < hot else 0) + 0.5 * popularity.weight(rank)
+            per_question[question_ids[popularity.order[rank]]] = min(len(user_ids), round(total * share))
+
+        counts = {}
+
+        def votes():
+            for question_id, amount in per_question.items():
+                options = choices[question_id]
+                # у каждого опроса есть явный фаворит
+                weights = [self.rng.random() ** 2 for _ in options]
+                for index in self.rng.sample(range(len(user_ids)), amount):
+                    choice_id = self.rng.choices(options, weights)[0]
+                    counts[choice_id] = counts.get(choice_id, 0) + 1
+                    yield Vote(user_id=user_ids[index], question_id=question_id,
+                               choice_id=choice_id, voted_at=self.past_moment())
+
+        with explicit_timestamps(Vote._meta.get_field('voted_at')):
+            self.stream_insert(Vote, votes(), 'Голоса')
+
+        # счетчики вариантов — одной пачкой обновлений
+        updated = [Choice(pk=choice_id, votes=amount) for choice_id, amount in counts.items()]
+        with transaction.atomic():
+            Choice.objects.bulk_update(updated, ['votes'], batch_size=self.chunk_size)
+        self.log(f'Счетчики вариантов: {len(updated)}')
+
+    def seed_posts(self, count, likes, comments, user_ids):
+        authors = ZipfSampler(self.rng, len(user_ids), 1.2)
+        popularity = ZipfSampler(self.rng, count, 1.0) if count else None
+        posts = []
+        for i in range(count):
+            created_at = self.past_moment()
+            posts.append(MicroblogPost(
+                author_id=user_ids[authors.pick(self.rng)],
+                content=f'Пост {i}\n' + 'Текст поста. ' * self.rng.randint(1, 20),
+                created_at=created_at,
+                updated_at=created_at,
+            ))
+
+        # лайки и комментарии распределены по популярности постов; без
+        # постов их ставить некуда
+        like_counts = [0] * count
+        comment_counts = [0] * count
+        if popularity is not None:
+            for _ in range(likes):
+                like_counts[popularity.pick(self.rng)] += 1
+            for _ in range(comments):
+                comment_counts[popularity.pick(self.rng)] += 1
+        for post, like_count, comment_count in zip(posts, like_counts, comment_counts):
+            post.likes_count = min(like_count, len(user_ids))
+            post.comments_count = comment_count
+
+        fields = [MicroblogPost._meta.get_field(name) for name in ('created_at', 'updated_at')]
+        with explicit_timestamps(*fields):
+            created = self.bulk_insert(MicroblogPost, posts, 'Посты')
+        return [(post.pk, post.created_at, post.likes_count, post.comments_count) for post in created]
+
+    def seed_likes(self, posts, user_ids):
+        def likes():
+            for post_id, created_at, like_count, _ in posts:
+                for index in self.rng.sample(range(len(user_ids)), like_count):
+                    yield PostLike(user_id=user_ids[index], post_id=post_id,
+                                   created_at=self._after(created_at))
+
+        with explicit_timestamps(PostLike._meta.get_field('created_at')):
+            self.stream_insert(PostLike, likes(), 'Лайки')
+
+    def seed_comments(self, posts, user_ids):
+        def comments():
+            for post_id, created_at, _, comment_count in posts:
+                for _ in range(comment_count):
+                    moment = self._after(created_at)
+                    yield PostComment(post_id=post_id,
+                                      author_id=user_ids[self.rng.randrange(len(user_ids))],
+                                      content='Комментарий', created_at=moment, updated_at=moment)
+
+        fields = [PostComment._meta.get_field(name) for name in ('created_at', 'updated_at')]
+        with explicit_timestamps(*fields):
+            self.stream_insert(PostComment, comments(), 'Комментарии')
+
+    def _after(self, moment):
+        """Случайный момент между moment и началом текущих суток"""
+        span = max(self.anchor - moment, datetime.timedelta(0))
+        return moment + self.rng.random() * span
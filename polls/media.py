@@ -0,0 +1,131 @@
+"""Учет ссылок на файлы хранилища с адресацией по содержимому.
+
+Каждое сохранение аватара или картинки вопроса увеличивает счетчик ссылок
+нового файла и уменьшает у прежнего; удаление профиля или вопроса —
+уменьшает. Файл с нулевым счетчиком удаляется вместе с рендициями
+сборщиком collect_orphans (команда collect_media) не раньше чем через
+POLLS_MEDIA_ORPHAN_GRACE секунд. Пауза нужна, потому что загрузка того же
+содержимого находит уже существующий файл еще до того, как ссылка на
+него будет учтена.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.signals import post_delete, post_init, post_save
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+from .images import delete_renditions
+from .models import MediaBlob, Question, UserProfile
+from .storage import is_content_addressed
+
+
+# модель -> поле с файлом
+MEDIA_FIELDS = {
+    UserProfile: 'avatar',
+    Question: 'image',
+}
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def orphan_grace():
+    return datetime.timedelta(seconds=getattr(settings, 'POLLS_MEDIA_ORPHAN_GRACE', 60 * 60))
+
+
+def incref(name):
+    if not is_content_addressed(name):
+        return
+    updated = MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, orphaned_at=None)
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, refcount=1)
+    except IntegrityError:
+        # строку успел создать параллельный запрос
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, orphaned_at=None)
+
+
+def decref(name):
+    if not is_content_addressed(name):
+        return
+    MediaBlob.objects.filter(name=name, refcount__gt=0).update(
+        refcount=F('refcount') - 1,
+        orphaned_at=Case(When(refcount=1, then=Value(timezone.now())), default=F('orphaned_at')),
+    )
+
+
+def collect_orphans(grace=None, batch_size=500):
+    """Удаляет файлы без ссылок, осиротевшие раньше чем grace назад; возвращает их число"""
+    cutoff = timezone.now() - (orphan_grace() if grace is None else grace)
+    collected = 0
+    while True:
+        names = list(
+            MediaBlob.objects.filter(refcount=0, orphaned_at__lte=cutoff)
+            .order_by('pk').values_list('name', flat=True)[:batch_size]
+        )
+        if not names:
+            return collected
+        for name in names:
+            # условие повторяется под блокировкой строки: если ссылка появилась
+            # или загрузка продлила паузу после выборки, файл остается. Файл
+            # удаляется до фиксации, пока сохранение того же содержимого ждет
+            # блокировку (polls/storage.py)
+            with transaction.atomic():
+                blob = (
+                    MediaBlob.objects.select_for_update()
+                    .filter(name=name, refcount=0, orphaned_at__lte=cutoff).first()
+                )
+                if blob is None:
+                    continue
+                blob.delete()
+                default_storage.delete(name)
+            delete_renditions(name)
+            collected += 1
+
+
+def _media_name(instance, field):
+    # отложенное поле не трогаем, чтобы не вызвать лишний запрос
+    if field not in instance.__dict__:
+        return None
+    return getattr(instance, field).name or None
+
+
+def remember_media_name(sender, instance, **kwargs):
+    instance._media_name = _media_name(instance, MEDIA_FIELDS[sender])
+
+
+def track_media_save(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    field = MEDIA_FIELDS[sender]
+    if raw or (update_fields is not None and field not in update_fields):
+        return
+    if field not in instance.__dict__:
+        return
+    old, new = (None if created else instance._media_name), _media_name(instance, field)
+    if old != new:
+        incref(new)
+        decref(old)
+    instance._media_name = new
+
+
+def track_media_delete(sender, instance, **kwargs):
+    decref(getattr(instance, '_media_name', None))
+
+
+for model in MEDIA_FIELDS:
+    post_init.connect(remember_media_name, sender=model)
+    post_save.connect(track_media_save, sender=model)
+    post_delete.connect(track_media_delete, sender=model)
+
+
+def serve_media(request, path):
+    """Отдает медиафайл; файлы с адресацией по содержимому — с бессрочным кэшем"""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_content_addressed(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
@@ -0,0 +1,288 @@
+"""Метрики запросов к представлениям polls и их выдача в формате Prometheus.
+
+RequestMetricsMiddleware для каждого запроса, разрешенного в пространство
+имен polls, замеряет общее время, число и время SQL-запросов, время
+рендеринга шаблонов и размер ответа. Значения попадают в гистограммы,
+которые каждый поток ведет у себя (без блокировок на горячем пути);
+при выдаче /metrics шарды потоков суммируются.
+
+Статистика текущего запроса хранится в contextvars, а не в потоке: под
+ASGI один поток обслуживает много запросов сразу, а SQL асинхронного ORM
+выполняется в другом потоке. Счетчик SQL ставится на каждое соединение и
+находит статистику запроса по контексту.
+
+Запросы дольше SLOW_REQUEST_SECONDS пишутся в лог polls.slow_requests
+вместе с их SQL.
+
+/metrics отдается сотрудникам (is_staff) и по заголовку
+Authorization: Bearer <TOKEN>. Проверка по адресу клиента не годится: за
+обратным прокси REMOTE_ADDR всегда адрес самого прокси.
+"""
+import contextvars
+import hmac
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import Template as DjangoTemplate
+
+
+logger = logging.getLogger('polls.slow_requests')
+
+DEFAULTS = {
+    'ENABLED': True,
+    # токен сборщика метрик; None — только для сотрудников
+    'TOKEN': None,
+    'SLOW_REQUEST_SECONDS': None,
+}
+
+# имя метрики -> (описание, границы корзин)
+HISTOGRAMS = {
+    'polls_request_duration_seconds': (
+        'Время обработки запроса',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'polls_request_sql_queries': (
+        'Число SQL-запросов на запрос',
+        (0, 1, 2, 5, 10, 20, 50, 100, 200),
+    ),
+    'polls_request_sql_duration_seconds': (
+        'Суммарное время SQL-запросов',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+    'polls_request_template_seconds': (
+        'Время рендеринга шаблонов',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    ),
+    'polls_response_size_bytes': (
+        'Размер тела ответа',
+        (512, 1024, 4096, 16384, 65536, 262144, 1048576),
+    ),
+}
+
+
+def metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_METRICS', {})}
+
+
+class MetricsRegistry:
+    """Гистограммы с шардированием по потокам.
+
+    Каждый поток пишет только в свой шард, поэтому observe() не берет
+    блокировок; блокировка нужна лишь при первом обращении потока.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, name, view, value):
+        shard = self._shard()
+        key = (name, view)
+        # [счетчики по корзинам..., +Inf, сумма]
+        row = shard.get(key)
+        if row is None:
+            row = shard[key] = [0] * (len(HISTOGRAMS[name][1]) + 1) + [0.0]
+        bounds = HISTOGRAMS[name][1]
+        index = len(bounds)
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                index = i
+                break
+        row[index] += 1
+        row[-1] += value
+
+    def collect(self):
+        """{(name, view): [счетчики..., сумма]} — сумма по всем шардам"""
+        with self._shards_lock:
+            shards = list(self._shards)
+        totals = {}
+        for shard in shards:
+            for key, row in list(shard.items()):
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = list(row)
+                else:
+                    for i, value in enumerate(row):
+                        total[i] += value
+        return totals
+
+    def render_prometheus(self):
+        totals = self.collect()
+        lines = []
+        for name, (description, bounds) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, view), row in sorted(totals.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip([*bounds, '+Inf'], row[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{view="{view}"}} {row[-1]}')
+                lines.append(f'{name}_count{{view="{view}"}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+_current = contextvars.ContextVar('polls_request_stats', default=None)
+
+
+class _RequestStats:
+    def __init__(self, capture_sql):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.capture_sql = capture_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.sql_time += elapsed
+            if self.capture_sql:
+                self.statements.append((elapsed, sql))
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def _install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _install_template_timer():
+    """Оборачивает рендеринг шаблонов Django, чтобы учитывать его время"""
+    if getattr(DjangoTemplate.render, 'polls_timed', False):
+        return
+    original = DjangoTemplate.render
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return original(self, context, request)
+        # вложенные рендеры уже учтены во внешнем
+        stats.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_time += time.perf_counter() - started
+
+    render.polls_timed = True
+    DjangoTemplate.render = render
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        options = metrics_settings()
+        self.enabled = options['ENABLED']
+        self.slow_threshold = options['SLOW_REQUEST_SECONDS']
+        if self.enabled:
+            _install_template_timer()
+            # соединения потоков асинхронного ORM создаются позже
+            connection_created.connect(_install_query_recorder, dispatch_uid='polls_metrics_queries')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        _install_query_recorder(connection)
+        stats = _RequestStats(capture_sql=self.slow_threshold is not None)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        stats = _RequestStats(capture_sql=self.slow_threshold is not None)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def _record(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        if match is None or match.namespace != 'polls' or match.url_name == 'metrics':
+            return
+
+        view = match.view_name
+        size = 0 if response.streaming else len(response.content)
+        registry.observe('polls_request_duration_seconds', view, elapsed)
+        registry.observe('polls_request_sql_queries', view, stats.queries)
+        registry.observe('polls_request_sql_duration_seconds', view, stats.sql_time)
+        registry.observe('polls_request_template_seconds', view, stats.template_time)
+        registry.observe('polls_response_size_bytes', view, size)
+
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            logger.warning(
+                'Медленный запрос %s %s (%s): %.3f с, SQL: %d запросов за %.3f с, шаблоны %.3f с\n%s',
+                request.method, request.path, view, elapsed, stats.queries, stats.sql_time,
+                stats.template_time,
+                '\n'.join(f'  [{duration * 1000:.1f} мс] {sql}' for duration, sql in stats.statements),
+            )
+
+
+def _has_metrics_token(request):
+    token = metrics_settings()['TOKEN']
+    if not token:
+        return False
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus"""
+    if not _has_metrics_token(request) and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
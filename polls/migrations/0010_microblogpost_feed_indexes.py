@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_choicevoteshard'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='microblogpost',
+            options={'ordering': ['-created_at', '-id'], 'verbose_name': 'Пост микроблога', 'verbose_name_plural': 'Посты микроблога'},
+        ),
+        migrations.AddIndex(
+            model_name='microblogpost',
+            index=models.Index(fields=['-created_at', '-id'], name='post_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='microblogpost',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='post_author_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:14
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_comments_count(apps, schema_editor):
+    MicroblogPost = apps.get_model('polls', 'MicroblogPost')
+    PostComment = apps.get_model('polls', 'PostComment')
+    counts = (
+        PostComment.objects.filter(post=OuterRef('pk'))
+        .order_by().values('post').annotate(total=Count('pk')).values('total')
+    )
+    MicroblogPost.objects.update(comments_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_microblogpost_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='microblogpost',
+            name='comments_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_comments_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_media_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionArchive',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='polls.question')),
+                ('total', models.PositiveIntegerField()),
+                ('choice_counts', models.JSONField()),
+                ('closed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('votes_compacted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
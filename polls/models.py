@@ -21,26 +21,50 @@ class UserProfile(models.Model):
     def __str__(self):
         return f'Profile of {self.user.username}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance._tracked_values()
+        return instance
+
+    def _tracked_values(self):
+        return {
+            field.attname: field.get_prep_value(getattr(self, field.attname))
+            for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname in self.__dict__
+        }
+
+    def changed_fields(self):
+        """Поля, измененные с момента загрузки из БД"""
+        loaded = getattr(self, '_loaded_values', {})
+        return [
+            name for name, value in self._tracked_values().items()
+            if name not in loaded or loaded[name] != value
+        ]
+
     def save(self, *args, **kwargs):
-        # Можно добавить обработку изображения при сохранении
+        # существующий профиль пишется только измененными полями, без изменений — не пишется
+        if not self._state.adding and hasattr(self, '_loaded_values') and not (
+            args or kwargs.get('update_fields') is not None or kwargs.get('force_insert')
+        ):
+            changed = self.changed_fields()
+            if not changed:
+                return
+            kwargs['update_fields'] = changed
         super().save(*args, **kwargs)
+        self._loaded_values = self._tracked_values()
 
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-
-    # профиль пользователя при
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    """Создает профиль один раз, при создании пользователя.
 
-    if created:
-        # аватар по
-        default_avatar = 'media/avatars/ez.jpg'
-        UserProfile.objects.create(user=instance, avatar=default_avatar)
-
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """Сохраняет профиль пользователя при сохранении пользователя"""
-    instance.profile.save()
+    Начальные значения полей профиля можно передать через атрибут
+    profile_defaults пользователя до его сохранения (так делает форма
+    регистрации).
+    """
+    if created and not raw:
+        UserProfile.objects.create(user=instance, **getattr(instance, 'profile_defaults', {}))
 
 
 class Question(models.Model):
@@ -79,6 +103,22 @@ class Choice(models.Model):
         return self.choice_text
 
 
+class ChoiceVoteShard(models.Model):
+    """Шард счетчика голосов варианта ответа.
+
+    Итоговое число голосов = Choice.votes + сумма count по всем шардам варианта.
+    """
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='vote_shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['choice', 'shard']
+
+    def __str__(self):
+        return f'{self.choice_id}#{self.shard}: {self.count}'
+
+
 class Vote(models.Model):
     """Модель для отслеживания голосов пользователей"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -100,9 +140,15 @@ class MicroblogPost(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     likes_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # курсорная пагинация ленты и постов автора по (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='post_feed_idx'),
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_feed_idx'),
+        ]
         verbose_name = 'Пост микроблога'
         verbose_name_plural = 'Посты микроблога'
 
@@ -110,7 +156,7 @@ class MicroblogPost(models.Model):
         return f'Пост от {self.author.username}'
 
     def get_comment_count(self):
-        return self.comments.count()
+        return self.comments_count
 
 
 class PostLike(models.Model):
@@ -142,4 +188,44 @@ class PostComment(models.Model):
         verbose_name_plural = 'Комментарии'
 
     def __str__(self):
-        return f'Комментарий от {self.author.username}'
\ No newline at end of file
+        return f'Комментарий от {self.author.username}'
+
+
+class MediaBlob(models.Model):
+    """Файл хранилища с адресацией по содержимому и число ссылок на него.
+
+    Файл с нулевым числом ссылок удаляется сборщиком (collect_media) после
+    паузы orphaned_at, чтобы не удалить файл, который как раз загружают снова.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    orphaned_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+
+class QuestionArchive(models.Model):
+    """Окончательные итоги закрытого опроса (polls/archive.py).
+
+    choice_counts — [[choice_id, choice_text, votes], ...] в порядке вариантов.
+    Запись не меняется; после сжатия (votes_compacted_at) строк Vote по
+    вопросу больше нет.
+    """
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    total = models.PositiveIntegerField()
+    choice_counts = models.JSONField()
+    closed_at = models.DateTimeField(default=timezone.now)
+    votes_compacted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Архив вопроса #{self.question_id}: {self.total}'
+
+
+class AccountDeletion(models.Model):
+    """Запрошенное удаление аккаунта; строки пользователя удаляются в фоне (polls/account_deletion.py)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='deletion')
+    requested_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'Удаление аккаунта #{self.user_id}'
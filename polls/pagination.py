@@ -0,0 +1,116 @@
+"""Курсорная (keyset) пагинация по (created_at, id).
+
+В отличие от Paginator не выполняет COUNT(*) и не использует OFFSET:
+страница выбирается условием по ключу последней/первой записи соседней
+страницы, поэтому глубокие страницы стоят столько же, сколько первая.
+Курсоры непрозрачны для клиента (base64 от направления и ключа).
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .async_utils import aslist
+
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, obj):
+    payload = json.dumps([direction, obj.created_at.isoformat(), obj.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(direction, created_at, pk) или None для пустого/битого курсора"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, created_at, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = datetime.datetime.fromisoformat(created_at)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or not isinstance(pk, int):
+        return None
+    return direction, created_at, pk
+
+
+class KeysetPage:
+    """Страница курсорной пагинации; совместима с циклом {% for %} в шаблонах"""
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(NEXT, self.object_list[-1]) if self.has_next() else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(PREVIOUS, self.object_list[0]) if self.has_previous() else None
+
+
+class KeysetPaginator:
+    """Пагинация queryset в порядке (-created_at, -id)"""
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    @cached_property
+    def count(self):
+        """Точное число записей — считается только если к нему обратились"""
+        return self.queryset.order_by().count()
+
+    def _page_query(self, token):
+        """(queryset на per_page + 1 строк, функция, собирающая из них страницу)"""
+        cursor = decode_cursor(token)
+        limit = self.per_page + 1
+
+        if cursor is None:
+            rows = self.queryset.order_by('-created_at', '-id')[:limit]
+            return rows, lambda rows: KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, False)
+
+        direction, created_at, pk = cursor
+        if direction == NEXT:
+            rows = (
+                self.queryset
+                .filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+                .order_by('-created_at', '-id')[:limit]
+            )
+            return rows, lambda rows: KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, True)
+
+        rows = (
+            self.queryset
+            .filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            .order_by('created_at', 'id')[:limit]
+        )
+        return rows, lambda rows: KeysetPage(rows[:self.per_page][::-1], self, True, len(rows) > self.per_page)
+
+    def get_page(self, token):
+        rows, build = self._page_query(token)
+        return build(list(rows))
+
+    async def aget_page(self, token):
+        rows, build = self._page_query(token)
+        return build(await aslist(rows))
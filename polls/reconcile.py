@@ -0,0 +1,66 @@
+"""Сверка денормализованных счетчиков постов с реальными строками.
+
+likes_count и comments_count ведутся F-выражениями и могут разойтись с
+таблицами лайков и комментариев (старые данные, удаления в обход
+представлений). Посты проходятся пачками по id; счетчик пересчитывается
+подзапросом в самом UPDATE, чтобы не затереть строки, добавленные между
+чтением и записью.
+"""
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import MicroblogPost, PostComment, PostLike
+
+
+# имя -> (поле счетчика, модель строк с FK post)
+POST_COUNTERS = {
+    'likes': ('likes_count', PostLike),
+    'comments': ('comments_count', PostComment),
+}
+
+
+def reconcile_post_counter(name, batch_size, dry_run=False, report=None):
+    """Сверяет счетчик name из POST_COUNTERS; возвращает (проверено, исправлено).
+
+    report(pk, stored, actual) вызывается на каждый разошедшийся пост.
+    """
+    field, related_model = POST_COUNTERS[name]
+    last_id = 0
+    checked = fixed = 0
+
+    while True:
+        posts = dict(
+            MicroblogPost.objects.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', field)[:batch_size]
+        )
+        if not posts:
+            break
+        last_id = max(posts)
+        checked += len(posts)
+
+        actual = dict(
+            related_model.objects.filter(post_id__in=posts).order_by()
+            .values('post_id').annotate(total=Count('pk')).values_list('post_id', 'total')
+        )
+        drifted = [pk for pk, stored in posts.items() if stored != actual.get(pk, 0)]
+        if not drifted:
+            continue
+
+        if report is not None:
+            for pk in drifted:
+                report(pk, posts[pk], actual.get(pk, 0))
+        if dry_run:
+            continue
+
+        # карточки постов кэшируются по значениям счетчиков — старые просто перестанут читаться
+        counts = (
+            related_model.objects.filter(post=OuterRef('pk'))
+            .order_by().values('post').annotate(total=Count('pk')).values('total')
+        )
+        with transaction.atomic():
+            fixed += MicroblogPost.objects.filter(pk__in=drifted).update(
+                **{field: Coalesce(Subquery(counts), 0)}
+            )
+
+    return checked, fixed
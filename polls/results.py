@@ -0,0 +1,153 @@
+"""Кэшированные снимки результатов опросов.
+
+Снимок вопроса хранится в кэше набором ключей под общей версией:
+список вариантов (meta) и отдельный счетчик на каждый вариант. Новый голос
+увеличивает счетчик через cache.incr, без пересчета всего снимка; любое
+другое изменение (правка вариантов, удаление голосов) поднимает версию,
+и следующий запрос собирает снимок заново одним агрегирующим запросом.
+
+Сборка снимка гоняется с голосами: голос, закоммиченный между чтением
+счетчиков из БД и записью снимка в кэш, не должен потеряться. Поэтому
+снимок пишется через cache.add (не затирая счетчики, уже увеличенные
+голосом), а голос, не нашедший счетчика при известной версии, поднимает
+версию — недособранный снимок остается под старой версией и не читается.
+Сброс из сигналов моделей выполняется после коммита, чтобы параллельный
+запрос не закэшировал под новой версией данные до коммита.
+
+Оба случая отправляют сигнал results_changed (на него подписана живая
+трансляция итогов в polls/live.py).
+"""
+from django.conf import settings
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .async_utils import aslist
+from .cache_versions import aget_version, bump_version, get_version
+from .models import Choice, Question, Vote
+from .voting import with_vote_totals
+
+
+VERSION_KEY = 'polls:results:ver:{question_id}'
+META_KEY = 'polls:results:{question_id}:v{version}:meta'
+COUNT_KEY = 'polls:results:{question_id}:v{version}:c{choice_id}'
+
+# итоги вопроса изменились; аргумент question_id
+results_changed = Signal()
+
+
+def snapshot_ttl():
+    return getattr(settings, 'POLLS_RESULTS_SNAPSHOT_TTL', 60 * 60)
+
+
+def invalidate_results(question_id):
+    """Сбрасывает снимок вопроса; он будет собран заново при следующем чтении"""
+    bump_version(VERSION_KEY.format(question_id=question_id))
+    results_changed.send(sender=None, question_id=question_id)
+
+
+def apply_vote(question_id, choice_id, amount=1):
+    """Инкрементально учитывает голоса в закэшированном снимке, если он есть"""
+    version = get_version(VERSION_KEY.format(question_id=question_id), create=False)
+    if version is not None:
+        key = COUNT_KEY.format(question_id=question_id, version=version, choice_id=choice_id)
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            # счетчик вытеснен или снимок как раз собирается по данным до
+            # этого голоса — такой снимок читаться не должен
+            bump_version(VERSION_KEY.format(question_id=question_id))
+    results_changed.send(sender=None, question_id=question_id)
+
+
+def _build_snapshot(meta, counts):
+    total = sum(counts.values())
+    choices = []
+    for choice_id, choice_text in meta:
+        votes = counts[choice_id]
+        percentage = votes / total * 100 if total else 0
+        choices.append({
+            'choice': {'id': choice_id, 'choice_text': choice_text},
+            'votes': votes,
+            'percentage': round(percentage, 1),
+        })
+    return {'total': total, 'choices': choices}
+
+
+def _count_keys(question_id, version, meta):
+    return {
+        COUNT_KEY.format(question_id=question_id, version=version, choice_id=choice_id): choice_id
+        for choice_id, _ in meta
+    }
+
+
+def _snapshot_rows(question_id):
+    return with_vote_totals(
+        Choice.objects.filter(question_id=question_id).order_by('id')
+    ).values_list('id', 'choice_text', 'vote_total')
+
+
+def get_results_snapshot(question_id):
+    """Итоги вопроса: {'total': ..., 'choices': [{'choice', 'votes', 'percentage'}]}.
+
+    Общее число голосов — сумма по вариантам, поэтому проценты всегда
+    в сумме дают 100%.
+    """
+    version = get_version(VERSION_KEY.format(question_id=question_id))
+    meta_key = META_KEY.format(question_id=question_id, version=version)
+    meta = cache.get(meta_key)
+
+    if meta is not None:
+        count_keys = _count_keys(question_id, version, meta)
+        cached = cache.get_many(list(count_keys))
+        if len(cached) == len(count_keys):
+            return _build_snapshot(meta, {count_keys[key]: value for key, value in cached.items()})
+
+    rows = list(_snapshot_rows(question_id))
+    meta = [(choice_id, choice_text) for choice_id, choice_text, _ in rows]
+    counts = {choice_id: votes for choice_id, _, votes in rows}
+
+    ttl = snapshot_ttl()
+    # add, а не set: счетчик, уже увеличенный голосом, не затирается
+    for key, choice_id in _count_keys(question_id, version, meta).items():
+        cache.add(key, counts[choice_id], ttl)
+    cache.add(meta_key, meta, ttl)
+    return _build_snapshot(meta, counts)
+
+
+async def aget_results_snapshot(question_id):
+    """Асинхронный вариант get_results_snapshot"""
+    version = await aget_version(VERSION_KEY.format(question_id=question_id))
+    meta_key = META_KEY.format(question_id=question_id, version=version)
+    meta = await cache.aget(meta_key)
+
+    if meta is not None:
+        count_keys = _count_keys(question_id, version, meta)
+        cached = await cache.aget_many(list(count_keys))
+        if len(cached) == len(count_keys):
+            return _build_snapshot(meta, {count_keys[key]: value for key, value in cached.items()})
+
+    rows = await aslist(_snapshot_rows(question_id))
+    meta = [(choice_id, choice_text) for choice_id, choice_text, _ in rows]
+    counts = {choice_id: votes for choice_id, _, votes in rows}
+
+    ttl = snapshot_ttl()
+    for key, choice_id in _count_keys(question_id, version, meta).items():
+        await cache.aadd(key, counts[choice_id], ttl)
+    await cache.aadd(meta_key, meta, ttl)
+    return _build_snapshot(meta, counts)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+@receiver(post_delete, sender=Vote)
+def invalidate_on_change(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_results, instance.question_id))
+
+
+@receiver(post_delete, sender=Question)
+def invalidate_on_question_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(cache.delete, VERSION_KEY.format(question_id=instance.pk)))
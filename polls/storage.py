@@ -0,0 +1,89 @@
+"""Хранилище медиафайлов с адресацией по содержимому.
+
+Имя файла — SHA-256 его содержимого внутри каталога upload_to:
+avatars/3f/3fa9...c1.jpg. Одинаковые загрузки ложатся в один файл, а
+файл под таким именем никогда не меняется, поэтому его можно отдавать с
+бессрочным кэшированием. Учет ссылок и удаление осиротевших файлов —
+в polls/media.py.
+
+Решение переиспользовать существующий файл принимается под блокировкой
+строки MediaBlob: сборщик удаляет файл под той же блокировкой, а сохранение
+продлевает паузу orphaned_at, так что файл не исчезнет между проверкой и
+учетом ссылки на него.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MediaBlob
+
+
+CONTENT_NAME_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}\.[0-9a-z]+$')
+
+
+def is_content_addressed(name):
+    return bool(name) and CONTENT_NAME_RE.search(name) is not None
+
+
+def content_name(name, digest):
+    directory, filename = posixpath.split(name)
+    ext = os.path.splitext(filename)[1].lower() or '.bin'
+    return posixpath.join(directory, digest[:2], digest + ext)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # имя определяется содержимым, суффиксы для уникальности не нужны
+        return name
+
+    def _save(self, name, content):
+        # хеш мог быть посчитан еще при приеме загрузки (polls/uploads.py)
+        digest = getattr(content, 'content_hash', None)
+        if digest is None:
+            hasher = hashlib.sha256()
+            for chunk in content.chunks():
+                hasher.update(chunk)
+            digest = hasher.hexdigest()
+        name = content_name(name, digest)
+        with transaction.atomic():
+            return self._save_locked(name, content)
+
+    def _save_locked(self, name, content):
+        blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+        if blob is not None and blob.refcount == 0:
+            # файл без ссылок мог быть выбран сборщиком: продлеваем паузу,
+            # пока ссылку на него не учтет сохранение модели
+            MediaBlob.objects.filter(pk=blob.pk).update(orphaned_at=timezone.now())
+        if self.exists(name):
+            return name
+
+        # запись во временный файл и атомарное переименование: параллельная
+        # загрузка того же содержимого не увидит недописанный файл
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            if hasattr(content, 'temporary_file_path'):
+                # загрузка уже лежит во временном файле — переносим без копирования
+                os.close(fd)
+                file_move_safe(content.temporary_file_path(), tmp_path, allow_overwrite=True)
+            else:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in content.chunks():
+                        f.write(chunk)
+            os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
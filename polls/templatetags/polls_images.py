@@ -0,0 +1,24 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from polls.images import rendition_urls
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(image, kind, **attrs):
+    """<picture> с WebP- и JPEG-рендициями kind; пока их нет — исходное изображение"""
+    name = getattr(image, 'name', None)
+    if not name:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    urls = rendition_urls(name, kind)
+    if urls is None:
+        return format_html('<img src="{}"{}>', image.url, flatatt(attrs))
+    return format_html(
+        '<picture><source srcset="{}" type="image/webp"><img src="{}"{}></picture>',
+        urls['webp'], urls['jpg'], flatatt(attrs),
+    )
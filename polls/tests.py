@@ -1,3 +1,1356 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import io
+import os
+import re
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+from . import active_questions, async_views, fragments, live, results
+from .account_deletion import process_account_deletions, request_account_deletion
+from .cache import require_shared_cache
+from .forms import QuestionForm
+from .images import AVATAR_RENDITIONS, build_renditions, ready_renditions, rendition_name
+from .media import collect_orphans, serve_media
+from .pagination import KeysetPaginator
+from .results import get_results_snapshot, invalidate_results
+from .vote_buffer import PENDING_KEY, VoteBuffer, _insert_votes, rotated_journals, write_votes
+from .voted import avoted_choices, voted_choice, voted_choices
+from .voting import AlreadyVoted, get_vote_counts, record_vote
+from .models import (
+    AccountDeletion, Choice, ChoiceVoteShard, MediaBlob, MicroblogPost, PostComment, PostLike, Question,
+    QuestionArchive, UserProfile, Vote,
+)
+
+
+class QueryBudgetTests(TestCase):
+    """Точное число SQL-запросов каждого представления.
+
+    Каждое представление проверяется на двух объемах данных: число запросов
+    должно совпадать с бюджетом, так что видно и лишний запрос, и
+    незафиксированное улучшение, и рост вместе с данными (N+1). Управление
+    транзакциями (SAVEPOINT, RELEASE, ROLLBACK TO) не считается. Кэш
+    очищается перед каждым замером, так что считается холодный путь.
+    """
+
+    TRANSACTION_CONTROL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+    SIZES = (3, 30)
+
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'reader-password')
+        self.client.force_login(self.user)
+        self.question = self._question('Основной вопрос', self.user)
+        self.post = MicroblogPost.objects.create(author=self.user, content='Свой пост')
+        self.comment = PostComment.objects.create(author=self.user, post=self.post, content='Свой комментарий')
+        self.size = 0
+
+    def _question(self, text, author):
+        question = Question.objects.create(
+            question_text=text,
+            pub_date=self.now - datetime.timedelta(days=1),
+            expiration_date=self.now + datetime.timedelta(days=7),
+            author=author,
+        )
+        Choice.objects.bulk_create([
+            Choice(question=question, choice_text=f'Вариант {i}') for i in range(4)
+        ])
+        return question
+
+    def grow_to(self, size):
+        """Доводит объем данных до size авторов, опросов, постов, лайков и комментариев"""
+        start = self.size
+        if size <= start:
+            return
+        authors = User.objects.bulk_create([
+            User(username=f'author{i}', password='!') for i in range(start, size)
+        ])
+        UserProfile.objects.bulk_create([UserProfile(user=author) for author in authors])
+
+        choices = list(self.question.choices.all())
+        Vote.objects.bulk_create([
+            Vote(user=author, question=self.question, choice=choices[i % len(choices)])
+            for i, author in enumerate(authors)
+        ])
+        for author in authors:
+            self._question(f'Вопрос {author.username}', author)
+
+        posts = MicroblogPost.objects.bulk_create([
+            MicroblogPost(author=author, content=f'Пост {author.username}') for author in authors
+        ])
+        posts.append(self.post)
+        PostLike.objects.bulk_create([
+            PostLike(user=author, post=post) for author in authors for post in posts[:3]
+        ])
+        PostComment.objects.bulk_create([
+            PostComment(author=author, post=post, content='Комментарий')
+            for author in authors for post in posts[-3:]
+        ])
+        # свои посты и комментарии тоже растут — для профиля и ленты
+        MicroblogPost.objects.bulk_create([
+            MicroblogPost(author=self.user, content=f'Еще пост {i}') for i in range(start, size)
+        ])
+        PostLike.objects.bulk_create([PostLike(user=self.user, post=post) for post in posts[:-1]])
+        self.size = size
+
+    def assertQueryBudget(self, budget, method, url, data=None, **extra):
+        """Выполняет запрос на каждом объеме данных и проверяет число SQL-запросов.
+
+        url и data могут быть вызываемыми объектами — они вызываются после роста
+        данных, чтобы изменяющие представления получали свежий объект на каждом
+        замере.
+        """
+        for size in self.SIZES:
+            self.grow_to(size)
+            target = url() if callable(url) else url
+            payload = data() if callable(data) else data
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(target, payload, **extra)
+            # форма с ошибкой вернула бы 200 и сэкономила запросы на записи
+            self.assertEqual(response.status_code, 302 if method == 'post' else 200, f'{method.upper()} {target}')
+            statements = [
+                query['sql'] for query in queries.captured_queries
+                if not query['sql'].startswith(self.TRANSACTION_CONTROL)
+            ]
+            self.assertEqual(
+                len(statements), budget,
+                f'{method.upper()} {target} при объеме {size}: {len(statements)} запросов, бюджет {budget}\n'
+                + '\n'.join(statements),
+            )
+
+    # опросы
+
+    def test_index(self):
+        self.assertQueryBudget(5, 'get', reverse('polls:index'))
+
+    def test_detail(self):
+        self.assertQueryBudget(5, 'get', reverse('polls:detail', args=(self.question.pk,)))
+
+    def test_results(self):
+        self.assertQueryBudget(4, 'get', reverse('polls:results', args=(self.question.pk,)))
+
+    def test_vote(self):
+        def fresh_question():
+            question = self._question(f'Новый вопрос {self.size}', self.user)
+            self.choice_id = question.choices.first().pk
+            return reverse('polls:vote', args=(question.pk,))
+
+        self.assertQueryBudget(7, 'post', fresh_question, lambda: {'choice': self.choice_id})
+
+    def test_create_question_form(self):
+        self.assertQueryBudget(2, 'get', reverse('polls:create_question'))
+
+    def test_create_question(self):
+        self.assertQueryBudget(5, 'post', reverse('polls:create_question'), {
+            'question_text': 'Новый вопрос',
+            'short_description': 'Кратко',
+            'full_description': 'Подробно',
+            'expiration_date': (self.now + datetime.timedelta(days=7)).strftime('%Y-%m-%dT%H:%M'),
+            'choice1': 'Да',
+            'choice2': 'Нет',
+        })
+
+    # пользователи и профили
+
+    def test_register_form(self):
+        self.client.logout()
+        self.assertQueryBudget(0, 'get', reverse('polls:register'))
+
+    def test_login_form(self):
+        self.client.logout()
+        self.assertQueryBudget(0, 'get', reverse('polls:login'))
+
+    def test_profile(self):
+        self.assertQueryBudget(3, 'get', reverse('polls:profile'))
+
+    def test_delete_profile_confirm(self):
+        self.assertQueryBudget(2, 'get', reverse('polls:delete_profile'))
+
+    def test_user_profile(self):
+        self.assertQueryBudget(5, 'get', reverse('polls:user_profile', args=(self.user.username,)))
+
+    def test_user_profile_anonymous(self):
+        self.client.logout()
+        self.assertQueryBudget(3, 'get', reverse('polls:user_profile', args=(self.user.username,)))
+
+    def test_edit_profile(self):
+        self.assertQueryBudget(2, 'get', reverse('polls:edit_profile', args=(self.user.username,)))
+
+    # микроблог
+
+    def test_microblog_feed(self):
+        self.assertQueryBudget(5, 'get', reverse('polls:microblog_feed'))
+
+    def test_microblog_feed_anonymous(self):
+        self.client.logout()
+        self.assertQueryBudget(2, 'get', reverse('polls:microblog_feed'))
+
+    def test_create_post(self):
+        self.assertQueryBudget(3, 'post', reverse('polls:create_post'), {'content': 'Новый пост'})
+
+    def test_edit_post_form(self):
+        self.assertQueryBudget(3, 'get', reverse('polls:edit_post', args=(self.post.pk,)))
+
+    def test_edit_post(self):
+        self.assertQueryBudget(4, 'post', reverse('polls:edit_post', args=(self.post.pk,)), {'content': 'Правка'})
+
+    def test_delete_post(self):
+        def fresh_post():
+            post = MicroblogPost.objects.create(author=self.user, content='Удаляемый пост')
+            return reverse('polls:delete_post', args=(post.pk,))
+
+        self.assertQueryBudget(6, 'post', fresh_post)
+
+    def test_like_post(self):
+        def fresh_post():
+            post = MicroblogPost.objects.create(author=self.user, content='Пост для лайка')
+            return reverse('polls:like_post', args=(post.pk,))
+
+        self.assertQueryBudget(6, 'post', fresh_post)
+
+    def test_unlike_post(self):
+        def liked_post():
+            post = MicroblogPost.objects.create(author=self.user, content='Пост с лайком', likes_count=1)
+            PostLike.objects.create(user=self.user, post=post)
+            return reverse('polls:like_post', args=(post.pk,))
+
+        self.assertQueryBudget(7, 'post', liked_post)
+
+    def test_add_comment(self):
+        self.assertQueryBudget(
+            5, 'post', reverse('polls:add_comment', args=(self.post.pk,)), {'content': 'Комментарий'}
+        )
+
+    def test_edit_comment_form(self):
+        self.assertQueryBudget(3, 'get', reverse('polls:edit_comment', args=(self.comment.pk,)))
+
+    def test_edit_comment(self):
+        self.assertQueryBudget(
+            4, 'post', reverse('polls:edit_comment', args=(self.comment.pk,)), {'content': 'Правка'}
+        )
+
+    def test_delete_comment(self):
+        def fresh_comment():
+            comment = PostComment.objects.create(author=self.user, post=self.post, content='Удаляемый')
+            return reverse('polls:delete_comment', args=(comment.pk,))
+
+        self.assertQueryBudget(5, 'post', fresh_comment)
+
+
+class ProfileLifecycleTests(TestCase):
+    """Профиль создается одной вставкой и пишется только при изменении своих полей"""
+
+    def test_registration_inserts_one_profile(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('polls:register'), {
+                'username': 'newcomer',
+                'email': 'newcomer@example.com',
+                'password1': 'Very-secret-42',
+                'password2': 'Very-secret-42',
+                'avatar_url': 'https://example.com/avatar.jpg',
+            })
+        self.assertEqual(response.status_code, 302)
+        profile = UserProfile.objects.get(user__username='newcomer')
+        self.assertEqual(profile.avatar.name, 'https://example.com/avatar.jpg')
+        inserts = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "polls_userprofile"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_login_does_not_write_profile(self):
+        User.objects.create_user('regular', password='Very-secret-42')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.client.login(username='regular', password='Very-secret-42'))
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'polls_userprofile' in q['sql']])
+
+    def test_save_writes_only_changed_fields(self):
+        user = User.objects.create_user('regular')
+        profile = UserProfile.objects.get(user=user)
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+        self.assertEqual(len(queries), 0)
+
+        profile.bio = 'Обо мне'
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"avatar"', queries.captured_queries[0]['sql'])
+        self.assertEqual(UserProfile.objects.get(user=user).bio, 'Обо мне')
+
+
+class AuthCacheTests(TestCase):
+    """Сессия и пользователь берутся из кэша и сбрасываются при изменениях"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('regular', password='Very-secret-42')
+        self.client.login(username='regular', password='Very-secret-42')
+        self.client.get(reverse('polls:index'))
+
+    def test_repeated_request_skips_auth_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('polls:index'))
+        self.assertEqual(response.context['user'].pk, self.user.pk)
+        self.assertEqual(len(queries), 0)
+
+    def test_password_change_invalidates_cached_user(self):
+        self.user.set_password('Another-secret-42')
+        self.user.save()
+        response = self.client.get(reverse('polls:profile'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_profile_change_is_visible(self):
+        profile = UserProfile.objects.get(user=self.user)
+        profile.bio = 'Новое описание'
+        profile.save()
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual(response.context['user'].profile.bio, 'Новое описание')
+
+    def test_process_local_cache_is_refused_outside_debug(self):
+        with override_settings(DEBUG=False):
+            with self.assertRaises(ImproperlyConfigured):
+                require_shared_cache()
+            with override_settings(CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'},
+            }):
+                require_shared_cache()
+        with override_settings(DEBUG=True):
+            require_shared_cache()
+
+
+class RenditionTests(TestCase):
+    """Рендиции строятся нужного размера и без метаданных"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'  # Make
+        buffer = io.BytesIO()
+        Image.new('RGB', (1600, 1200), 'red').save(buffer, 'JPEG', exif=exif)
+        self.name = default_storage.save('avatars/photo.jpg', ContentFile(buffer.getvalue()))
+
+    def test_build_renditions(self):
+        self.assertEqual(ready_renditions([self.name], 'feed_avatar'), set())
+        self.assertEqual(build_renditions(self.name, AVATAR_RENDITIONS), 4)
+        self.assertEqual(build_renditions(self.name, AVATAR_RENDITIONS), 0)
+
+        with default_storage.open(rendition_name(self.name, 'feed_avatar', 'jpg')) as f, Image.open(f) as image:
+            self.assertEqual(image.size, (100, 100))
+            self.assertFalse(image.getexif())
+        with default_storage.open(rendition_name(self.name, 'profile_avatar', 'webp')) as f, Image.open(f) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (300, 300)))
+        self.assertEqual(ready_renditions([self.name], 'feed_avatar'), {self.name})
+
+    def test_rendition_names_keep_source_extension(self):
+        self.assertNotEqual(
+            rendition_name('avatars/photo.jpg', 'feed_avatar', 'webp'),
+            rendition_name('avatars/photo.png', 'feed_avatar', 'webp'),
+        )
+
+
+class ContentAddressedMediaTests(TestCase):
+    """Одинаковые загрузки хранятся одним файлом, файл без ссылок удаляется"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload_avatar(self, username):
+        user = User.objects.create_user(username)
+        profile = UserProfile.objects.get(user=user)
+        profile.avatar = SimpleUploadedFile('Photo.JPG', b'same bytes')
+        profile.save()
+        return user, profile.avatar.name
+
+    def test_deduplication_and_collection(self):
+        first, name = self.upload_avatar('first')
+        second, same_name = self.upload_avatar('second')
+        self.assertEqual(name, same_name)
+        self.assertRegex(name, r'^avatars/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+
+        response = serve_media(RequestFactory().get(f'/media/{name}'), name)
+        self.assertIn('immutable', response['Cache-Control'])
+
+        first.delete()
+        self.assertEqual(collect_orphans(datetime.timedelta(0)), 0)
+        second.delete()
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 0)
+        # до истечения паузы файл не трогается
+        self.assertEqual(collect_orphans(), 0)
+        self.assertEqual(collect_orphans(datetime.timedelta(0)), 1)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_reupload_keeps_orphan_from_collection(self):
+        user, name = self.upload_avatar('first')
+        user.delete()
+        MediaBlob.objects.filter(name=name).update(orphaned_at=timezone.now() - datetime.timedelta(days=1))
+        # та же загрузка нашла давно осиротевший файл — пауза начинается заново
+        default_storage.save('avatars/photo.jpg', ContentFile(b'same bytes'))
+        self.assertEqual(collect_orphans(), 0)
+        self.assertTrue(default_storage.exists(name))
+
+
+class ImageUploadTests(TestCase):
+    """Загрузка проверяется и хешируется за один проход при приеме запроса"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('uploader', password='Very-secret-42')
+        self.client.force_login(self.user)
+
+    def image_bytes(self, size=(64, 48)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'blue').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def post_avatar(self, content, name='avatar.png', client=None):
+        return (client or self.client).post(reverse('polls:profile'), {
+            'avatar': SimpleUploadedFile(name, content), 'bio': 'Описание',
+        })
+
+    def test_valid_image(self):
+        response = self.post_avatar(self.image_bytes())
+        self.assertEqual(response.status_code, 302)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertRegex(profile.avatar.name, r'^avatars/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(profile.bio, 'Описание')
+        self.assertTrue(default_storage.exists(profile.avatar.name))
+
+    def test_not_an_image(self):
+        response = self.post_avatar(b'not an image at all', name='avatar.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Файл не является изображением.')
+        self.assertEqual(UserProfile.objects.get(user=self.user).avatar.name, 'avatars/ez.jpg')
+
+    def test_corrupt_image_body(self):
+        content = bytearray(self.image_bytes())
+        # заголовок цел, данные IDAT испорчены — ловит только verify()
+        content[-20] ^= 0xFF
+        response = self.post_avatar(bytes(content))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_limits(self):
+        with override_settings(POLLS_IMAGE_UPLOADS={'MAX_BYTES': 100}):
+            response = self.post_avatar(self.image_bytes())
+        self.assertContains(response, 'Файл больше')
+
+        with override_settings(POLLS_IMAGE_UPLOADS={'MAX_SIDE': 32}):
+            response = self.post_avatar(self.image_bytes())
+        self.assertContains(response, 'Слишком большое изображение: 64×48.')
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_csrf_still_enforced(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        self.assertEqual(self.post_avatar(self.image_bytes(), client=client).status_code, 403)
+
+
+@override_settings(POLLS_ASYNC_VIEWS=True)
+class AsyncViewsTests(TestCase):
+    """Под ASGI страницы отдаются асинхронными представлениями с тем же содержимым"""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.user = User.objects.create_user('reader', password='reader-password')
+        self.question = Question.objects.create(
+            question_text='Асинхронный вопрос',
+            pub_date=now - datetime.timedelta(days=1),
+            expiration_date=now + datetime.timedelta(days=7),
+            author=self.user,
+        )
+        self.choice = Choice.objects.create(question=self.question, choice_text='Да')
+        MicroblogPost.objects.create(author=self.user, content='Асинхронный пост')
+        self.client.force_login(self.user)
+        self.urls = {
+            async_views.index: reverse('polls:index'),
+            async_views.detail: reverse('polls:detail', args=(self.question.pk,)),
+            async_views.results: reverse('polls:results', args=(self.question.pk,)),
+            async_views.microblog_feed: reverse('polls:microblog_feed'),
+            async_views.user_profile: reverse('polls:user_profile', args=(self.user.username,)),
+        }
+
+    async def test_pages_match_sync_views(self):
+        await self.async_client.aforce_login(self.user)
+        for view, url in self.urls.items():
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIs(response.resolver_match.func, view)
+            sync_response = await sync_to_async(self.client.get)(url)
+            self.assertEqual(len(response.content), len(sync_response.content), url)
+
+    async def test_login_required(self):
+        response = await self.async_client.get(self.urls[async_views.detail])
+        self.assertRedirects(
+            response, f'{reverse("polls:login")}?next={self.urls[async_views.detail]}',
+            fetch_redirect_response=False,
+        )
+
+    async def test_detail_shows_user_vote(self):
+        await Vote.objects.acreate(user=self.user, question=self.question, choice=self.choice)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.urls[async_views.detail])
+        self.assertTrue(response.context['has_voted'])
+        self.assertEqual(response.context['user_choice'], self.choice)
+
+    @override_settings(POLLS_ASYNC_VIEWS=False)
+    async def test_can_be_disabled(self):
+        response = await self.async_client.get(reverse('polls:index'))
+        self.assertIsNot(response.resolver_match.func, async_views.index)
+
+
+@override_settings(POLLS_LIVE_RESULTS={'INTERVAL': 0.05, 'HEARTBEAT': 5, 'RETRY_MS': 1000})
+class LiveResultsTests(TestCase):
+    """Поток итогов: ASGI-обертка, проверка доступа и объединение обновлений"""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.user = User.objects.create_user('watcher', password='watcher-password')
+        self.question = Question.objects.create(
+            question_text='Живой вопрос',
+            pub_date=now - datetime.timedelta(days=1),
+            expiration_date=now + datetime.timedelta(days=7),
+            author=self.user,
+        )
+        self.choice = Choice.objects.create(question=self.question, choice_text='Да')
+        self.url = reverse('polls:results_stream', args=(self.question.pk,))
+        self.app = live.LiveResultsApp(self._django_app)
+        # настоящий вызов закрыл бы соединение, в котором идет транзакция теста
+        patcher = mock.patch.object(live, 'close_old_connections')
+        self.close_old_connections = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _django_app(self, scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 299, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _request(self, path, cookie=None, wait_for=1):
+        """Выполняет запрос через LiveResultsApp; (статус, куски тела до wait_for событий)"""
+        headers = [(b'host', b'testserver')]
+        if cookie:
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}={cookie}'.encode()))
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+            'headers': headers, 'client': ('127.0.0.1', 1), 'server': ('testserver', 80),
+        }
+        disconnected = asyncio.Event()
+        messages = []
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            events = [m for m in messages if m.get('body', b'').startswith(b'event:')]
+            if message['type'] == 'http.response.body' and (
+                not message.get('more_body') or len(events) >= wait_for
+            ):
+                disconnected.set()
+
+        await asyncio.wait_for(self.app(scope, receive, send), 5)
+        return messages[0]['status'], [m.get('body', b'').decode() for m in messages[1:]]
+
+    def test_wsgi_stops_event_source(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 204)
+
+    async def test_other_paths_go_to_django(self):
+        status, _ = await self._request(reverse('polls:index'))
+        self.assertEqual(status, 299)
+
+    async def test_anonymous_is_rejected(self):
+        status, _ = await self._request(self.url)
+        self.assertEqual(status, 403)
+
+    async def test_stream_sends_current_results(self):
+        await sync_to_async(self.client.force_login)(self.user)
+        cookie = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        await sync_to_async(record_vote)(self.user, self.question, self.choice)
+        status, chunks = await self._request(self.url, cookie)
+        self.assertEqual(status, 200)
+        self.assertEqual(chunks[0], 'retry: 1000\n\n')
+        self.assertIn('"total":1', chunks[-1])
+        # до и после проверки доступа и после снимка брокера
+        self.assertGreaterEqual(self.close_old_connections.call_count, 3)
+        self.assertFalse(live.broker.has_subscribers(self.question.pk))
+
+    async def test_updates_are_coalesced(self):
+        subscriber = live.broker.subscribe(self.question.pk)
+        try:
+            first = await subscriber.next(1)
+            self.assertEqual(first['total'], 0)
+
+            await sync_to_async(record_vote)(self.user, self.question, self.choice)
+            for _ in range(10):
+                await sync_to_async(invalidate_results)(self.question.pk)
+
+            updates = []
+            while (payload := await subscriber.next(0.3)) is not None:
+                updates.append(payload)
+            self.assertEqual(len(updates), 1)
+            self.assertEqual(updates[0]['total'], 1)
+        finally:
+            live.broker.unsubscribe(self.question.pk, subscriber)
+
+
+class VotedIndexTests(TestCase):
+    """Индекс голосов: одна выборка на пользователя и сброс после голоса"""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.user = User.objects.create_user('voter', password='voter-password')
+        self.questions = [
+            Question.objects.create(
+                question_text=f'Вопрос {i}',
+                pub_date=now - datetime.timedelta(days=1),
+                expiration_date=now + datetime.timedelta(days=7),
+                author=self.user,
+            )
+            for i in range(3)
+        ]
+        self.choices = [Choice.objects.create(question=question, choice_text='Да') for question in self.questions]
+        Vote.objects.create(user=self.user, question=self.questions[0], choice=self.choices[0])
+        self.client.force_login(self.user)
+
+    def test_index_marks_voted_questions(self):
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual(response.context['voted_question_ids'], {self.questions[0].pk})
+        self.assertContains(response, 'Вы голосовали', count=1)
+
+    def test_warm_index_needs_no_vote_queries(self):
+        voted_choices(self.user, [question.pk for question in self.questions])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(voted_choice(self.user, self.questions[0].pk), self.choices[0].pk)
+            self.assertIsNone(voted_choice(self.user, self.questions[1].pk))
+        self.assertEqual(len(queries), 0)
+
+    def test_vote_invalidates_index(self):
+        self.assertIsNone(voted_choice(self.user, self.questions[1].pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.user, self.questions[1], self.choices[1])
+        self.assertEqual(voted_choice(self.user, self.questions[1].pk), self.choices[1].pk)
+
+        response = self.client.get(reverse('polls:detail', args=(self.questions[1].pk,)))
+        self.assertTrue(response.context['has_voted'])
+        self.assertEqual(response.context['user_choice'], self.choices[1])
+
+    @override_settings(POLLS_VOTE_BUFFER={'ENABLED': True})
+    def test_buffered_vote_counts_as_voted(self):
+        voted_choices(self.user, [self.questions[2].pk])
+        cache.set(PENDING_KEY.format(user_id=self.user.pk, question_id=self.questions[2].pk), self.choices[2].pk)
+        self.assertEqual(voted_choice(self.user, self.questions[2].pk), self.choices[2].pk)
+
+    async def test_async_lookup(self):
+        user = await User.objects.aget(pk=self.user.pk)
+        voted = await avoted_choices(user, [question.pk for question in self.questions])
+        self.assertEqual(voted, {self.questions[0].pk: self.choices[0].pk})
+
+
+class ArchiveTests(TestCase):
+    """Закрытые опросы: итоги замораживаются в архиве, голоса можно сжать"""
+
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.user = User.objects.create_superuser('admin', password='admin-password')
+        self.voters = User.objects.bulk_create([User(username=f'voter{i}', password='!') for i in range(3)])
+        self.question = Question.objects.create(
+            question_text='Закрытый вопрос',
+            pub_date=self.now - datetime.timedelta(days=8),
+            expiration_date=self.now - datetime.timedelta(days=1),
+        )
+        self.choices = [Choice.objects.create(question=self.question, choice_text=text) for text in 'АБ']
+        for voter, choice in zip(self.voters, [0, 0, 1]):
+            record_vote(voter, self.question, self.choices[choice])
+        self.open_question = Question.objects.create(
+            question_text='Открытый вопрос',
+            pub_date=self.now - datetime.timedelta(days=1),
+            expiration_date=self.now + datetime.timedelta(days=1),
+        )
+        self.client.force_login(self.user)
+
+    def close(self, *args):
+        call_command('close_expired_polls', *args, stdout=io.StringIO())
+
+    def test_archives_only_expired_questions(self):
+        self.close()
+        archive = QuestionArchive.objects.get()
+        self.assertEqual(archive.question, self.question)
+        self.assertEqual(archive.total, 3)
+        self.assertEqual(archive.choice_counts, [
+            [self.choices[0].pk, 'А', 2], [self.choices[1].pk, 'Б', 1],
+        ])
+        self.close()
+        self.assertEqual(QuestionArchive.objects.count(), 1)
+
+    @override_settings(POLLS_ARCHIVE={'GRACE': 2 * 24 * 60 * 60})
+    def test_grace_period(self):
+        self.close()
+        self.assertFalse(QuestionArchive.objects.exists())
+
+    def test_results_served_from_archive(self):
+        self.close()
+        # архив расходится со счетчиками — страница должна показывать архив
+        Choice.objects.filter(pk=self.choices[1].pk).update(votes=100)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('polls:results', args=(self.question.pk,)))
+        self.assertEqual(response.context['total_votes'], 3)
+        self.assertEqual([item['votes'] for item in response.context['choices_with_percentage']], [2, 1])
+        self.assertNotIn('polls_choice', ' '.join(query['sql'] for query in queries.captured_queries))
+
+    def test_voting_closed_for_everyone(self):
+        self.close()
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.pk,)), {'choice': self.choices[1].pk},
+        )
+        self.assertRedirects(response, reverse('polls:detail', args=(self.question.pk,)), fetch_redirect_response=False)
+        self.assertFalse(Vote.objects.filter(user=self.user).exists())
+
+    def test_archived_detail_skips_voted_lookup(self):
+        voter = self.voters[0]
+        self.assertEqual(voted_choice(voter, self.question.pk), self.choices[0].pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.close('--compact-votes')
+        # индекс сброшен при сжатии и собирается уже без строк Vote
+        self.assertIsNone(voted_choice(voter, self.question.pk))
+        voter.is_superuser = True
+        voter.save()
+        self.client.force_login(voter)
+        response = self.client.get(reverse('polls:detail', args=(self.question.pk,)))
+        self.assertTrue(response.context['archived'])
+        self.assertContains(response, 'Голосование по этому вопросу завершено.')
+        self.assertNotContains(response, 'name="choice"')
+
+    def test_expiration_date_frozen_after_archiving(self):
+        self.assertFalse(QuestionForm(instance=self.question).fields['expiration_date'].disabled)
+        self.close()
+        question = Question.objects.select_related('archive').get(pk=self.question.pk)
+        self.assertTrue(QuestionForm(instance=question).fields['expiration_date'].disabled)
+        question_admin = admin.site._registry[Question]
+        self.assertIn('expiration_date', question_admin.get_readonly_fields(None, question))
+        self.assertNotIn('expiration_date', question_admin.get_readonly_fields(None, self.open_question))
+
+    def test_compact_votes(self):
+        self.close('--compact-votes', '--batch-size', '2')
+        self.assertFalse(Vote.objects.filter(question=self.question).exists())
+        self.assertFalse(ChoiceVoteShard.objects.filter(choice__question=self.question).exists())
+        self.assertEqual([choice.votes for choice in Choice.objects.filter(question=self.question).order_by('pk')], [2, 1])
+        self.assertIsNotNone(QuestionArchive.objects.get().votes_compacted_at)
+
+    @override_settings(POLLS_ASYNC_VIEWS=True)
+    async def test_async_results_from_archive(self):
+        await sync_to_async(self.close)()
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('polls:results', args=(self.question.pk,)))
+        self.assertIs(response.resolver_match.func, async_views.results)
+        self.assertEqual(response.context['total_votes'], 3)
+
+
+class ReconcileCountersTests(TestCase):
+    """Сверка счетчиков голосов, лайков и комментариев с реальными строками"""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.users = User.objects.bulk_create([User(username=f'user{i}', password='!') for i in range(3)])
+        self.question = Question.objects.create(
+            question_text='Вопрос', pub_date=now - datetime.timedelta(days=1),
+            expiration_date=now + datetime.timedelta(days=1),
+        )
+        self.choice = Choice.objects.create(question=self.question, choice_text='Да')
+        for user in self.users:
+            record_vote(user, self.question, self.choice)
+        self.post = MicroblogPost.objects.create(author=self.users[0], content='Пост')
+        PostLike.objects.bulk_create([PostLike(user=user, post=self.post) for user in self.users[:2]])
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile_counters', *args, stdout=out)
+        return out.getvalue()
+
+    def vote_total(self):
+        return get_vote_counts(self.question.pk)[self.choice.pk]
+
+    def test_consistent_counters_untouched(self):
+        self.assertIn('исправлено: 0', self.reconcile())
+        self.assertEqual(self.vote_total(), 3)
+
+    def test_fixes_drift(self):
+        Choice.objects.filter(pk=self.choice.pk).update(votes=7)
+        MicroblogPost.objects.filter(pk=self.post.pk).update(likes_count=-1)
+        self.assertEqual(get_results_snapshot(self.question.pk)['total'], 10)
+
+        output = self.reconcile('--dry-run')
+        self.assertIn(f'Вариант #{self.choice.pk}: 10 -> 3', output)
+        self.assertIn(f'Пост #{self.post.pk}: -1 -> 2', output)
+        self.assertEqual(self.vote_total(), 10)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reconcile('--batch-size', '1')
+        self.assertEqual(self.vote_total(), 3)
+        self.assertEqual(MicroblogPost.objects.get(pk=self.post.pk).likes_count, 2)
+        # снимок итогов пересобран
+        self.assertEqual(get_results_snapshot(self.question.pk)['total'], 3)
+
+    def test_only_votes(self):
+        MicroblogPost.objects.filter(pk=self.post.pk).update(likes_count=5)
+        output = self.reconcile('--only', 'votes')
+        self.assertNotIn('Пост', output)
+        self.assertEqual(MicroblogPost.objects.get(pk=self.post.pk).likes_count, 5)
+
+    def test_comment_counts(self):
+        PostComment.objects.create(author=self.users[1], post=self.post, content='Комментарий')
+        MicroblogPost.objects.filter(pk=self.post.pk).update(comments_count=4)
+        out = io.StringIO()
+        call_command('reconcile_comment_counts', '--dry-run', stdout=out)
+        self.assertIn(f'Пост #{self.post.pk}: 4 -> 1', out.getvalue())
+        self.assertNotIn('Вариант', out.getvalue())
+
+        self.reconcile('--only', 'comments')
+        self.post.refresh_from_db()
+        # likes_count не сверялся
+        self.assertEqual((self.post.comments_count, self.post.likes_count), (1, 0))
+
+    def test_archived_questions_skipped(self):
+        QuestionArchive.objects.create(question=self.question, total=3, choice_counts=[[self.choice.pk, 'Да', 3]])
+        Vote.objects.filter(question=self.question).delete()
+        self.reconcile()
+        self.assertEqual(self.vote_total(), 3)
+
+
+@override_settings(POLLS_ACCOUNT_DELETION={'BACKGROUND': False})
+class AccountDeletionTests(TestCase):
+    """Удаление аккаунта: сразу деактивация, затем пачки с поправкой счетчиков"""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.user = User.objects.create_user('leaving', password='leaving-password')
+        self.other = User.objects.create_user('staying', password='staying-password')
+
+        def question(author):
+            question = Question.objects.create(
+                question_text='Вопрос', author=author, pub_date=now - datetime.timedelta(days=1),
+                expiration_date=now + datetime.timedelta(days=1),
+            )
+            return question, Choice.objects.create(question=question, choice_text='Да')
+
+        self.question, self.choice = question(self.other)
+        record_vote(self.user, self.question, self.choice)
+        record_vote(self.other, self.question, self.choice)
+        self.own_question, own_choice = question(self.user)
+        record_vote(self.other, self.own_question, own_choice)
+
+        self.post = MicroblogPost.objects.create(author=self.other, content='Чужой пост', likes_count=2, comments_count=3)
+        PostLike.objects.bulk_create([PostLike(user=user, post=self.post) for user in (self.user, self.other)])
+        PostComment.objects.bulk_create(
+            [PostComment(author=self.user, post=self.post, content='Мой')] * 2
+            + [PostComment(author=self.other, post=self.post, content='Чужой')]
+        )
+        own_post = MicroblogPost.objects.create(author=self.user, content='Свой пост', likes_count=1, comments_count=1)
+        PostLike.objects.create(user=self.other, post=own_post)
+        PostComment.objects.create(author=self.other, post=own_post, content='Под своим')
+
+    def test_view_deactivates_and_logs_out(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('polls:delete_profile'))
+        self.assertRedirects(response, reverse('polls:index'), fetch_redirect_response=False)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(AccountDeletion.objects.filter(user=self.user).exists())
+        self.assertNotIn('_auth_user_id', self.client.session)
+        # строки остаются до фоновой обработки
+        self.assertTrue(Vote.objects.filter(user=self.user).exists())
+
+    def test_deleted_account_disappears_right_away(self):
+        profile_url = reverse('polls:user_profile', args=(self.user.username,))
+        self.assertEqual(self.client.get(profile_url).status_code, 200)
+        self.assertContains(self.client.get(reverse('polls:microblog_feed')), 'Свой пост')
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('polls:delete_profile'))
+        # строки еще не удалены, но ни профиля, ни постов уже не видно
+        self.assertTrue(MicroblogPost.objects.filter(author=self.user).exists())
+        self.assertEqual(self.client.get(profile_url).status_code, 404)
+        feed = self.client.get(reverse('polls:microblog_feed'))
+        self.assertNotContains(feed, 'Свой пост')
+        self.assertContains(feed, 'Чужой пост')
+
+    def test_other_sessions_stop_authenticating(self):
+        other_client = Client()
+        other_client.force_login(self.user)
+        request_account_deletion(self.user)
+        response = other_client.get(reverse('polls:profile'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_batches_keep_counters_consistent(self):
+        self.assertEqual(get_results_snapshot(self.question.pk)['total'], 2)
+        self.assertIn(self.own_question.pk, voted_choices(self.other, [self.own_question.pk]))
+        request_account_deletion(self.user)
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('process_account_deletions', '--batch-size', '1', stdout=out)
+        self.assertIn('Удалено аккаунтов: 1', out.getvalue())
+
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(AccountDeletion.objects.exists())
+        self.assertEqual(list(MicroblogPost.objects.all()), [self.post])
+        self.assertFalse(Question.objects.filter(pk=self.own_question.pk).exists())
+
+        self.assertEqual(get_vote_counts(self.question.pk), {self.choice.pk: 1})
+        self.assertEqual(get_results_snapshot(self.question.pk)['total'], 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (1, 1))
+        self.assertEqual(voted_choices(self.other, [self.own_question.pk]), {})
+
+        out = io.StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertNotIn('->', out.getvalue())
+
+    def test_blob_refcounts_released(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with override_settings(MEDIA_ROOT=media.name):
+            profile = UserProfile.objects.get(user=self.user)
+            profile.avatar = SimpleUploadedFile('me.png', b'avatar bytes')
+            profile.save()
+            self.own_question.image = SimpleUploadedFile('q.png', b'question bytes')
+            self.own_question.save()
+            # та же картинка у чужого вопроса — ее ссылка должна остаться
+            self.question.image = SimpleUploadedFile('q.png', b'question bytes')
+            self.question.save()
+            avatar, image = profile.avatar.name, self.own_question.image.name
+
+            request_account_deletion(self.user)
+            with self.captureOnCommitCallbacks(execute=True):
+                process_account_deletions(batch_size=1)
+
+        self.assertEqual(MediaBlob.objects.get(name=avatar).refcount, 0)
+        self.assertEqual(MediaBlob.objects.get(name=image).refcount, 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (1, 1))
+        self.assertEqual(get_vote_counts(self.question.pk), {self.choice.pk: 1})
+
+    @override_settings(POLLS_VOTE_BUFFER={'ENABLED': True, 'PENDING_TTL': 300})
+    def test_waits_for_buffered_votes(self):
+        request_account_deletion(self.user)
+        # голоса, принятые буфером до деактивации, еще могут быть не записаны
+        self.assertEqual(process_account_deletions(), 0)
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+
+        AccountDeletion.objects.update(requested_at=timezone.now() - datetime.timedelta(seconds=301))
+        self.assertEqual(process_account_deletions(), 1)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+
+class VoteBufferWriteTests(TestCase):
+    """Запись буферизованных голосов: отброс мертвых записей и счетчики по вставленным строкам"""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.users = User.objects.bulk_create([User(username=f'buffered{i}', password='!') for i in range(3)])
+        self.question = Question.objects.create(
+            question_text='Вопрос', pub_date=now - datetime.timedelta(days=1),
+            expiration_date=now + datetime.timedelta(days=1),
+        )
+        self.choice = Choice.objects.create(question=self.question, choice_text='Да')
+        other = Question.objects.create(question_text='Другой', expiration_date=now + datetime.timedelta(days=1))
+        self.foreign_choice = Choice.objects.create(question=other, choice_text='Чужой')
+
+    def entry(self, user_id, choice_id=None, question_id=None):
+        return (user_id, question_id or self.question.pk), choice_id or self.choice.pk
+
+    def test_dead_entries_are_dropped(self):
+        gone = User.objects.create_user('gone')
+        gone_id = gone.pk
+        gone.delete()
+        created = write_votes([
+            self.entry(self.users[0].pk),
+            self.entry(gone_id),
+            self.entry(self.users[1].pk, choice_id=self.foreign_choice.pk),
+            self.entry(self.users[2].pk, question_id=10 ** 6),
+        ])
+        self.assertEqual(created, 1)
+        self.assertEqual(get_vote_counts(self.question.pk), {self.choice.pk: 1})
+
+    def test_conflicting_rows_are_not_counted(self):
+        record_vote(self.users[0], self.question, self.choice)
+        votes = [Vote(user=user, question=self.question, choice=self.choice) for user in self.users]
+        inserted = _insert_votes(votes)
+        self.assertEqual([vote.user_id for vote in inserted], [user.pk for user in self.users[1:]])
+
+        self.assertEqual(write_votes([self.entry(self.users[0].pk)]), 0)
+        self.assertEqual(get_vote_counts(self.question.pk), {self.choice.pk: 1})
+
+    def test_command_replays_only_rotated_journals(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        journal = os.path.join(directory.name, 'votes.log')
+        record = '{{"u": {}, "q": {}, "c": {}}}\n'
+        with open(journal, 'w') as live_journal:
+            live_journal.write(record.format(self.users[0].pk, self.question.pk, self.choice.pk))
+        with open(f'{journal}.1.flushing', 'w') as rotated:
+            rotated.write(record.format(self.users[1].pk, self.question.pk, self.choice.pk))
+
+        call_command('flush_vote_journal', '--journal', journal, stdout=io.StringIO())
+        self.assertEqual(list(Vote.objects.values_list('user_id', flat=True)), [self.users[1].pk])
+        self.assertTrue(os.path.exists(journal))
+        self.assertEqual(rotated_journals(journal), [])
+
+    def test_flush_tolerates_journal_removed_by_command(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        journal = os.path.join(directory.name, 'votes.log')
+        buffer = VoteBuffer(journal, 60, 500, 300)
+        self.addCleanup(buffer._journal.close)
+        # ротированный журнал уже переиграла и удалила flush_vote_journal
+        buffer._rotated = [f'{journal}.1.flushing']
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer._rotated, [])
+
+
+class ResultsSnapshotTests(TestCase):
+    """Снимок итогов не теряет голос, пришедший во время его сборки"""
+
+    def test_vote_during_rebuild_is_not_lost(self):
+        cache.clear()
+        user = User.objects.create_user('racer')
+        question = Question.objects.create(
+            question_text='Гонка', expiration_date=timezone.now() + datetime.timedelta(days=1),
+        )
+        choice = Choice.objects.create(question=question, choice_text='Да')
+        snapshot_rows = results._snapshot_rows
+
+        def rows_then_vote(question_id):
+            rows = list(snapshot_rows(question_id))
+            with self.captureOnCommitCallbacks(execute=True):
+                record_vote(user, question, choice)
+            return rows
+
+        with mock.patch.object(results, '_snapshot_rows', rows_then_vote):
+            self.assertEqual(get_results_snapshot(question.pk)['total'], 0)
+        self.assertEqual(get_results_snapshot(question.pk)['total'], 1)
+
+
+@override_settings(POLLS_METRICS={'ENABLED': True, 'TOKEN': 'scrape-token'})
+class MetricsAccessTests(TestCase):
+    """/metrics — по токену сборщика или сотрудникам, независимо от адреса клиента"""
+
+    def setUp(self):
+        self.url = reverse('polls:metrics')
+
+    def test_local_address_alone_is_rejected(self):
+        self.assertEqual(self.client.get(self.url, REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    def test_token(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    @override_settings(POLLS_METRICS={'ENABLED': True, 'TOKEN': None})
+    def test_no_token_configured(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_staff(self):
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class KeysetPaginationTests(TestCase):
+    """Курсорная пагинация: обход в обе стороны, равные created_at, битые курсоры"""
+
+    def setUp(self):
+        author = User.objects.create_user('author')
+        base = timezone.now()
+        # у трех средних постов одинаковый created_at — порядок решает id
+        offsets = [0, 1, 1, 1, 2]
+        self.posts = []
+        for offset in offsets:
+            post = MicroblogPost.objects.create(author=author, content=f'Пост {offset}')
+            MicroblogPost.objects.filter(pk=post.pk).update(created_at=base + datetime.timedelta(minutes=offset))
+            self.posts.append(post.pk)
+        self.expected = [self.posts[4], self.posts[3], self.posts[2], self.posts[1], self.posts[0]]
+        self.paginator = KeysetPaginator(MicroblogPost.objects.all(), 2)
+
+    def ids(self, page):
+        return [post.pk for post in page]
+
+    def test_forward_and_back(self):
+        pages, page = [], self.paginator.get_page(None)
+        self.assertFalse(page.has_previous())
+        self.assertIsNone(page.previous_cursor)
+        while True:
+            pages.append(self.ids(page))
+            if not page.has_next():
+                break
+            page = self.paginator.get_page(page.next_cursor)
+        self.assertEqual(pages, [self.expected[0:2], self.expected[2:4], self.expected[4:]])
+        self.assertIsNone(page.next_cursor)
+
+        # обратно к первой странице по курсорам «назад»
+        back = []
+        while page.has_previous():
+            page = self.paginator.get_page(page.previous_cursor)
+            back.append(self.ids(page))
+            self.assertTrue(page.has_next())
+        self.assertEqual(back, [self.expected[2:4], self.expected[0:2]])
+
+    def test_equal_created_at_split_across_pages(self):
+        first = self.paginator.get_page(None)
+        second = self.paginator.get_page(first.next_cursor)
+        # граница страницы проходит внутри группы с одинаковым created_at
+        self.assertEqual(self.ids(first)[1], self.posts[3])
+        self.assertEqual(self.ids(second), [self.posts[2], self.posts[1]])
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        forged = [
+            'not-a-cursor',
+            base64.urlsafe_b64encode(b'["x","2020-01-01T00:00:00",1]').decode(),
+            base64.urlsafe_b64encode(b'["n","2020-01-01T00:00:00","1"]').decode(),
+            base64.urlsafe_b64encode(b'["n","not a date",1]').decode(),
+            base64.urlsafe_b64encode(b'{"n":1}').decode(),
+        ]
+        for token in forged:
+            page = self.paginator.get_page(token)
+            self.assertEqual(self.ids(page), self.expected[:2], token)
+            self.assertFalse(page.has_previous(), token)
+
+    def test_empty_and_single_page(self):
+        page = KeysetPaginator(MicroblogPost.objects.none(), 2).get_page(None)
+        self.assertEqual((len(page), page.has_next(), page.has_previous()), (0, False, False))
+        page = KeysetPaginator(MicroblogPost.objects.all(), 10).get_page(None)
+        self.assertEqual(self.ids(page), self.expected)
+        self.assertFalse(page.has_next())
+
+
+class PostCardCacheTests(TestCase):
+    """Карточка из кэша не выдает одному зрителю данные другого"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.viewer = User.objects.create_user('viewer')
+        self.post = MicroblogPost.objects.create(author=self.owner, content='Пост владельца', likes_count=1, comments_count=1)
+        PostLike.objects.create(user=self.owner, post=self.post)
+        self.comment = PostComment.objects.create(author=self.owner, post=self.post, content='Комментарий владельца')
+        self.owner_links = [
+            reverse('polls:edit_post', args=(self.post.pk,)),
+            reverse('polls:delete_post', args=(self.post.pk,)),
+            reverse('polls:edit_comment', args=(self.comment.pk,)),
+            reverse('polls:delete_comment', args=(self.comment.pk,)),
+        ]
+        self.comment_form = f'action="{reverse("polls:add_comment", args=(self.post.pk,))}"'
+
+    def card(self, url, user=None):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # скрипт лайков ниже карточек сам содержит оба сердечка
+        return response.content.decode().split('<script>')[0]
+
+    def check_viewers(self, url):
+        with mock.patch.object(fragments, 'render_to_string', wraps=fragments.render_to_string) as render:
+            owner_html = self.card(url, self.owner)
+            viewer_html = self.card(url, self.viewer)
+            anonymous_html = self.card(url)
+        # карточка отрендерена один раз, остальные зрители получили ее из кэша
+        self.assertEqual(render.call_count, 1)
+
+        for link in self.owner_links:
+            self.assertIn(link, owner_html)
+            self.assertNotIn(link, viewer_html)
+            self.assertNotIn(link, anonymous_html)
+        self.assertIn('❤️', owner_html)
+        self.assertNotIn('❤️', viewer_html)
+        self.assertNotIn('❤️', anonymous_html)
+        self.assertIn(self.comment_form, viewer_html)
+        self.assertNotIn(self.comment_form, anonymous_html)
+        # CSRF-токен в карточке — свой у каждого зрителя
+        owner_token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', owner_html)[1]
+        self.assertNotIn(owner_token, viewer_html)
+        self.assertNotIn(owner_token, anonymous_html)
+
+    def test_feed(self):
+        self.check_viewers(reverse('polls:microblog_feed'))
+
+    def test_profile(self):
+        url = reverse('polls:user_profile', args=(self.owner.username,))
+        with mock.patch.object(fragments, 'render_to_string', wraps=fragments.render_to_string) as render:
+            owner_html = self.card(url, self.owner)
+            viewer_html = self.card(url, self.viewer)
+        self.assertEqual(render.call_count, 1)
+        self.assertIn(self.owner_links[0], owner_html)
+        self.assertNotIn(self.owner_links[0], viewer_html)
+
+
+class ActiveQuestionsCacheTests(TestCase):
+    """Кэш активных опросов живет до ближайшей границы и сбрасывается после коммита"""
+
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.active = Question.objects.create(
+            question_text='Активный', pub_date=self.now - datetime.timedelta(days=1),
+            expiration_date=self.now + datetime.timedelta(hours=2),
+        )
+        self.upcoming = Question.objects.create(
+            question_text='Будущий', pub_date=self.now + datetime.timedelta(hours=1),
+            expiration_date=self.now + datetime.timedelta(days=1),
+        )
+
+    def active_at(self, moment):
+        with mock.patch.object(active_questions.timezone, 'now', return_value=moment):
+            return [question.pk for question in active_questions.get_active_questions()]
+
+    def test_ttl_ends_at_next_boundary(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.assertEqual(self.active_at(self.now), [self.active.pk])
+        (_, (_, valid_until), timeout), _ = cache_set.call_args
+        # ближайшая граница — публикация будущего вопроса, а не истечение активного
+        self.assertEqual(valid_until, self.upcoming.pub_date)
+        self.assertEqual(timeout, 60 * 60)
+
+        # до границы список берется из кэша, после — пересобирается без инвалидации
+        Question.objects.filter(pk=self.active.pk).update(question_text='Без сигнала')
+        self.assertEqual(self.active_at(self.now + datetime.timedelta(minutes=59)), [self.active.pk])
+        self.assertEqual(
+            self.active_at(self.now + datetime.timedelta(hours=1, seconds=1)),
+            [self.upcoming.pk, self.active.pk],
+        )
+        # следующая граница — истечение активного вопроса
+        self.assertEqual(self.active_at(self.now + datetime.timedelta(hours=2, seconds=1)), [self.upcoming.pk])
+
+    def test_save_invalidates_on_commit(self):
+        self.assertEqual(self.active_at(self.now), [self.active.pk])
+        with self.captureOnCommitCallbacks() as callbacks:
+            Question.objects.filter(pk=self.upcoming.pk).update(pub_date=self.now - datetime.timedelta(hours=1))
+            self.upcoming.refresh_from_db()
+            self.upcoming.save()
+            # до коммита версия прежняя — кэш еще не сброшен
+            self.assertEqual(self.active_at(self.now), [self.active.pk])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.active_at(self.now), [self.upcoming.pk, self.active.pk])
+
+
+class RecordVoteTests(TestCase):
+    """Голос и шардированный счетчик пишутся вместе; повторный голос ничего не меняет"""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.question = Question.objects.create(
+            question_text='Вопрос', pub_date=now - datetime.timedelta(days=1),
+            expiration_date=now + datetime.timedelta(days=1),
+        )
+        self.choices = [Choice.objects.create(question=self.question, choice_text=text) for text in 'АБ']
+        self.users = User.objects.bulk_create([User(username=f'voter{i}', password='!') for i in range(20)])
+
+    def counters(self):
+        return (
+            list(Choice.objects.order_by('pk').values_list('votes', flat=True)),
+            sorted(ChoiceVoteShard.objects.values_list('choice_id', 'shard', 'count')),
+        )
+
+    @override_settings(POLLS_VOTE_COUNTER_SHARDS=4)
+    def test_shard_totals_add_up(self):
+        for i, user in enumerate(self.users):
+            record_vote(user, self.question, self.choices[i % 3 == 0])
+        counts = get_vote_counts(self.question.pk)
+        self.assertEqual(counts, {self.choices[0].pk: 13, self.choices[1].pk: 7})
+        self.assertEqual(sum(counts.values()), Vote.objects.count())
+        # голоса разошлись по шардам, база не трогается
+        self.assertGreater(ChoiceVoteShard.objects.filter(choice=self.choices[0]).count(), 1)
+        self.assertLessEqual(ChoiceVoteShard.objects.values('shard').distinct().count(), 4)
+        self.assertEqual(self.counters()[0], [0, 0])
+
+    def test_duplicate_vote_changes_nothing(self):
+        record_vote(self.users[0], self.question, self.choices[0])
+        before = self.counters()
+        with self.assertRaises(AlreadyVoted):
+            record_vote(self.users[0], self.question, self.choices[1])
+        self.assertEqual(self.counters(), before)
+        self.assertEqual(get_vote_counts(self.question.pk), {self.choices[0].pk: 1, self.choices[1].pk: 0})
+        self.assertEqual(list(Vote.objects.values_list('choice_id', flat=True)), [self.choices[0].pk])
+
+    def test_admin_inline_shows_totals_read_only(self):
+        record_vote(self.users[0], self.question, self.choices[0])
+        Choice.objects.filter(pk=self.choices[0].pk).update(votes=5)
+        self.client.force_login(User.objects.create_superuser('root', password='root-password'))
+        response = self.client.get(reverse('admin:polls_question_change', args=(self.question.pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'name="choices-0-votes"')
+        inline = response.context['inline_admin_formsets'][0]
+        totals = [inline.opts.vote_total(form.instance) for form in inline.formset.forms[:2]]
+        self.assertEqual(totals, [6, 0])
+
+
+class CreateProfilesTests(TestCase):
+    """Команда create_profiles дозаполняет недостающие профили ровно по одному"""
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        call_command('create_profiles', *args, stdout=out)
+        return out.getvalue()
+
+    def test_backfill_is_idempotent(self):
+        with_profile = User.objects.create_user('registered')
+        # bulk_create обходит сигнал, создающий профиль
+        missing = User.objects.bulk_create([User(username=f'imported{i}', password='!') for i in range(5)])
+        self.assertEqual(UserProfile.objects.filter(user__in=missing).count(), 0)
+
+        output = self.run_command('--chunk-size', '2')
+        self.assertIn('Проверено пользователей: 6, создано профилей: 5', output)
+        for user in [with_profile, *missing]:
+            self.assertEqual(UserProfile.objects.filter(user=user).count(), 1)
+
+        output = self.run_command('--chunk-size', '2')
+        self.assertIn('создано профилей: 0', output)
+        self.assertEqual(UserProfile.objects.count(), 6)
+
+    def test_after_id(self):
+        missing = User.objects.bulk_create([User(username=f'imported{i}', password='!') for i in range(3)])
+        self.run_command('--after-id', str(missing[0].pk))
+        self.assertFalse(UserProfile.objects.filter(user=missing[0]).exists())
+        self.assertEqual(UserProfile.objects.filter(user__in=missing[1:]).count(), 2)
@@ -1,6 +1,6 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import live, metrics, views
 
 
 app_name = 'polls'
@@ -9,6 +9,8 @@ urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    # живые итоги (server-sent events, только под ASGI)
+    path('<int:pk>/results/stream/', live.results_stream, name='results_stream'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
 
     #для пользователей
@@ -34,5 +36,8 @@ urlpatterns = [
     path('microblog/comment/<int:comment_id>/edit/', views.edit_comment, name='edit_comment'),
     path('microblog/comment/<int:comment_id>/delete/', views.delete_comment, name='delete_comment'),
 
-    path('microblog/', views.microblog_feed, name='microblog')
+    path('microblog/', views.microblog_feed, name='microblog'),
+
+    # метрики для Prometheus
+    path('metrics/', metrics.metrics_view, name='metrics'),
 ]
@@ -1,16 +1,24 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.urls import reverse
 from django.views import generic
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login, logout, authenticate
 from django.utils import timezone
 from django.contrib import messages
 from django.db import transaction
+from django.db.models import F
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import Question, Choice, Vote, UserProfile
+from .models import Question, Choice, UserProfile
+from .account_deletion import request_account_deletion
 from .forms import CustomUserCreationForm, UserProfileForm, QuestionForm
+from .voting import AlreadyVoted, record_vote
+from .archive import get_archive, is_archived, question_results
+from .active_questions import get_active_questions
+from .vote_buffer import buffering_enabled, submit_vote
+from .voted import voted_choice, voted_choices
+from .uploads import image_uploads
 from django.contrib.auth.models import User
 
 
@@ -38,6 +46,7 @@ def register(request):
     return render(request, 'polls/register.html', {'form': form})
 
 # Профиль пользователя
+@image_uploads
 @login_required
 def profile(request):
     """Просмотр и редактирование профиля пользователя"""
@@ -57,14 +66,16 @@ def profile(request):
 @login_required
 def delete_profile(request):
     if request.method == 'POST':
-        # Удаление пользователя
-        request.user.delete()
+        # аккаунт деактивируется сразу, его строки удаляются в фоне пачками
+        request_account_deletion(request.user)
+        logout(request)
         messages.success(request, 'Ваш профиль был успешно удален.')
         return redirect('polls:index')
     return render(request, 'polls/delete_profile_confirm.html')
 
 
 # вопрос
+@image_uploads
 @login_required
 def create_question(request):
     if request.method == 'POST':
@@ -103,14 +114,18 @@ class IndexView(generic.ListView):
     context_object_name = 'latest_question_list'
 
     def get_queryset(self):
-
-        now = timezone.now()
         if self.request.user.is_superuser:
-            return Question.objects.all()
-        return Question.objects.filter(
-            expiration_date__gt=now,
-            pub_date__lte=now
-        ).order_by('-pub_date')
+            return Question.objects.select_related('author')
+        # список активных опросов из кэша, живущего до ближайшей pub_date/expiration_date
+        return get_active_questions()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # вопросы, по которым пользователь уже голосовал, — из индекса голосов
+        context['voted_question_ids'] = set(voted_choices(
+            self.request.user, [question.pk for question in context['latest_question_list']]
+        ))
+        return context
 
 
 # Детали вопроса
@@ -119,30 +134,32 @@ class DetailView(LoginRequiredMixin, generic.DetailView):
     template_name = 'polls/detail.html'
 
     def get_queryset(self):
+        questions = Question.objects.select_related('archive').prefetch_related('choices')
         if self.request.user.is_superuser:
-            return Question.objects.all()
+            return questions
         now = timezone.now()
-        return Question.objects.filter(
+        return questions.filter(
             expiration_date__gt=now,
             pub_date__lte=now
         )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        question = self.get_object()
 
-        # голосовал ли уже пользователь
-        has_voted = Vote.objects.filter(
-            user=self.request.user,
-            question=question
-        ).exists()
-
-        context['has_voted'] = has_voted
-
-        if has_voted:
-            # Если уже голосовал, показываем результаты
-            user_vote = Vote.objects.get(user=self.request.user, question=question)
-            context['user_choice'] = user_vote.choice
+        # у архивного вопроса строки Vote могли быть сжаты — голос не ищем
+        context['archived'] = is_archived(self.object)
+        if context['archived']:
+            context['has_voted'] = False
+            return context
+
+        # голосовал ли уже пользователь — по индексу голосов, без запросов к Vote
+        choice_id = voted_choice(self.request.user, self.object.pk)
+        context['has_voted'] = choice_id is not None
+        if choice_id is not None:
+            # Если уже голосовал, показываем его выбор из уже загруженных вариантов
+            context['user_choice'] = next(
+                (choice for choice in self.object.choices.all() if choice.pk == choice_id), None
+            )
 
         return context
 
@@ -152,29 +169,16 @@ class ResultsView(LoginRequiredMixin, generic.DetailView):
     model = Question
     template_name = 'polls/results.html'
 
+    def get_queryset(self):
+        return Question.objects.select_related('archive')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        question = self.get_object()
-
-
-        votes = Vote.objects.filter(question=question)
-        total_votes = votes.count()
-
-        choices_with_percentage = []
-        for choice in question.choices.all():
-            if total_votes > 0:
-                percentage = (choice.votes / total_votes) * 100
-            else:
-                percentage = 0
 
-            choices_with_percentage.append({
-                'choice': choice,
-                'percentage': round(percentage, 1),
-                'votes': choice.votes
-            })
-
-        context['choices_with_percentage'] = choices_with_percentage
-        context['total_votes'] = total_votes
+        # итоги закрытого опроса — из архива, остальных — из кэшированного снимка
+        snapshot = question_results(self.object)
+        context['choices_with_percentage'] = snapshot['choices']
+        context['total_votes'] = snapshot['total']
 
         return context
 
@@ -182,46 +186,43 @@ class ResultsView(LoginRequiredMixin, generic.DetailView):
 # Голосование
 @login_required
 def vote(request, question_id):
-    question = get_object_or_404(Question, pk=question_id)
+    question = get_object_or_404(Question.objects.select_related('archive'), pk=question_id)
 
-    # активен ли еще вопрос
-    if not question.is_active() and not request.user.is_superuser:
+    # активен ли еще вопрос; итоги архивного вопроса заморожены для всех
+    if get_archive(question) is not None or (not question.is_active() and not request.user.is_superuser):
         messages.error(request, 'Голосование по этому вопросу завершено.')
         return redirect('polls:detail', pk=question.id)
 
-    #голосовал ли уже пользователь
-    if Vote.objects.filter(user=request.user, question=question).exists():
-        messages.error(request, 'Вы уже голосовали по этому вопросу.')
-        return redirect('polls:detail', pk=question.id)
-
     try:
         selected_choice = question.choices.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
+    except (KeyError, ValueError, Choice.DoesNotExist):
         messages.error(request, 'Вы не сделали выбор.')
         return render(request, 'polls/detail.html', {
             'question': question,
             'error_message': 'Вы не сделали выбор'
         })
 
-    # счетчик голосов
-    selected_choice.votes += 1
-    selected_choice.save()
-
-    # голос пользователя
-    Vote.objects.create(
-        user=request.user,
-        question=question,
-        choice=selected_choice
-    )
+    # голос и счетчик пишутся одной транзакцией, повтор отсекает unique_together
+    try:
+        if buffering_enabled():
+            submit_vote(request.user, question, selected_choice)
+        else:
+            record_vote(request.user, question, selected_choice)
+    except AlreadyVoted:
+        messages.error(request, 'Вы уже голосовали по этому вопросу.')
+        return redirect('polls:detail', pk=question.id)
 
     messages.success(request, 'Ваш голос учтен!')
     return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
 
 # Добавить импорты
-from .models import MicroblogPost, PostLike, PostComment
+from .models import MicroblogPost, PostComment
 from .forms import MicroblogPostForm, PostCommentForm
-from django.core.paginator import Paginator
+from .feed import mark_liked, visible_authors, visible_posts, with_feed_relations
+from .fragments import render_post_cards
+from .likes import toggle_like
+from .pagination import KeysetPaginator
 
 
 # Добавить представления для микроблогов
@@ -245,11 +246,12 @@ def create_post(request):
 
 def microblog_feed(request):
     """Лента постов (главная страница микроблогов)"""
-    posts_list = MicroblogPost.objects.all().select_related('author')
-    paginator = Paginator(posts_list, 10)  # 10 постов на странице
+    posts_list = with_feed_relations(visible_posts(MicroblogPost.objects.all()))
+    paginator = KeysetPaginator(posts_list, 10)  # 10 постов на странице
 
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    page_obj.object_list = mark_liked(page_obj.object_list, request.user)
+    render_post_cards(page_obj.object_list, request, 'feed')
 
     comment_form = PostCommentForm()
 
@@ -292,29 +294,16 @@ def delete_post(request, post_id):
 @login_required
 def like_post(request, post_id):
     """Лайк/анлайк поста"""
-    post = get_object_or_404(MicroblogPost, id=post_id)
+    get_object_or_404(MicroblogPost.objects.only('pk'), id=post_id)
 
-    # Проверяем, лайкал ли уже пользователь этот пост
-    like_exists = PostLike.objects.filter(user=request.user, post=post).exists()
-
-    if like_exists:
-        # Убираем лайк
-        PostLike.objects.filter(user=request.user, post=post).delete()
-        post.likes_count -= 1
-        liked = False
-    else:
-        # Ставим лайк
-        PostLike.objects.create(user=request.user, post=post)
-        post.likes_count += 1
-        liked = True
-
-    post.save()
+    # вставка лайка, при конфликте unique_together — удаление
+    liked, likes_count = toggle_like(request.user, post_id)
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         # AJAX запрос
         return JsonResponse({
             'liked': liked,
-            'likes_count': post.likes_count
+            'likes_count': likes_count
         })
 
     return redirect(request.META.get('HTTP_REFERER', 'polls:microblog_feed'))
@@ -331,7 +320,9 @@ def add_comment(request, post_id):
             comment = form.save(commit=False)
             comment.author = request.user
             comment.post = post
-            comment.save()
+            with transaction.atomic():
+                comment.save()
+                MicroblogPost.objects.filter(pk=post.pk).update(comments_count=F('comments_count') + 1)
             messages.success(request, 'Комментарий добавлен!')
 
     return redirect(request.META.get('HTTP_REFERER', 'polls:microblog_feed'))
@@ -360,7 +351,9 @@ def delete_comment(request, comment_id):
     comment = get_object_or_404(PostComment, id=comment_id, author=request.user)
 
     if request.method == 'POST':
-        comment.delete()
+        with transaction.atomic():
+            comment.delete()
+            MicroblogPost.objects.filter(pk=comment.post_id).update(comments_count=F('comments_count') - 1)
         messages.success(request, 'Комментарий удален!')
 
     return redirect(request.META.get('HTTP_REFERER', 'polls:microblog_feed'))
@@ -368,14 +361,14 @@ def delete_comment(request, comment_id):
 
 def user_profile(request, username):
     """Профиль пользователя с его постами"""
-    user = get_object_or_404(User, username=username)
+    user = get_object_or_404(visible_authors(User.objects.all()), username=username)
     user_profile_obj = user.profile
 
     posts_list = MicroblogPost.objects.filter(author=user)
-    paginator = Paginator(posts_list, 10)
+    paginator = KeysetPaginator(posts_list, 10)
 
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    render_post_cards(page_obj.object_list, request, 'profile')
 
     context = {
         'profile_user': user,
@@ -406,6 +399,7 @@ def edit_profile(request):
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect
 
+@image_uploads
 @login_required
 def edit_profile(request, username):
     if request.user.username != username:
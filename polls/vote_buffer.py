@@ -0,0 +1,323 @@
+"""Буферизованная (write-behind) запись голосов.
+
+Включается настройкой POLLS_VOTE_BUFFER['ENABLED']. Принятый голос сначала
+дописывается в журнал на диске (с fsync), и только потом пользователю
+отвечают «голос учтен». Фоновый поток раз в FLUSH_INTERVAL_MS или при
+накоплении FLUSH_MAX_VOTES голосов пишет их в БД одной транзакцией:
+один bulk_create строк Vote и один UPDATE счетчика на каждый вариант.
+
+Журнал ротируется перед каждым сбросом и удаляется только после коммита,
+поэтому после падения процесса неподтвержденные в БД голоса
+переигрываются из журнала. Повторная запись безопасна: голоса, уже
+лежащие в БД, отбрасываются по (user, question), а счетчики растут только
+на действительно вставленные строки. Голоса удаленных с тех пор
+пользователей, вопросов и вариантов отбрасываются. Журнал принадлежит
+одному процессу: при нескольких воркерах у каждого должен быть свой
+JOURNAL_PATH.
+"""
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from .background import PeriodicFlusher
+from .models import Choice, Question, Vote
+from .results import apply_vote
+from .voting import AlreadyVoted, bump_choice_counter
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL_MS': 200,
+    'FLUSH_MAX_VOTES': 500,
+    'JOURNAL_PATH': os.path.join(settings.BASE_DIR, 'var', 'vote_journal.log'),
+    'PENDING_TTL': 300,
+}
+
+PENDING_KEY = 'polls:vote-pending:{user_id}:{question_id}'
+
+
+def buffer_settings():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_VOTE_BUFFER', {})}
+
+
+def buffering_enabled():
+    return buffer_settings()['ENABLED']
+
+
+class VoteBuffer:
+    """Очередь принятых, но еще не записанных в БД голосов"""
+
+    def __init__(self, journal_path, flush_interval, max_votes, pending_ttl):
+        self.journal_path = str(journal_path)
+        self.max_votes = max_votes
+        self.pending_ttl = pending_ttl
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (user_id, question_id) -> choice_id
+        self._pending = {}
+        self._queue = []
+        self._rotated = []
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        self._replay()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._flusher = PeriodicFlusher('vote-buffer', flush_interval, self.flush)
+        if self._queue:
+            self._flusher.start()
+
+    def pending_choice(self, user_id, question_id):
+        """choice_id голоса, ожидающего записи, или None"""
+        return self._pending.get((user_id, question_id))
+
+    def submit(self, user_id, question_id, choice_id):
+        """Принимает голос; после возврата он гарантированно есть в журнале"""
+        key = (user_id, question_id)
+        record = json.dumps({'u': user_id, 'q': question_id, 'c': choice_id})
+
+        with self._lock:
+            if key in self._pending:
+                raise AlreadyVoted
+            # общий для процессов набор ожидающих голосов — через кэш
+            pending_key = PENDING_KEY.format(user_id=user_id, question_id=question_id)
+            if not cache.add(pending_key, choice_id, self.pending_ttl):
+                raise AlreadyVoted
+            try:
+                self._journal.write(record + '\n')
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            except OSError:
+                cache.delete(pending_key)
+                raise
+            self._pending[key] = choice_id
+            self._queue.append(key)
+            full = len(self._queue) >= self.max_votes
+
+        self._flusher.start()
+        if full:
+            self._flusher.wake()
+
+    def flush(self):
+        """Записывает накопленные голоса в БД; возвращает число новых строк Vote"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._queue:
+                    # журналы без ожидающих голосов больше не нужны
+                    # команда flush_vote_journal могла удалить их раньше
+                    for path in self._rotated:
+                        _remove_journal(path)
+                    self._rotated = []
+                    return 0
+                batch = [(key, self._pending[key]) for key in self._queue]
+                self._queue = []
+                self._rotate_journal()
+
+            try:
+                created = self._write(batch)
+            except Exception:
+                # голоса остаются в журнале и в очереди до следующей попытки
+                with self._lock:
+                    self._queue[:0] = [key for key, _ in batch]
+                raise
+
+            with self._lock:
+                for key, _ in batch:
+                    self._pending.pop(key, None)
+                rotated, self._rotated = self._rotated, []
+            _forget_pending(batch)
+            for path in rotated:
+                _remove_journal(path)
+            return created
+
+    def _write(self, batch):
+        return write_votes(batch)
+
+    def _rotate_journal(self):
+        """Переименовывает текущий журнал; вызывается под self._lock"""
+        if getattr(self, '_journal', None) is None:
+            return
+        self._journal.close()
+        rotated = f'{self.journal_path}.{time.time_ns()}.flushing'
+        os.replace(self.journal_path, rotated)
+        self._rotated.append(rotated)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _replay(self):
+        """Поднимает в очередь голоса из журналов, оставшихся после падения"""
+        paths = rotated_journals(self.journal_path)
+        if os.path.exists(self.journal_path):
+            rotated = f'{self.journal_path}.{time.time_ns()}.flushing'
+            os.replace(self.journal_path, rotated)
+            paths.append(rotated)
+
+        for path in paths:
+            for key, choice_id in _read_journal(path):
+                if key not in self._pending:
+                    self._pending[key] = choice_id
+                    self._queue.append(key)
+            self._rotated.append(path)
+
+
+def rotated_journals(journal_path):
+    return sorted(glob.glob(glob.escape(str(journal_path)) + '.*.flushing'))
+
+
+def _read_journal(path):
+    """((user_id, question_id), choice_id) из журнала"""
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # недописанная последняя строка — голос не был подтвержден
+                continue
+            yield (record['u'], record['q']), record['c']
+
+
+def _remove_journal(path):
+    # журнал мог уже записать и удалить flush_vote_journal
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def _forget_pending(batch):
+    cache.delete_many([
+        PENDING_KEY.format(user_id=user_id, question_id=question_id)
+        for (user_id, question_id), _ in batch
+    ])
+
+
+def _live_entries(batch):
+    """Голоса, у которых еще существуют пользователь, вопрос и вариант этого вопроса.
+
+    Голос удаленного с тех пор объекта нарушил бы внешний ключ при коммите
+    и навсегда заблокировал бы всю пачку.
+    """
+    users = set(get_user_model().objects.filter(
+        pk__in={user_id for (user_id, _), _ in batch}
+    ).values_list('pk', flat=True))
+    questions = set(Question.objects.filter(
+        pk__in={question_id for (_, question_id), _ in batch}
+    ).values_list('pk', flat=True))
+    choices = dict(Choice.objects.filter(
+        pk__in={choice_id for _, choice_id in batch}
+    ).values_list('pk', 'question_id'))
+    return [
+        ((user_id, question_id), choice_id) for (user_id, question_id), choice_id in batch
+        if user_id in users and question_id in questions and choices.get(choice_id) == question_id
+    ]
+
+
+def _insert_votes(votes):
+    """Вставляет голоса; возвращает действительно вставленные.
+
+    Обычно хватает одного bulk_create. Если параллельный record_vote успел
+    записать голос той же пары (user, question), пачка вставляется по одной
+    строке и конфликтующие строки пропускаются.
+    """
+    try:
+        with transaction.atomic():
+            Vote.objects.bulk_create(votes)
+        return votes
+    except IntegrityError:
+        pass
+    inserted = []
+    for vote in votes:
+        try:
+            with transaction.atomic():
+                vote.save(force_insert=True)
+        except IntegrityError:
+            continue
+        inserted.append(vote)
+    return inserted
+
+
+def write_votes(batch):
+    """Записывает пачку [((user_id, question_id), choice_id)] в БД; возвращает число новых строк Vote"""
+    batch = _live_entries(batch)
+    user_ids = {user_id for (user_id, _), _ in batch}
+    question_ids = {question_id for (_, question_id), _ in batch}
+
+    with transaction.atomic():
+        existing = set(
+            Vote.objects.filter(user_id__in=user_ids, question_id__in=question_ids)
+            .values_list('user_id', 'question_id')
+        )
+        votes = []
+        for (user_id, question_id), choice_id in batch:
+            if (user_id, question_id) in existing:
+                continue
+            existing.add((user_id, question_id))
+            votes.append(Vote(user_id=user_id, question_id=question_id, choice_id=choice_id))
+
+        votes = _insert_votes(votes)
+        # счетчики — только по вставленным строкам
+        per_choice = {}
+        for vote in votes:
+            key = (vote.question_id, vote.choice_id)
+            per_choice[key] = per_choice.get(key, 0) + 1
+        for (_, choice_id), amount in per_choice.items():
+            bump_choice_counter(choice_id, amount)
+
+    for (question_id, choice_id), amount in per_choice.items():
+        apply_vote(question_id, choice_id, amount)
+    # bulk_create не отправляет post_save — индекс голосов сбрасываем сами
+    from .voted import invalidate_voted
+    for user_id in {vote.user_id for vote in votes}:
+        invalidate_voted(user_id)
+    return len(votes)
+
+
+def flush_rotated_journals(journal_path):
+    """Записывает голоса из ротированных журналов (*.flushing) и удаляет их.
+
+    Текущий журнал не трогается: в него, возможно, пишет живой воркер, и
+    переименовать его из другого процесса — значит потерять голоса, которые
+    воркер подтвердит после этого. Текущий журнал упавшего воркера
+    переиграет сам воркер при следующем запуске.
+    """
+    paths = rotated_journals(journal_path)
+    pending = {}
+    for path in paths:
+        for key, choice_id in _read_journal(path):
+            pending.setdefault(key, choice_id)
+    batch = list(pending.items())
+    created = write_votes(batch)
+    _forget_pending(batch)
+    for path in paths:
+        _remove_journal(path)
+    return created
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                options = buffer_settings()
+                _buffer = VoteBuffer(
+                    journal_path=options['JOURNAL_PATH'],
+                    flush_interval=options['FLUSH_INTERVAL_MS'] / 1000,
+                    max_votes=options['FLUSH_MAX_VOTES'],
+                    pending_ttl=options['PENDING_TTL'],
+                )
+    return _buffer
+
+
+def submit_vote(user, question, choice):
+    """Буферизованный аналог voting.record_vote"""
+    from .voted import voted_choice
+
+    if voted_choice(user, question.pk) is not None:
+        raise AlreadyVoted
+    get_vote_buffer().submit(user.pk, question.pk, choice.pk)
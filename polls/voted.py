@@ -0,0 +1,108 @@
+"""Индекс голосов пользователя: {question_id: choice_id}.
+
+Весь индекс пользователя загружается одним запросом и кэшируется под
+версионным ключом, после чего «голосовал ли и за что» для одного вопроса
+или целой страницы вопросов — поиск в словаре. Голос, его удаление и
+запись буферизованных голосов поднимают версию после коммита, чтобы
+параллельный запрос не закэшировал индекс без нового голоса. Голоса,
+еще ждущие записи в буфере (vote_buffer), добавляются к индексу из их
+ключей в кэше.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .async_utils import aslist
+from .cache_versions import aget_version, bump_version, get_version
+from .models import Vote
+from .vote_buffer import PENDING_KEY, buffering_enabled
+
+
+VERSION_KEY = 'polls:voted:ver:{user_id}'
+INDEX_KEY = 'polls:voted:{user_id}:v{version}'
+
+
+def voted_index_ttl():
+    return getattr(settings, 'POLLS_VOTED_INDEX_TTL', 60 * 60)
+
+
+def invalidate_voted(user_id):
+    bump_version(VERSION_KEY.format(user_id=user_id))
+
+
+def _index_queryset(user_id):
+    return Vote.objects.filter(user_id=user_id).values_list('question_id', 'choice_id')
+
+
+def get_voted_index(user_id):
+    """{question_id: choice_id} по записанным в БД голосам пользователя"""
+    key = INDEX_KEY.format(user_id=user_id, version=get_version(VERSION_KEY.format(user_id=user_id)))
+    index = cache.get(key)
+    if index is None:
+        index = dict(_index_queryset(user_id))
+        cache.set(key, index, voted_index_ttl())
+    return index
+
+
+async def aget_voted_index(user_id):
+    version = await aget_version(VERSION_KEY.format(user_id=user_id))
+    key = INDEX_KEY.format(user_id=user_id, version=version)
+    index = await cache.aget(key)
+    if index is None:
+        index = dict(await aslist(_index_queryset(user_id)))
+        await cache.aset(key, index, voted_index_ttl())
+    return index
+
+
+def _pending_keys(user_id, question_ids):
+    if not buffering_enabled():
+        return {}
+    return {
+        PENDING_KEY.format(user_id=user_id, question_id=question_id): question_id
+        for question_id in question_ids
+    }
+
+
+def _select(index, question_ids, pending_keys, pending):
+    voted = {question_id: index[question_id] for question_id in question_ids if question_id in index}
+    for key, choice_id in pending.items():
+        voted.setdefault(pending_keys[key], choice_id)
+    return voted
+
+
+def voted_choices(user, question_ids):
+    """{question_id: choice_id} для вопросов из question_ids, за которые голосовал user"""
+    if not user.is_authenticated:
+        return {}
+    question_ids = list(question_ids)
+    pending_keys = _pending_keys(user.pk, question_ids)
+    pending = cache.get_many(list(pending_keys)) if pending_keys else {}
+    return _select(get_voted_index(user.pk), question_ids, pending_keys, pending)
+
+
+async def avoted_choices(user, question_ids):
+    if not user.is_authenticated:
+        return {}
+    question_ids = list(question_ids)
+    pending_keys = _pending_keys(user.pk, question_ids)
+    pending = await cache.aget_many(list(pending_keys)) if pending_keys else {}
+    return _select(await aget_voted_index(user.pk), question_ids, pending_keys, pending)
+
+
+def voted_choice(user, question_id):
+    """choice_id голоса user по вопросу или None"""
+    return voted_choices(user, [question_id]).get(question_id)
+
+
+async def avoted_choice(user, question_id):
+    return (await avoted_choices(user, [question_id])).get(question_id)
+
+
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def invalidate_on_vote_change(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_voted, instance.user_id))
@@ -0,0 +1,83 @@
+"""Запись голосов и шардированные счетчики вариантов ответа.
+
+Голос (строка Vote) и увеличение счетчика выполняются в одной транзакции.
+Счетчик горячего варианта размазан по N строкам ChoiceVoteShard, поэтому
+параллельные голоса за один вариант не ждут друг друга на одной строке.
+При чтении шарды суммируются с базовым значением Choice.votes.
+"""
+import random
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Choice, ChoiceVoteShard, Vote
+
+
+DEFAULT_COUNTER_SHARDS = 8
+
+
+class AlreadyVoted(Exception):
+    """Пользователь уже голосовал по этому вопросу"""
+
+
+def shard_count():
+    return max(1, getattr(settings, 'POLLS_VOTE_COUNTER_SHARDS', DEFAULT_COUNTER_SHARDS))
+
+
+def bump_choice_counter(choice_id, amount=1, shard=None):
+    """Увеличивает счетчик варианта на amount в случайном (или заданном) шарде"""
+    if shard is None:
+        shard = random.randrange(shard_count())
+
+    updated = ChoiceVoteShard.objects.filter(
+        choice_id=choice_id, shard=shard
+    ).update(count=F('count') + amount)
+    if updated:
+        return
+
+    # Шарда еще нет — создаем; если его успел создать параллельный запрос,
+    # просто повторяем UPDATE
+    try:
+        with transaction.atomic():
+            ChoiceVoteShard.objects.create(choice_id=choice_id, shard=shard, count=amount)
+    except IntegrityError:
+        ChoiceVoteShard.objects.filter(
+            choice_id=choice_id, shard=shard
+        ).update(count=F('count') + amount)
+
+
+def record_vote(user, question, choice):
+    """Атомарно сохраняет голос и увеличивает счетчик выбранного варианта.
+
+    Повторный голос отсекается ограничением unique_together на Vote,
+    без отдельного запроса exists(); в этом случае поднимается AlreadyVoted.
+    """
+    from .results import apply_vote
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                vote = Vote.objects.create(user=user, question=question, choice=choice)
+        except IntegrityError:
+            raise AlreadyVoted
+        bump_choice_counter(choice.pk)
+        transaction.on_commit(partial(apply_vote, question.pk, choice.pk))
+    return vote
+
+
+def with_vote_totals(choices):
+    """Добавляет к queryset вариантов аннотацию vote_total (база + шарды)"""
+    return choices.annotate(
+        vote_total=F('votes') + Coalesce(Sum('vote_shards__count'), 0)
+    )
+
+
+def get_vote_counts(question_id):
+    """Словарь {choice_id: число голосов} для вопроса за один запрос"""
+    return dict(
+        with_vote_totals(Choice.objects.filter(question_id=question_id))
+        .values_list('id', 'vote_total')
+    )